@@ -9,6 +9,7 @@ __version__ = "0.1.2"
 # --------------------------------------------------------------------------- #
 # Import libraries
 # --------------------------------------------------------------------------- #
+import argparse
 import logging
 import os
 import sys
@@ -17,6 +18,10 @@ import sys
 cwd = os.getcwd()
 if cwd not in sys.path:
     sys.path.insert(0, cwd)
+# the modules of this package import each other by their plain names
+package_dir = os.path.dirname(os.path.abspath(__file__))
+if package_dir not in sys.path:
+    sys.path.insert(0, package_dir)
 
 import simplesignals as sisi
 
@@ -25,14 +30,38 @@ import simplesignals as sisi
 # Declare package globals
 # --------------------------------------------------------------------------- #
 import model
-import view
+# the view module is imported in main() so headless rendering never loads Qt
 log = logging.getLogger(__name__)
+# the doll files next to this package, so the commands work from any directory
+default_dolldir = os.path.join(os.path.dirname(package_dir), "dollfiles")
+profile_startup = False  # print a startup profile; set in __main__.py
 
 
 # --------------------------------------------------------------------------- #
 # Define functions
 # --------------------------------------------------------------------------- #
+def init_signals():
+    '''Registers the simple signals and channels used by the models.'''
+    sisi.add_signals("doll drawn", "draw doll", "export doll",
+                     "set state", "set style", "state changed",
+                     "update dial state")
+    sisi.add_channels("editor")
+
+
+def create_editor(dolldir=None, **kwargs):
+    '''Returns a new editor model and prints its startup profile if asked.'''
+    import profiling
+    if dolldir is None:
+        dolldir = default_dolldir
+    editor = model.MPaperdollEditor(dolldir, profile=profile_startup,
+                                    **kwargs)
+    if profile_startup:
+        print(profiling.format_report(editor.startup_profile))
+    return editor
+
+
 def main():
+    import view
     # set up logging
     logging.basicConfig(level=logging.WARNING)
     log.info("")
@@ -41,12 +70,9 @@ def main():
     log.info("")
     log.info("cwd %s", os.getcwd())
     # initialize signalling
-    sisi.add_signals("doll drawn", "draw doll", "export doll",
-                     "set state", "set style", "state changed",
-                     "update dial state")
-    sisi.add_channels("editor")
+    init_signals()
     # create editor model
-    model.editor = model.MPaperdollEditor()
+    model.editor = create_editor()
     # create Qt GUI
     view.version = __version__
     view.app = view.Application(sys.argv)
@@ -56,16 +82,244 @@ def main():
     view.gui.resizeToScreen(width=0.8, height=0.8)
     view.gui.centerOnScreen()
     view.gui.show()
-    # define initial state and draw the doll
-    for dial in model.editor.dials.values():
-        dial.change_value(dial.value + 1)
-        dial.change_value(dial.value - 1)
+    # draw the doll in its default state
     sisi.send(signal="draw doll")
 #    print_state()
     # show GUI with Qt
     sys.exit(view.app.exec_())
 
+def render(argv=None):
+    '''Renders one SVG file per line of a JSON lines state file without Qt.
+
+    Usage: python -m paperdoll render STATEFILE OUTDIR [--dolldir DIR]
+                                                   [--processes N]
+                                                   [--numeric float]
+                                                   [--trace-draw FILE]
+                                                   [--png SIZES]
+    '''
+    import batch
+    import profiling
+    parser = argparse.ArgumentParser(prog="paperdoll render",
+        description="Render one SVG file per state dictionary.")
+    parser.add_argument("statefile",
+                        help="JSON lines file with one state dict per line")
+    parser.add_argument("outdir", help="directory for the SVG files")
+    parser.add_argument("--dolldir", default=default_dolldir,
+                        help="directory with the doll description files")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="number of render processes, 0 for one per CPU")
+    parser.add_argument("--numeric", choices=("decimal", "float"),
+                        default="decimal",
+                        help="number type used for coordinates")
+    parser.add_argument("--trace-draw", metavar="FILE", default=None,
+                        help="write the draw stages as a Chrome trace; " +
+                        "only used with one process")
+    parser.add_argument("--png", metavar="SIZES", default=None,
+                        help="also write PNG images with these comma " +
+                        "separated sizes in pixels, e.g. 64,256")
+    args = parser.parse_args(argv)
+    pngsizes = None
+    if args.png:
+        import raster
+        try:
+            pngsizes = raster.parse_sizes(args.png)
+        except ValueError as err:
+            parser.error(str(err))
+    # set up logging
+    logging.basicConfig(level=logging.WARNING)
+    log.info("Paperdoll batch renderer")
+    # initialize signalling
+    init_signals()
+    # create editor model
+    model.editor = create_editor(args.dolldir, numeric=args.numeric)
+    # render the dolls
+    states = batch.read_states(args.statefile)
+    if args.processes == 1:
+        profiles = [] if args.trace_draw else None
+        paths = batch.render_states(model.editor, states, args.outdir,
+                                    profiles=profiles, pngsizes=pngsizes)
+        if profiles is not None:
+            profiling.write_chrome_trace(profiles, args.trace_draw)
+            log.info("Wrote draw trace to %s", args.trace_draw)
+    else:
+        if args.trace_draw:
+            log.warning("--trace-draw is ignored with several processes")
+        processes = args.processes or None
+        paths, report = batch.render_pool(model.editor, states, args.outdir,
+                                          processes=processes,
+                                          dolldir=args.dolldir,
+                                          pngsizes=pngsizes)
+        print(batch.format_report(report))
+    log.info("Rendered %s dolls to %s", len(paths), args.outdir)
+    return paths
+
+
+def bake(argv=None):
+    '''Bakes the frame atlas of each doll description file.
+
+    Usage: python -m paperdoll bake [--dolldir DIR]
+    '''
+    import atlas
+    parser = argparse.ArgumentParser(prog="paperdoll bake",
+        description="Store every integer state of all animations.")
+    parser.add_argument("--dolldir", default=default_dolldir,
+                        help="directory with the doll description files")
+    args = parser.parse_args(argv)
+    # set up logging
+    logging.basicConfig(level=logging.INFO)
+    # initialize signalling
+    init_signals()
+    # create editor model
+    editor = create_editor(args.dolldir)
+    # release old atlases so they can be overwritten
+    for frameatlas in set(editor.atlases.values()):
+        frameatlas.close()
+    editor.atlases = {}
+    paths = []
+    for filename in sorted(editor.dollfiles):
+        path = atlas.bake(editor.dollfiles[filename])
+        if path is not None:
+            paths.append(path)
+    return paths
+
+
+def check_float(argv=None):
+    '''Checks that decimal and float mode draw the reference SVG.
+
+    Usage: python -m paperdoll check-float STATEFILE [--dolldir DIR]
+    '''
+    import batch
+    parser = argparse.ArgumentParser(prog="paperdoll check-float",
+        description="Compare the SVG of both numeric modes with " +
+        "the reference drawn by svglib alone.")
+    parser.add_argument("statefile",
+                        help="JSON lines file with one state dict per line")
+    parser.add_argument("--dolldir", default=default_dolldir,
+                        help="directory with the doll description files")
+    args = parser.parse_args(argv)
+    # set up logging
+    logging.basicConfig(level=logging.WARNING)
+    # initialize signalling
+    init_signals()
+    states = list(batch.read_states(args.statefile))
+    differences = batch.compare_numeric(args.dolldir, states)
+    print("%s of %s states differ" % (len(differences), len(states)))
+    if differences:
+        sys.exit(1)
+
+
+def pack(argv=None):
+    '''Converts a JSON lines state file to a binary doll state file.
+
+    Usage: python -m paperdoll pack STATEFILE DOLLFILE [--dolldir DIR]
+    '''
+    import batch
+    import dollstate
+    parser = argparse.ArgumentParser(prog="paperdoll pack",
+        description="Write one doll state record per state dictionary. " +
+        "Records store animation states and style overrides; dial values " +
+        "are intentionally not stored, they follow from the states.")
+    parser.add_argument("statefile",
+                        help="JSON lines file with one state dict per line")
+    parser.add_argument("dollfile", help="binary doll state file to write")
+    parser.add_argument("--dolldir", default=default_dolldir,
+                        help="directory with the doll description files")
+    args = parser.parse_args(argv)
+    # set up logging
+    logging.basicConfig(level=logging.WARNING)
+    # initialize signalling
+    init_signals()
+    model.editor = create_editor(args.dolldir)
+    with open(args.dollfile, "wb") as f:
+        recordwriter = dollstate.writer(model.editor, f)
+        for statedict in batch.read_states(args.statefile):
+            batch.apply_state(model.editor, statedict)
+            recordwriter.write(dollstate.capture(model.editor))
+    log.info("Packed %s dolls into %s", recordwriter.count, args.dollfile)
+    return recordwriter.count
+
+
+def archive(argv=None):
+    '''Renders every doll of a doll state file into a tar or zip archive.
+
+    Usage: python -m paperdoll archive DOLLFILE ARCHIVE [--dolldir DIR]
+                                                        [--format zip]
+                                                        [--shard-size N]
+    '''
+    import dollstate
+    parser = argparse.ArgumentParser(prog="paperdoll archive",
+        description="Render the dolls of a doll state file into an archive.")
+    parser.add_argument("dollfile", help="binary doll state file")
+    parser.add_argument("archive", help="archive file to write")
+    parser.add_argument("--dolldir", default=default_dolldir,
+                        help="directory with the doll description files")
+    parser.add_argument("--format", choices=("tar", "tar.gz", "zip"),
+                        default="tar", help="archive format")
+    parser.add_argument("--shard-size", type=int, default=None,
+                        help="dolls per archive, written as numbered shards")
+    args = parser.parse_args(argv)
+    # set up logging
+    logging.basicConfig(level=logging.WARNING)
+    # initialize signalling
+    init_signals()
+    model.editor = create_editor(args.dolldir)
+    with open(args.dollfile, "rb") as f:
+        reader = dollstate.RecordReader(f)
+        count = dollstate.export_archive(model.editor, reader,
+                                         reader.animations, args.archive,
+                                         fmt=args.format,
+                                         shard_size=args.shard_size)
+    print("%s dolls written to %s" % (count, args.archive))
+    return count
+
+
+def bench(argv=None):
+    '''Benchmarks startup, drawing and export of the doll files.
+
+    Usage: python -m paperdoll bench [--dolldir DIR] [--repeat N]
+                                     [--baseline FILE] [--save-baseline FILE]
+    '''
+    import benchmark
+    parser = argparse.ArgumentParser(prog="paperdoll bench",
+        description="Benchmark startup, drawing and export.")
+    parser.add_argument("--dolldir", default=default_dolldir,
+                        help="directory with the doll description files")
+    parser.add_argument("--repeat", type=int, default=10,
+                        help="number of timed runs per benchmark")
+    parser.add_argument("--sweep", type=int, default=20,
+                        help="number of random states in the state sweep")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the random state sweep")
+    parser.add_argument("--baseline", default=None,
+                        help="JSON report to compare the results with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slowdown of the median, 0.2 for 20%%")
+    parser.add_argument("--save-baseline", default=None,
+                        help="store the results as JSON report")
+    args = parser.parse_args(argv)
+    # set up logging
+    logging.basicConfig(level=logging.WARNING)
+    # initialize signalling
+    init_signals()
+    report = benchmark.run(args.dolldir, repeat=args.repeat,
+                           sweep=args.sweep, seed=args.seed)
+    baseline = None
+    if args.baseline is not None:
+        baseline = benchmark.read_report(args.baseline)
+    print(benchmark.format_report(report, baseline))
+    if args.save_baseline is not None:
+        benchmark.write_report(report, args.save_baseline)
+    if baseline is not None:
+        regressions = benchmark.compare(report, baseline, args.tolerance)
+        for name, old, new in regressions:
+            print("%s regressed from %.2f ms to %.2f ms" %
+                  (name, old * 1000, new * 1000))
+        if regressions:
+            sys.exit(1)
+
+
 def print_state():
+    import view
     print("editor state:")
     for animname, animstate in sorted(model.editor.state.items()):
         print("  ", animname, animstate)
@@ -11,6 +11,11 @@ import sys
 
 # add the current working directory to the python path
 sys.path.insert(0, os.getcwd())
+# "python path/to/paperdoll" runs this file without importing the package,
+# so the directory containing the package is added as well
+package_parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if package_parent not in sys.path:
+    sys.path.insert(0, package_parent)
 
 import paperdoll
 
@@ -24,5 +29,17 @@ log = logging.getLogger(__name__)
 # --------------------------------------------------------------------------- #
 # Execute
 # --------------------------------------------------------------------------- #
-log.info("Launching from __main__")
-paperdoll.main()
+# render worker processes import this module too, so only launch when run
+if __name__ == "__main__":
+    log.info("Launching from __main__")
+    if "--profile-startup" in sys.argv:
+        sys.argv.remove("--profile-startup")
+        paperdoll.profile_startup = True
+    commands = {"render": paperdoll.render, "bake": paperdoll.bake,
+                "check-float": paperdoll.check_float,
+                "bench": paperdoll.bench, "pack": paperdoll.pack,
+                "archive": paperdoll.archive}
+    if len(sys.argv) > 1 and sys.argv[1] in commands:
+        commands[sys.argv[1]](sys.argv[2:])
+    else:
+        paperdoll.main()
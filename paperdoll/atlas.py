@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+'''Paperdoll editor frame atlas module.
+
+A frame atlas stores the point coordinates of every integer state of the
+animations of one description file. It is baked once and saved next to the
+description file, e.g. linedoll.atlas next to linedoll.xml. At startup the
+editor memory-maps the atlas and rebuilds frames by writing the stored
+coordinates into a copy of a template frame instead of interpolating.
+'''
+
+
+# --------------------------------------------------------------------------- #
+# Import libraries
+# --------------------------------------------------------------------------- #
+import array
+import json
+import logging
+import mmap
+import struct
+import sys
+
+import svglib
+
+import dollcache
+from geometry import (coordinate, flat_points, geometry_elements,
+                      set_flat_points)
+
+
+# --------------------------------------------------------------------------- #
+# Define classes
+# --------------------------------------------------------------------------- #
+class FrameAtlas(object):
+    '''A memory-mapped frame atlas file.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.templates = {}  # maps animation names to template frames
+        with path.open("rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.data = None
+        try:
+            self.read_header()
+        except Exception:
+            if self.data is not None:
+                self.data.release()
+            self.mmap.close()
+            raise
+
+    def read_header(self):
+        '''Reads the header and checks that the data holds all entries.'''
+        if self.mmap[:len(magic)] != magic:
+            raise ValueError("%s is not a frame atlas" % self.path.name)
+        headersize, = struct.unpack_from("<I", self.mmap, len(magic))
+        headerstart = len(magic) + 4
+        header = json.loads(
+            self.mmap[headerstart:headerstart + headersize].decode("utf-8"))
+        self.byteorder = header["byteorder"]
+        self.sources = header["sources"]
+        self.entries = header["animations"]
+        datastart = data_offset(headersize)
+        self.data = memoryview(self.mmap)[datastart:].cast("d")
+        for name, entry in self.entries.items():
+            frames = entry["last"] - entry["first"] + 1
+            if entry["offset"] + frames * entry["count"] > len(self.data):
+                raise ValueError("the frames of '%s' are truncated" % name)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def has_frame(self, name, state):
+        '''Returns True if the atlas contains this state of the animation.'''
+        entry = self.entries.get(name, None)
+        if entry is None or not isinstance(state, int):
+            return False
+        return entry["first"] <= state <= entry["last"]
+
+    def points(self, name, state):
+        '''Returns the flat x, y coordinates of a frame as a memoryview.'''
+        entry = self.entries[name]
+        count = entry["count"]
+        start = entry["offset"] + (state - entry["first"]) * count
+        return self.data[start:start + count]
+
+    def frame(self, name, state, anim):
+        '''Returns a new frame of the animation anim for this state.'''
+        template = self.templates.get(name, None)
+        if template is None:
+            template = anim.get_frame(self.entries[name]["first"])
+            self.templates[name] = template
+        frame = template.copy()
+        set_flat_points(frame, self.points(name, state))
+        return frame
+
+    def is_current(self, descfile):
+        '''Returns True if the atlas was baked from the current files.'''
+        return (self.byteorder == sys.byteorder and
+                self.sources == source_signature(descfile))
+
+    def close(self):
+        '''Releases the frame data and unmaps the file.'''
+        self.data.release()
+        self.mmap.close()
+
+
+# --------------------------------------------------------------------------- #
+# Define functions
+# --------------------------------------------------------------------------- #
+def atlas_path(descfile):
+    '''Returns the path of the atlas file of a description file.'''
+    return descfile.path.with_suffix(".atlas")
+
+
+def source_signature(descfile):
+    '''Returns the content hashes of all inputs of a description file.
+
+    Descriptions import and conform to geometry of the other description
+    files, so all description and SVG files of the doll directory are
+    hashed, together with the svglib sources and the atlas format version.
+    '''
+    descpaths = sorted(descfile.path.parent.glob("*.xml"))
+    files = {path.name: dollcache.file_digest(path)
+             for path in dollcache.source_paths(descpaths)}
+    return {"version": format_version,
+            "files": files,
+            "library": dollcache.library_signature()}
+
+
+def is_exact(frame):
+    '''Returns True if float64 keeps every coordinate of a frame exactly.
+
+    Decimal coordinates with more significant digits than a float64 holds
+    would be rounded differently after a round-trip through the atlas.
+    '''
+    for geomelem in geometry_elements(frame):
+        for cmd in geomelem.commands:
+            for point in cmd.parameters:
+                for value in (point.x, point.y):
+                    if coordinate(float(value), value) != value:
+                        return False
+    return True
+
+
+def has_delta(frame):
+    '''Returns True if an element of a frame conforms to a target.'''
+    return any(getattr(geomelem, "delta", None) is not None
+               for geomelem in geometry_elements(frame))
+
+
+def data_offset(headersize):
+    '''Returns the 8 byte aligned start of the coordinate data.'''
+    end = len(magic) + 4 + headersize
+    return end + (-end % 8)
+
+
+def keyframe_range(descfile, name):
+    '''Returns the first and last keyframe number of an animation.'''
+    xmlanims = descfile.tree.find("animations")
+    if xmlanims is None:
+        return None
+    for xmlanim in xmlanims:
+        if xmlanim.get("name", None) == name:
+            numbers = [int(xmlkey.get("number"))
+                       for xmlkey in xmlanim.iter("keyframe")]
+            if numbers:
+                return min(numbers), max(numbers)
+    return None
+
+
+def bake(descfile):
+    '''Writes the atlas of all non-combined animations of a description.
+
+    Returns the path of the written atlas or None if there was nothing to
+    bake.
+    '''
+    entries = {}
+    data = array.array("d")
+    for name in sorted(descfile.animations):
+        anim = descfile.animations[name]
+        if isinstance(anim, svglib.CombinedAnimation):
+            continue
+        staterange = keyframe_range(descfile, name)
+        if staterange is None:
+            log.warning("No keyframes found for animation '%s'", name)
+            continue
+        first, last = staterange
+        offset = len(data)
+        count = None
+        exact = True
+        for state in range(first, last + 1):
+            frame = anim.get_frame(state)
+            if has_delta(frame):
+                # frames are rebuilt from copies, which lose their delta
+                log.warning("Animation '%s' was not baked because its " +
+                            "frames conform to other geometry", name)
+                del data[offset:]
+                break
+            points = flat_points(frame)
+            if count is None:
+                count = len(points)
+            elif len(points) != count:
+                # the atlas relies on all frames having the same commands
+                log.warning("Animation '%s' was not baked because its " +
+                            "frames have different numbers of points", name)
+                del data[offset:]
+                break
+            exact = exact and is_exact(frame)
+            data.extend(points)
+        else:
+            entries[name] = {"first": first, "last": last,
+                             "count": count, "offset": offset,
+                             "exact": exact}
+    if not entries:
+        return None
+    header = json.dumps({"byteorder": sys.byteorder,
+                         "sources": source_signature(descfile),
+                         "animations": entries}).encode("utf-8")
+    path = atlas_path(descfile)
+    with path.open("wb") as f:
+        f.write(magic)
+        f.write(struct.pack("<I", len(header)))
+        f.write(header)
+        f.write(bytes(data_offset(len(header)) - f.tell()))
+        data.tofile(f)
+    log.info("Baked %s animations to %s", len(entries), path.name)
+    return path
+
+
+def load(descfile):
+    '''Returns the atlas of a description file or None.
+
+    None is returned if there is no atlas or if the atlas is outdated.
+    '''
+    path = atlas_path(descfile)
+    if not path.exists():
+        return None
+    try:
+        frameatlas = FrameAtlas(path)
+    except (ValueError, KeyError, TypeError, struct.error, OSError) as err:
+        # truncated or corrupt atlases are rebuilt by interpolating
+        log.warning("Frame atlas %s was ignored: %s", path.name, err)
+        return None
+    if not frameatlas.is_current(descfile):
+        log.warning("Frame atlas %s is outdated and was ignored; " +
+                    "run 'python -m paperdoll bake' to update it", path.name)
+        frameatlas.close()
+        return None
+    return frameatlas
+
+
+# --------------------------------------------------------------------------- #
+# Declare module globals
+# --------------------------------------------------------------------------- #
+log = logging.getLogger(__name__)
+magic = b"PDCATLS1"  # the first bytes of each atlas file
+format_version = 2  # increase when the atlas content changes
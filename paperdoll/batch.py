@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+'''Paperdoll editor headless batch rendering module.
+
+Nothing in this module may import PyQt5 at import time, so render workers
+start quickly and run on servers without a display. Only PNG export loads
+the raster module and with it PyQt5.
+'''
+
+
+# --------------------------------------------------------------------------- #
+# Import libraries
+# --------------------------------------------------------------------------- #
+import io
+import json
+import logging
+import multiprocessing
+import os
+import time
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import model
+
+
+# --------------------------------------------------------------------------- #
+# Define functions
+# --------------------------------------------------------------------------- #
+def read_states(path):
+    '''Yields one state dictionary per line of a JSON lines file.
+
+    Each line maps animation names to integer states, for example
+    {"body_boobs": 60, "hips": 20}. Empty lines are skipped.
+    '''
+    with Path(path).open("r") as f:
+        for lineno, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            states = json.loads(line)
+            if not isinstance(states, dict):
+                raise ValueError("Line %s of %s is not a JSON object" %
+                                 (lineno, path))
+            yield states
+
+
+def reset_state(editor):
+    '''Sets every animation of the editor to its default state.'''
+    apply_state(editor, {})
+
+
+def apply_state(editor, states):
+    '''Sets the editor state to the defaults updated with states.
+
+    The state is changed in one transaction and the dials are set to match.
+    '''
+    mapping = {animname: anim.default_state
+               for animname, anim in editor.animations.items()}
+    for animname, value in states.items():
+        if animname not in editor.animations:
+            log.warning("Unknown animation '%s' was ignored", animname)
+            continue
+        mapping[animname] = int(value)
+    editor.set_states(mapping, follow=False)
+    editor.reset_dials()
+
+
+def render_states(editor, states, outdir, pattern="doll_{:05d}.svg",
+                  profiles=None, pngsizes=None):
+    '''Writes one SVG file per state dictionary to outdir.
+
+    If profiles is a list, the stage profile of each draw is appended to it.
+    If pngsizes lists image sizes, PNG files of these sizes are written
+    next to each SVG file. Returns the list of written SVG file paths in the
+    order of states.
+    '''
+    outdir = Path(outdir)
+    outdir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for number, statedict in enumerate(states):
+        apply_state(editor, statedict)
+        path = outdir / pattern.format(number)
+        save_doll(editor, path, pngsizes)
+        paths.append(path)
+        if profiles is not None:
+            profiles.append(editor.draw_profile)
+    return paths
+
+
+def compare_numeric(dolldir, states, cache=True):
+    '''Draws each state like the reference editor in each numeric mode.
+
+    The reference editor draws with svglib only, i.e. decimal coordinates
+    without frame atlases and conform maps. Returns the numbers of the
+    states whose SVG differs from the reference in decimal or float mode.
+    '''
+    reference = model.MPaperdollEditor(dolldir, cache=cache, compiled=False)
+    editors = {mode: model.MPaperdollEditor(dolldir, numeric=mode,
+                                            cache=cache)
+               for mode in ("decimal", "float")}
+    differences = []
+    for number, statedict in enumerate(states):
+        apply_state(reference, statedict)
+        expected = ET.tostring(reference.draw(incremental=False).to_xml())
+        for mode, editor in sorted(editors.items()):
+            apply_state(editor, statedict)
+            svgdoc = editor.draw(incremental=False)
+            if ET.tostring(svgdoc.to_xml()) != expected:
+                log.warning("State %s is drawn differently in %s mode",
+                            number, mode)
+                differences.append(number)
+                break
+    return differences
+
+
+def save_doll(editor, path, pngsizes=None):
+    '''Writes the current doll to an SVG file and optional PNG files.'''
+    if not pngsizes:
+        editor.save_to_file(path)
+        return
+    import raster
+    buffer = io.BytesIO()
+    editor.write_svg(buffer)
+    svgbytes = buffer.getvalue()
+    with Path(path).open("wb") as f:
+        f.write(svgbytes)
+    raster.save_images(svgbytes, pngsizes, Path(path))
+
+
+def render_pool(editor, states, outdir, processes=None, dolldir=None,
+                pattern="doll_{:05d}.svg", chunksize=4, pngsizes=None):
+    '''Writes one SVG file per state dictionary using a pool of processes.
+
+    Where the fork start method exists the workers inherit the parsed editor
+    of this process; elsewhere each worker loads the files in dolldir once,
+    with the numeric mode and the cache and compiled flags of editor.
+    Files are numbered and returned in the order of states. Returns the list
+    of written paths and a throughput report dictionary.
+    '''
+    global worker_editor
+    outdir = Path(outdir)
+    outdir.mkdir(parents=True, exist_ok=True)
+    jobs = ((number, statedict, outdir / pattern.format(number), pngsizes)
+            for number, statedict in enumerate(states))
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+        worker_editor = editor
+        initargs = (None, None)
+    else:
+        if dolldir is None:
+            raise ValueError("dolldir is required without the fork " +
+                             "start method")
+        context = multiprocessing.get_context("spawn")
+        initargs = (str(dolldir), {"numeric": editor.numeric,
+                                   "cache": editor.cache,
+                                   "compiled": editor.compiled})
+    paths = []
+    workers = {}
+    drawtime = 0.0
+    start = time.perf_counter()
+    with context.Pool(processes, initializer=init_worker,
+                      initargs=initargs) as pool:
+        for path, seconds, pid in pool.imap(render_job, jobs, chunksize):
+            paths.append(path)
+            drawtime += seconds
+            workers[pid] = workers.get(pid, 0) + 1
+    elapsed = time.perf_counter() - start
+    worker_editor = None
+    report = {"count": len(paths),
+              "processes": len(workers),
+              "seconds": elapsed,
+              "dolls_per_second": len(paths) / elapsed if elapsed else 0.0,
+              "mean_render_seconds": drawtime / len(paths) if paths else 0.0,
+              "dolls_per_worker": workers}
+    log.info("Rendered %s dolls in %.2f s (%.1f dolls/s)", report["count"],
+             report["seconds"], report["dolls_per_second"])
+    return paths, report
+
+
+def format_report(report):
+    '''Returns a render farm throughput report as readable text.'''
+    lines = ["dolls rendered:   %s" % report["count"],
+             "worker processes: %s" % report["processes"],
+             "wall time:        %.2f s" % report["seconds"],
+             "throughput:       %.1f dolls/s" % report["dolls_per_second"],
+             "mean render time: %.1f ms" %
+             (report["mean_render_seconds"] * 1000)]
+    return "\n".join(lines)
+
+
+def init_worker(dolldir, options):
+    '''Prepares a render worker process of render_pool().
+
+    options are the keyword arguments of the worker editor.
+    '''
+    global worker_editor
+    if worker_editor is not None:
+        return  # the editor was inherited from the parent process
+    import paperdoll
+    paperdoll.init_signals()
+    worker_editor = model.MPaperdollEditor(dolldir, **options)
+    model.editor = worker_editor
+
+
+def render_job(job):
+    '''Renders one doll in a worker process of render_pool().'''
+    number, statedict, path, pngsizes = job
+    start = time.perf_counter()
+    apply_state(worker_editor, statedict)
+    save_doll(worker_editor, path, pngsizes)
+    return path, time.perf_counter() - start, os.getpid()
+
+
+# --------------------------------------------------------------------------- #
+# Declare module globals
+# --------------------------------------------------------------------------- #
+log = logging.getLogger(__name__)
+worker_editor = None  # the editor used by render_job() in worker processes
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+'''Paperdoll editor benchmark module.
+
+Measures startup, drawing and export with the doll files in one doll
+directory and compares the results with a stored baseline. The random
+state sweep uses a fixed seed, so every run draws the same states.
+
+Like the batch module this module does not import PyQt5.
+'''
+
+
+# --------------------------------------------------------------------------- #
+# Import libraries
+# --------------------------------------------------------------------------- #
+import json
+import logging
+import platform
+import random
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import batch
+import model
+import svgio
+
+
+# --------------------------------------------------------------------------- #
+# Define functions
+# --------------------------------------------------------------------------- #
+def measure(func, repeat):
+    '''Calls func repeat times and returns the statistics of the calls.
+
+    The calls are timed without tracing allocations. One additional call
+    runs with tracemalloc to find the peak memory of a single call.
+    '''
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    if hasattr(tracemalloc, "reset_peak"):
+        tracemalloc.reset_peak()
+    func()
+    peak = tracemalloc.get_traced_memory()[1] - before
+    if started:
+        tracemalloc.stop()
+    return summarize(samples, peak)
+
+
+def summarize(samples, peak=0):
+    '''Returns median, 95th percentile and extremes of timing samples.'''
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+    return {"runs": len(ordered),
+            "median": statistics.median(ordered),
+            "p95": p95,
+            "min": ordered[0],
+            "max": ordered[-1],
+            "peak_bytes": max(peak, 0)}
+
+
+def random_states(editor, count, seed=0):
+    '''Returns count random state dictionaries for the dial animations.
+
+    Each animation controlled by a dial gets a random integer state in the
+    range of that dial.
+    '''
+    ranges = {}
+    for dial in editor.dials.values():
+        for animname, animdata in dial.animations.items():
+            ranges[animname] = (animdata["minimum"], animdata["maximum"])
+    rng = random.Random(seed)
+    return [{animname: rng.randint(low, high)
+             for animname, (low, high) in sorted(ranges.items())}
+            for _ in range(count)]
+
+
+def run(dolldir="../dollfiles", repeat=10, sweep=20, seed=0):
+    '''Runs all benchmarks and returns their results as a dictionary.
+
+    The benchmarks run on a copy of the doll directory in a temporary
+    directory, so the doll cache written by the editors and the exported
+    files never end up in the doll directory.
+    '''
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = Path(tmpdir) / "dollfiles"
+        shutil.copytree(dolldir, workdir)
+        results = measure_all(workdir, repeat, sweep, seed)
+    return {"python": platform.python_version(),
+            "dolldir": str(Path(dolldir).resolve()),
+            "repeat": repeat,
+            "seed": seed,
+            "results": results}
+
+
+def measure_all(workdir, repeat, sweep, seed):
+    '''Runs the benchmarks on the doll files in workdir.
+
+    Cold draws clear the frame, outline and layer caches before every draw;
+    warm draws reuse the caches of the previous repetition. Cold editor
+    construction parses the doll files, warm construction loads the
+    compiled doll cache. The editors created here are closed when they are
+    no longer needed, so the signals of later benchmarks do not reach them
+    and their frame atlases are unmapped.
+    '''
+    results = {}
+    editor = model.MPaperdollEditor(workdir)
+    try:
+        measure_drawing(editor, results, repeat, sweep, seed)
+        path = workdir.parent / "benchmark.svg"
+        batch.reset_state(editor)
+        results["save_to_file"] = measure(lambda: editor.save_to_file(path),
+                                          repeat)
+        svgdoc = editor.draw(incremental=False)
+        results["tostring"] = measure(lambda: ET.tostring(svgdoc.to_xml()),
+                                      repeat)
+        layerelems = list(editor.layerelems)
+        results["serialize"] = measure(
+            lambda: svgio.document_bytes(svgdoc, layerelems), repeat)
+    finally:
+        editor.close()
+
+    def construct(cache):
+        model.MPaperdollEditor(workdir, cache=cache).close()
+    # the first editor wrote the compiled doll cache
+    results["construct_cold"] = measure(lambda: construct(False),
+                                        max(1, repeat // 5))
+    results["construct_warm"] = measure(lambda: construct(True),
+                                        max(1, repeat // 5))
+    return results
+
+
+def measure_drawing(editor, results, repeat, sweep, seed):
+    '''Measures default draws, random state sweeps and dial drags.'''
+    def draw_default():
+        batch.reset_state(editor)
+        editor.draw(incremental=False)
+    results["draw_default"] = measure(draw_default, repeat)
+
+    def draw_default_cold():
+        editor.clear_caches()
+        draw_default()
+    results["draw_default_cold"] = measure(draw_default_cold, repeat)
+
+    states = random_states(editor, sweep, seed)
+
+    def draw_sweep():
+        for statedict in states:
+            batch.apply_state(editor, statedict)
+            editor.draw()
+    results["draw_sweep"] = measure(draw_sweep, repeat)
+    results["draw_sweep"]["states"] = len(states)
+
+    def draw_sweep_cold():
+        for statedict in states:
+            editor.clear_caches()
+            batch.apply_state(editor, statedict)
+            editor.draw()
+    results["draw_sweep_cold"] = measure(draw_sweep_cold, repeat)
+    results["draw_sweep_cold"]["states"] = len(states)
+
+    results["dial_drag"] = measure_dial_drag(editor, repeat)
+
+
+def measure_dial_drag(editor, repeat, steps=10):
+    '''Measures dragging each dial by steps values with a draw per value.
+
+    Every dial is dragged up from its minimum and returned to it, so each
+    repetition starts at the same state.
+    '''
+    batch.reset_state(editor)
+    dials = [editor.dials[name] for name in sorted(editor.dials)]
+
+    def drag():
+        for dial in dials:
+            for value in range(dial.minimum, dial.minimum + steps + 1):
+                dial.change_value(value)
+                editor.draw()
+            dial.change_value(dial.minimum)
+    stats = measure(drag, repeat)
+    stats["dials"] = len(dials)
+    stats["steps"] = steps
+    return stats
+
+
+def compare(report, baseline, tolerance=0.2):
+    '''Returns the benchmarks whose median got slower than the baseline.
+
+    A benchmark regressed if its median exceeds the baseline median by more
+    than tolerance, e.g. 0.2 for 20%. Returns a list of (name, baseline
+    median, current median) tuples.
+    '''
+    regressions = []
+    for name, stats in sorted(report["results"].items()):
+        old = baseline["results"].get(name, None)
+        if old is None:
+            continue
+        if stats["median"] > old["median"] * (1 + tolerance):
+            regressions.append((name, old["median"], stats["median"]))
+    return regressions
+
+
+def format_report(report, baseline=None):
+    '''Returns benchmark results as a readable table.'''
+    lines = ["%-18s %10s %10s %12s %10s" % ("benchmark", "median ms",
+                                            "p95 ms", "peak", "baseline")]
+    for name, stats in sorted(report["results"].items()):
+        change = ""
+        if baseline is not None and name in baseline["results"]:
+            old = baseline["results"][name]["median"]
+            if old:
+                change = "%+.1f%%" % ((stats["median"] / old - 1) * 100)
+        lines.append("%-18s %10.2f %10.2f %12s %10s" % (
+            name, stats["median"] * 1000, stats["p95"] * 1000,
+            "%.1f KiB" % (stats["peak_bytes"] / 1024), change))
+    return "\n".join(lines)
+
+
+def read_report(path):
+    '''Returns a benchmark report stored as JSON.'''
+    with Path(path).open("r") as f:
+        return json.load(f)
+
+
+def write_report(report, path):
+    '''Stores a benchmark report as JSON, e.g. as new baseline.'''
+    with Path(path).open("w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+
+# --------------------------------------------------------------------------- #
+# Declare module globals
+# --------------------------------------------------------------------------- #
+log = logging.getLogger(__name__)
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+'''Paperdoll editor compiled doll cache module.
+
+Parsing the Inkscape SVG files of the doll descriptions takes most of the
+startup time. The compiled doll cache stores the fully loaded description
+files in one pickle file in the doll directory, together with the conform
+maps compiled for them. It is used instead of parsing as long as path,
+size, modification time and content hash of all description and SVG files,
+the svglib sources and the NumPy version are unchanged.
+'''
+
+
+# --------------------------------------------------------------------------- #
+# Import libraries
+# --------------------------------------------------------------------------- #
+import hashlib
+import logging
+import pickle
+import sys
+from pathlib import Path
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import svglib
+
+
+# --------------------------------------------------------------------------- #
+# Define functions
+# --------------------------------------------------------------------------- #
+def cache_path(dolldir):
+    '''Returns the path of the compiled doll cache of a doll directory.'''
+    return dolldir / "dollfiles.pdccache"
+
+
+def source_paths(descpaths):
+    '''Returns the description files and the SVG files they describe.'''
+    paths = []
+    for descpath in descpaths:
+        paths.append(descpath)
+        svgpath = descpath.with_suffix(".svg")
+        if svgpath.exists():
+            paths.append(svgpath)
+    return paths
+
+
+def file_digest(path):
+    '''Returns the SHA-1 hex digest of the content of a file.
+
+    Digests are remembered by path, size and modification time, so each
+    file is hashed once per process.
+    '''
+    stat = path.stat()
+    key = (str(path), stat.st_size, stat.st_mtime_ns)
+    digest = digests.get(key, None)
+    if digest is None:
+        digest = hashlib.sha1(path.read_bytes()).hexdigest()
+        digests[key] = digest
+    return digest
+
+
+def library_signature():
+    '''Returns the version and a content hash of the svglib sources.
+
+    Objects loaded by svglib are only reused while svglib is unchanged.
+    '''
+    global library
+    if library is None:
+        path = Path(svglib.__file__)
+        if path.name == "__init__.py":
+            paths = sorted(path.parent.rglob("*.py"))
+        else:
+            paths = [path]
+        digest = hashlib.sha1()
+        for libpath in paths:
+            digest.update(libpath.read_bytes())
+        library = {"svglib": str(getattr(svglib, "__version__", None)),
+                   "svglib_sha1": digest.hexdigest()}
+    return library
+
+
+def signature(descpaths):
+    '''Returns the signature of the source files, svglib and NumPy.'''
+    entries = []
+    for path in source_paths(descpaths):
+        stat = path.stat()
+        entries.append((str(path), stat.st_size, stat.st_mtime_ns,
+                        file_digest(path)))
+    return {"version": cache_version,
+            "python": tuple(sys.version_info[:2]),
+            "library": library_signature(),
+            "numpy": getattr(numpy, "__version__", None),
+            "files": entries}
+
+
+def load(dolldir, descpaths):
+    '''Returns the cached content or None if the cache is stale.
+
+    The content is a dictionary with the items "dollfiles" (the description
+    files by file name) and "conformmaps" (the conform maps by element id,
+    or None if they were not compiled).
+    '''
+    path = cache_path(dolldir)
+    if not path.exists():
+        return None
+    try:
+        with path.open("rb") as f:
+            # the small header is checked before the large payload is read
+            header = pickle.load(f)
+            if header != signature(descpaths):
+                log.info("Compiled doll cache %s is outdated", path.name)
+                return None
+            content = pickle.load(f)
+    except Exception as err:
+        log.warning("Compiled doll cache %s was ignored: %s", path.name, err)
+        return None
+    log.info("Loaded description files from %s", path.name)
+    return content
+
+
+def save(dolldir, descpaths, dollfiles, conformmaps=None):
+    '''Writes the loaded description files to the compiled doll cache.
+
+    conformmaps are the conform maps compiled for the description files.
+    They are pickled together with the files, so they keep referring to
+    the deltas of the files.
+    '''
+    path = cache_path(dolldir)
+    try:
+        header = signature(descpaths)
+        payload = pickle.dumps({"dollfiles": dollfiles,
+                                "conformmaps": conformmaps},
+                               protocol=pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, TypeError, AttributeError,
+            RecursionError) as err:
+        log.warning("Description files cannot be cached: %s", err)
+        return None
+    try:
+        with path.open("wb") as f:
+            pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.write(payload)
+    except OSError as err:
+        log.warning("Compiled doll cache %s was not written: %s",
+                    path.name, err)
+        return None
+    return path
+
+
+# --------------------------------------------------------------------------- #
+# Declare module globals
+# --------------------------------------------------------------------------- #
+log = logging.getLogger(__name__)
+digests = {}  # maps (path, size, mtime) to the SHA-1 digest of a file
+library = None  # the svglib signature; computed by library_signature()
+cache_version = 2  # increase when the loaded description files change
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+'''Paperdoll editor doll state record module.
+
+A doll state file stores many dolls in a compact binary format. The file
+starts with a header naming the animations in sorted order, so
+each record only holds numbers:
+
+    magic           8 bytes, b"PDCDOLL1"
+    header size     uint32
+    header          UTF-8 JSON: version, animations
+    records         uint32 size followed by the record
+
+A record holds the animation states in the order of the header (int32
+each) and the style overrides as pairs of UTF-8 element id and style
+string. Dial values are intentionally not stored: they follow from the
+animation states, and restoring the states restores them.
+
+Records are read and written one at a time, so files with millions of
+dolls can be read with bounded memory. A zip archive keeps one directory
+entry per member until it is closed, so export_archive can split the dolls
+into shards of a fixed number of members.
+'''
+
+
+# --------------------------------------------------------------------------- #
+# Import libraries
+# --------------------------------------------------------------------------- #
+import io
+import json
+import logging
+import struct
+import tarfile
+import time
+import zipfile
+
+import svglib
+
+
+# --------------------------------------------------------------------------- #
+# Define classes
+# --------------------------------------------------------------------------- #
+class RecordWriter(object):
+    '''Writes doll state records to a binary file object.
+    '''
+    def __init__(self, f, animations):
+        self.f = f
+        self.animations = list(animations)
+        self.count = 0
+        self.codec = RecordCodec(self.animations)
+        header = json.dumps({"version": format_version,
+                             "animations": self.animations}).encode("utf-8")
+        f.write(magic)
+        f.write(size_struct.pack(len(header)))
+        f.write(header)
+
+    def write(self, record):
+        data = self.codec.encode(record)
+        self.f.write(size_struct.pack(len(data)))
+        self.f.write(data)
+        self.count += 1
+
+
+class RecordCodec(object):
+    '''Converts records to bytes and back for fixed animations.
+
+    A record is a dictionary with the items "state" (list of animation
+    states) and "styles" (dictionary mapping element ids to style strings).
+    '''
+    def __init__(self, animations):
+        self.vector = struct.Struct("<%si" % len(animations))
+
+    def encode(self, record):
+        parts = [self.vector.pack(*record["state"]),
+                 count_struct.pack(len(record["styles"]))]
+        for elemid, style in sorted(record["styles"].items()):
+            for text in (elemid, str(style)):
+                data = text.encode("utf-8")
+                parts.append(size_struct.pack(len(data)))
+                parts.append(data)
+        return b"".join(parts)
+
+    def decode(self, data):
+        values = self.vector.unpack_from(data, 0)
+        offset = self.vector.size
+        stylecount, = count_struct.unpack_from(data, offset)
+        offset += count_struct.size
+        texts = []
+        for _ in range(stylecount * 2):
+            size, = size_struct.unpack_from(data, offset)
+            offset += size_struct.size
+            texts.append(data[offset:offset + size].decode("utf-8"))
+            offset += size
+        if offset != len(data):
+            raise ValueError("Doll state record has %s trailing bytes" %
+                             (len(data) - offset))
+        return {"state": list(values),
+                "styles": dict(zip(texts[::2], texts[1::2]))}
+
+
+class RecordReader(object):
+    '''Reads doll state records from a binary file object.
+
+    Iterating over the reader yields one record dictionary at a time.
+    '''
+    def __init__(self, f):
+        self.f = f
+        if f.read(len(magic)) != magic:
+            raise ValueError("Not a doll state file")
+        header = json.loads(read_exactly(f, read_size(f)).decode("utf-8"))
+        if header.get("version", None) != format_version:
+            raise ValueError("Unsupported doll state file version %s" %
+                             header.get("version", None))
+        self.animations = header["animations"]
+        self.codec = RecordCodec(self.animations)
+
+    def __iter__(self):
+        while True:
+            sizedata = self.f.read(size_struct.size)
+            if not sizedata:
+                return
+            if len(sizedata) != size_struct.size:
+                raise ValueError("Doll state file is truncated")
+            size, = size_struct.unpack(sizedata)
+            yield self.codec.decode(read_exactly(self.f, size))
+
+
+# --------------------------------------------------------------------------- #
+# Define functions
+# --------------------------------------------------------------------------- #
+def read_size(f):
+    '''Reads one uint32 size from a binary file object.'''
+    size, = size_struct.unpack(read_exactly(f, size_struct.size))
+    return size
+
+
+def read_exactly(f, size):
+    '''Reads size bytes from a binary file object.'''
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError("Doll state file is truncated")
+    return data
+
+
+def writer(editor, f):
+    '''Returns a RecordWriter for the animations of an editor.'''
+    return RecordWriter(f, sorted(editor.animations))
+
+
+def capture(editor):
+    '''Returns the record of the current doll of an editor.'''
+    return {"state": [editor.state[animname]
+                      for animname in sorted(editor.animations)],
+            "styles": {elemid: str(style) for elemid, style
+                       in editor.modified_styles.items()}}
+
+
+def apply_record(editor, record, animations):
+    '''Sets state and style overrides of an editor from a record.
+
+    animations are the animation names of the file the record was read
+    from. Animations missing in the file keep their default state. The dials
+    are reset to the animation states, which gives them the values they had
+    when the record was captured.
+    '''
+    mapping = {animname: anim.default_state
+               for animname, anim in editor.animations.items()}
+    for animname, animstate in zip(animations, record["state"]):
+        if animname not in editor.animations:
+            log.warning("Unknown animation '%s' was ignored", animname)
+            continue
+        mapping[animname] = animstate
+    editor.set_states(mapping, follow=False)
+    editor.reset_dials()
+    editor.modified_styles = {elemid: svglib.Style(style) for elemid, style
+                              in record["styles"].items()}
+
+
+def open_archive(archivepath, fmt):
+    '''Opens a tar or zip archive for writing.'''
+    if fmt == "zip":
+        return zipfile.ZipFile(str(archivepath), "w",
+                               compression=zipfile.ZIP_DEFLATED)
+    if fmt in {"tar", "tar.gz"}:
+        mode = "w|gz" if fmt == "tar.gz" else "w|"
+        return tarfile.open(str(archivepath), mode)
+    raise ValueError("Unknown archive format '%s'" % fmt)
+
+
+def shard_path(archivepath, fmt, shard):
+    '''Returns the path of a shard, e.g. dolls_0001.tar for dolls.tar.'''
+    archivepath = str(archivepath)
+    suffix = "." + fmt
+    if archivepath.endswith(suffix):
+        archivepath = archivepath[:-len(suffix)]
+    else:
+        suffix = ""
+    return "%s_%04d%s" % (archivepath, shard, suffix)
+
+
+def export_archive(editor, records, animations, archivepath, fmt="tar",
+                   pattern="doll_{:07d}.svg", shard_size=None):
+    '''Renders each record to SVG and writes it into tar or zip archives.
+
+    records is an iterable of record dictionaries, e.g. a RecordReader, with
+    the given animations. Only one drawing is held in memory at a time; tar
+    archives are written as a stream. A zip archive keeps its central
+    directory in memory until it is closed, one entry per doll, so with
+    shard_size the dolls are split into archives of at most shard_size dolls
+    named like dolls_0000.zip. Returns the number of dolls.
+    '''
+    if fmt not in {"tar", "tar.gz", "zip"}:
+        raise ValueError("Unknown archive format '%s'" % fmt)
+    count = 0
+    archive = None
+    start = time.perf_counter()
+    try:
+        for number, record in enumerate(records):
+            if archive is None or (shard_size and
+                                   number % shard_size == 0):
+                if archive is not None:
+                    archive.close()
+                path = archivepath
+                if shard_size:
+                    path = shard_path(archivepath, fmt, number // shard_size)
+                archive = open_archive(path, fmt)
+            apply_record(editor, record, animations)
+            buffer = io.BytesIO()
+            editor.write_svg(buffer)
+            name = pattern.format(number)
+            if fmt == "zip":
+                archive.writestr(name, buffer.getvalue())
+            else:
+                info = tarfile.TarInfo(name)
+                info.size = buffer.tell()
+                info.mtime = time.time()
+                buffer.seek(0)
+                archive.addfile(info, buffer)
+                # a stream is never read back, so its members are not needed
+                archive.members = []
+            count += 1
+        if archive is None and not shard_size:
+            archive = open_archive(archivepath, fmt)
+    finally:
+        if archive is not None:
+            archive.close()
+    log.info("Archived %s dolls in %.2f s", count,
+             time.perf_counter() - start)
+    return count
+
+
+# --------------------------------------------------------------------------- #
+# Declare module globals
+# --------------------------------------------------------------------------- #
+log = logging.getLogger(__name__)
+magic = b"PDCDOLL1"  # the first bytes of each doll state file
+format_version = 1  # increase when the record layout changes
+size_struct = struct.Struct("<I")
+count_struct = struct.Struct("<H")
@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+'''Paperdoll editor vectorized geometry module.
+
+A PathArray holds the points of svglib geometry elements in one contiguous
+float64 NumPy array with a parallel array of command letters, so the
+skeleton poses a body part with one matrix product. svglib elements stay the canonical
+representation; their points are read into the array once and written back
+once. A ConformMap replaces the conforming of a path by a precompiled sparse
+linear map.
+
+NumPy is optional. Without it PathArray and ConformMap are unavailable and
+the editor uses its per-point loops and the svglib deltas.
+'''
+
+
+# --------------------------------------------------------------------------- #
+# Import libraries
+# --------------------------------------------------------------------------- #
+import logging
+from decimal import Decimal
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import svglib
+
+
+# --------------------------------------------------------------------------- #
+# Define classes
+# --------------------------------------------------------------------------- #
+class PathArray(object):
+    '''The points of geometry elements as a (n, 2) float64 array.
+
+    Points of relative commands (lower case command letters) are offsets,
+    so translations do not move them and rotations and scaling ignore the
+    center. H and V commands should be replaced by L before rotating, as
+    transform_skeleton does for bones.
+    '''
+    def __init__(self, elems=(), points=None, commands=None, relative=None):
+        if numpy is None:
+            raise RuntimeError("PathArray requires NumPy")
+        self.elems = list(elems)
+        if points is None:
+            letters = []
+            offsets = []
+            values = []
+            for elem in self.elems:
+                for cmdidx, cmd in enumerate(elem.commands):
+                    # a leading m command starts at an absolute position
+                    isoffset = (cmd.commandletter.islower() and
+                                not (cmdidx == 0 and cmd.commandletter == "m"))
+                    for point in cmd.parameters:
+                        letters.append(cmd.commandletter)
+                        offsets.append(isoffset)
+                        values.append(float(point.x))
+                        values.append(float(point.y))
+            points = numpy.array(values, dtype=numpy.float64).reshape(-1, 2)
+            commands = numpy.array(letters, dtype="U1")
+            relative = numpy.array(offsets, dtype=bool)
+        self.points = points  # the x, y coordinates of all points
+        self.commands = commands  # the command letter of each point
+        self.relative = relative  # True for points that are offsets
+
+    def __len__(self):
+        return len(self.points)
+
+    @classmethod
+    def from_element(cls, elem):
+        '''Returns the PathArray of a geometry element or group.'''
+        return cls(geometry_elements(elem))
+
+    def transform(self, matrix):
+        '''Applies a 3x3 affine matrix to all points in place.
+
+        Relative points only get the linear part of the matrix.
+        '''
+        linear = matrix[:2, :2]
+        self.points[:] = self.points @ linear.T
+        self.points[~self.relative] += matrix[:2, 2]
+        return self
+
+    def apply(self, elems=None):
+        '''Writes the points back to the geometry elements.
+
+        The coordinates keep the numeric type the elements use.
+        '''
+        if elems is None:
+            elems = self.elems
+        values = self.points.tolist()
+        idx = 0
+        for elem in elems:
+            for cmd in elem.commands:
+                for point in cmd.parameters:
+                    x, y = values[idx]
+                    point.x = coordinate(x, point.x)
+                    point.y = coordinate(y, point.y)
+                    idx += 1
+
+
+class ConformMap(object):
+    '''The conforming of one path as a sparse linear map of its target.
+
+    Conforming computes the points of a path from the points of its target.
+    For the linear deltas svglib uses this is conformed = W target + b. W
+    and b are found once by probing: the delta conforms the path to the
+    target and to copies of the target with one coordinate moved at a time.
+    W is kept as a sparse COO matrix, so conforming is a single sparse
+    matrix-vector product.
+
+    A random displacement of all target points checks the map. If the
+    delta turns out not to be linear, or the target changes its number of
+    points, conform() falls back to the delta.
+    '''
+    def __init__(self, elemid, delta, targetelem, step=1.0, tolerance=1e-6):
+        if numpy is None:
+            raise RuntimeError("ConformMap requires NumPy")
+        self.elemid = elemid
+        self.delta = delta
+        self.tolerance = tolerance
+        # an empty map that falls back to the delta until probing succeeds
+        self.linear = False
+        self.rows = numpy.zeros(0, dtype=int)
+        self.cols = numpy.zeros(0, dtype=int)
+        self.weights = numpy.zeros(0)
+        self.offset = numpy.zeros(0)
+        base = numpy.array(flat_points(targetelem))
+        self.targetsize = len(base)
+        template = delta.conform(elemid, targetelem)
+        self.template = template.copy()  # the structure of conformed paths
+        conformed = numpy.array(flat_points(template))
+        columns = []
+        probe = targetelem.copy()
+        for col in range(len(base)):
+            values = base.copy()
+            values[col] += step
+            set_flat_points(probe, values)
+            response = numpy.array(flat_points(delta.conform(elemid, probe)))
+            if response.shape != conformed.shape:
+                log.debug("Conforming %s changes the number of points",
+                          elemid)
+                return
+            columns.append((response - conformed) / step)
+        if columns:
+            matrix = numpy.column_stack(columns)
+        else:
+            matrix = numpy.zeros((len(conformed), 0))
+        self.rows, self.cols = numpy.nonzero(numpy.abs(matrix) > 1e-12)
+        self.weights = matrix[self.rows, self.cols]
+        self.offset = conformed - matrix @ base
+        # check the map against the delta for an unrelated target
+        rng = numpy.random.RandomState(0)
+        values = base + rng.uniform(-10.0, 10.0, len(base))
+        set_flat_points(probe, values)
+        expected = numpy.array(flat_points(delta.conform(elemid, probe)))
+        self.linear = (expected.shape == conformed.shape and
+                       numpy.allclose(self.apply(values), expected,
+                                      rtol=0.0, atol=tolerance))
+        if not self.linear:
+            log.debug("Conforming %s is not linear; the delta is used",
+                      elemid)
+
+    def __len__(self):
+        '''Returns the number of nonzero weights.'''
+        return len(self.weights)
+
+    def apply(self, values):
+        '''Returns the conformed flat coordinates for flat target values.'''
+        products = self.weights * numpy.asarray(values)[self.cols]
+        return self.offset + numpy.bincount(self.rows, weights=products,
+                                            minlength=len(self.offset))
+
+    def conform(self, targetelem):
+        '''Returns a new element conformed to targetelem.'''
+        if not self.linear:
+            return self.delta.conform(self.elemid, targetelem)
+        values = flat_points(targetelem)
+        if len(values) != self.targetsize:
+            return self.delta.conform(self.elemid, targetelem)
+        elem = self.template.copy()
+        set_flat_points(elem, self.apply(values).tolist())
+        return elem
+
+
+# --------------------------------------------------------------------------- #
+# Define functions
+# --------------------------------------------------------------------------- #
+def geometry_elements(elem):
+    '''Returns the geometry elements of an element or group in order.'''
+    if isinstance(elem, svglib.SvgGroup):
+        return [subelem for subelem in elem.iterate()
+                if isinstance(subelem, svglib.SvgGeometryElement)]
+    return [elem]
+
+
+def coordinate(value, like):
+    '''Converts a float to the numeric type of the coordinate like.'''
+    if isinstance(like, Decimal):
+        return Decimal(repr(value))
+    return type(like)(value)
+
+
+def flat_points(elem):
+    '''Returns the coordinates of all points of an element as flat floats.
+
+    The stored coordinates are returned, i.e. offsets for relative commands.
+    '''
+    values = []
+    for geomelem in geometry_elements(elem):
+        for cmd in geomelem.commands:
+            for point in cmd.parameters:
+                values.append(float(point.x))
+                values.append(float(point.y))
+    return values
+
+
+def set_flat_points(elem, values):
+    '''Writes flat x, y coordinates to the points of an element.
+
+    The coordinates keep the numeric type the element uses.
+    '''
+    idx = 0
+    for geomelem in geometry_elements(elem):
+        for cmd in geomelem.commands:
+            for point in cmd.parameters:
+                point.x = coordinate(values[idx], point.x)
+                point.y = coordinate(values[idx + 1], point.y)
+                idx += 2
+
+
+def convert_coordinates(elem, numbertype):
+    '''Converts all coordinates of an element or group to numbertype.'''
+    for geomelem in geometry_elements(elem):
+        for cmd in geomelem.commands:
+            for point in cmd.parameters:
+                point.x = numbertype(point.x)
+                point.y = numbertype(point.y)
+
+
+def convert_numbers(root, numbertype):
+    '''Converts every Decimal reachable from root to numbertype in place.
+
+    Walks the attributes of svglib objects and the items of lists,
+    dictionaries and tuples, so the offsets of deltas, the keyframes of
+    animations and the parameters of transforms are converted together with
+    the geometry. Returns the number of converted values.
+    '''
+    count = 0
+    seen = set()
+    stack = [root]
+
+    def convert(value):
+        nonlocal count
+        if isinstance(value, Decimal):
+            count += 1
+            return numbertype(value)
+        if isinstance(value, tuple):
+            items = [convert(item) for item in value]
+            if all(new is old for new, old in zip(items, value)):
+                return value
+            if hasattr(value, "_fields"):
+                return type(value)(*items)
+            return type(value)(items)
+        if ((isinstance(value, (list, dict)) or
+                type(value).__module__.split(".")[0] == "svglib") and
+                id(value) not in seen):
+            seen.add(id(value))
+            stack.append(value)
+        return value
+
+    seen.add(id(root))
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, list):
+            for idx, value in enumerate(obj):
+                new = convert(value)
+                if new is not value:
+                    obj[idx] = new
+        elif isinstance(obj, dict):
+            for key, value in list(obj.items()):
+                new = convert(value)
+                if new is not value:
+                    obj[key] = new
+        else:
+            attributes = getattr(obj, "__dict__", {})
+            for name, value in list(attributes.items()):
+                new = convert(value)
+                if new is not value:
+                    attributes[name] = new
+            for cls in type(obj).__mro__:
+                slots = cls.__dict__.get("__slots__", ())
+                for name in [slots] if isinstance(slots, str) else slots:
+                    if name.startswith("__") or not hasattr(obj, name):
+                        continue
+                    value = getattr(obj, name)
+                    new = convert(value)
+                    if new is not value:
+                        setattr(obj, name, new)
+    return count
+
+
+# --------------------------------------------------------------------------- #
+# Declare module globals
+# --------------------------------------------------------------------------- #
+log = logging.getLogger(__name__)
@@ -6,7 +6,9 @@
 # Import libraries
 # --------------------------------------------------------------------------- #
 import logging
-import copy
+import collections
+import re
+import threading
 import xml.etree.ElementTree as ET
 from pathlib import Path
 from decimal import Decimal
@@ -17,6 +19,13 @@ import svglib
 from svglib import round_decimal
 import simplesignals as sisi
 
+import atlas
+import dollcache
+import geometry
+import profiling
+import skeleton
+import svgio
+
 
 # --------------------------------------------------------------------------- #
 # Define classes
@@ -42,8 +51,9 @@ class MDial(MBase):
          <animation name="" weight="1"/>
      </dial>
      '''
-    def __init__(self, name, minimum=1, maximum=100):
+    def __init__(self, name, minimum=1, maximum=100, editor=None):
         MBase.__init__(self)
+        self.editor = editor  # the MPaperdollEditor owning this dial
         self.name = name
         self.minimum = minimum
         self.maximum = maximum
@@ -55,24 +65,11 @@ class MDial(MBase):
 
     @property
     def value(self):
-        '''Returns the value of the dial based on stored animation values.'''
+        '''Returns the value of the dial based on the animation states.'''
         # the whole range of the dial is split between the animations
         # according to their weight
         # each segment is filled according to animation progress
-        dialrange = self.maximum - self.minimum
-        dialval = 0.0
-        weightsum = sum([animdata["weight"] for animdata
-                         in self.animations.values()])
-        for animname, animdata in self.animations.items():
-            animstate = editor.state[animname]
-            # calculate the porting of slider value this animation represents
-            animportion = dialrange * animdata["weight"] / weightsum
-            # calculate animation progress
-            progress = ((animstate - animdata["minimum"]) /
-                        (animdata["maximum"] - animdata["minimum"]))
-            # adjust slider value
-            dialval += animportion * progress
-        return round(dialval)
+        return self.editor.dialengine.values(self.editor.state)[self.name]
 
 #    def animation_state(self, name):
 #        '''Returns the last known state for this animation.'''
@@ -89,23 +86,6 @@ class MDial(MBase):
 #        '''Returns True if this dial influences the state of this animation.'''
 #        return name in self.animations
 
-    def update_animation_value(self, name, dialchange=0, animchange=0):
-        '''If a state changed we need to update the animation value.'''
-        if dialchange is 0 and animchange is 0:
-            raise ValueError("Do not update the animation value if neither " +
-                             "the dial state nor the animation state changed.")
-        animdata = self.animations[name]
-        # calculate the new value of this animation
-        if dialchange is not 0:
-            animval = (dialchange * animdata["weight"]) + animdata["value"]
-        else:
-            animval = animchange + animdata["value"]
-        # limit the value and store it
-        animval = max(animval, animdata["minimum"])
-        animval = min(animval, animdata["maximum"])
-        animdata["value"] = animval
-        return animval
-
     def change_value(self, newval):
         '''This changes the value of the dial to the specified number.'''
         oldval = self.value
@@ -114,48 +94,308 @@ class MDial(MBase):
         newval = min(newval, self.maximum)
         if oldval == newval:
             return oldval
-        # update the animations
-        statechange = newval - oldval
-        for animname, animdata in self.animations.items():
-            animval = self.update_animation_value(animname,
-                                                  dialchange=statechange)
-            # check if the new value is different from the current state
-            oldstate = editor.state[animname]
-            newstate = round(animval)  # round to int
-            if oldstate != newstate:
-#                sisi.disconnect(self.on__state_changed, signal="state changed",
-#                     channel="editor")
-                self.ignore_state_change = True
-                sisi.send(signal="set state", channel="editor", sender=self,
-                          data={"field": animname, "value": newstate})
-                self.ignore_state_change = False
-#                sisi.connect(self.on__state_changed, signal="state changed",
-#                     channel="editor")
-                # update the view
-                sisi.send(signal="update dial state", sender=self,
-                          data=newstate)
+        # update the animations; the view already shows the new value
+        self.ignore_state_change = True
+        try:
+            self.editor.apply_dials({self.name: newval})
+        finally:
+            self.ignore_state_change = False
         return newval
 
+    def disconnect_signals(self):
+        sisi.disconnect(self.on__state_changed, signal="state changed",
+                        channel="editor")
+
     def on__state_changed(self, sender, data):
+        if sender is not self.editor:
+            return  # the state of another editor changed
         if self.ignore_state_change is True:
             return
-        animname = data["field"]
-        if animname not in self.animations:
+        if not any(animname in self.animations for animname in data):
             return
-        newstate = data["new"]
-        oldstate = data["old"]
-        # update the internal animation value
-        self.update_animation_value(animname, animchange=newstate - oldstate)
-        # calculate new value of slider based on change in animation value
-        # and send it to the view
+        # send the new value of the slider to the view
         sisi.send(signal="update dial state", sender=self, data=self.value)
 
 
+class DialEngine(object):
+    '''Maps dial values to animation states for all dials at once.
+
+    All dials are compiled into dense matrices with one row per dial and one
+    column per animation: the weights, the animation ranges, the portion of
+    the dial range each animation represents and the unrounded animation
+    value each dial tracks. Moving any number of dials is then one
+    clamp-and-multiply over these matrices. Without NumPy the matrices are
+    nested lists and the same math runs in loops.
+    '''
+    def __init__(self, dials):
+        self.dialnames = sorted(dials)
+        self.animnames = sorted({animname for dial in dials.values()
+                                 for animname in dial.animations})
+        self.dialindex = {name: idx for idx, name
+                          in enumerate(self.dialnames)}
+        self.animindex = {name: idx for idx, name
+                          in enumerate(self.animnames)}
+        shape = (len(self.dialnames), len(self.animnames))
+        rows = {name: [[0.0] * shape[1] for _ in range(shape[0])]
+                for name in ("member", "weight", "minimum", "maximum",
+                             "value", "portion")}
+        self.dialmin = [dials[name].minimum for name in self.dialnames]
+        self.dialmax = [dials[name].maximum for name in self.dialnames]
+        for row, dialname in enumerate(self.dialnames):
+            dial = dials[dialname]
+            weightsum = sum(animdata["weight"]
+                            for animdata in dial.animations.values())
+            for animname, animdata in dial.animations.items():
+                col = self.animindex[animname]
+                rows["member"][row][col] = 1.0
+                for key in ("weight", "minimum", "maximum", "value"):
+                    rows[key][row][col] = float(animdata[key])
+                rows["portion"][row][col] = ((dial.maximum - dial.minimum) *
+                                             animdata["weight"] / weightsum)
+        # members with an empty range never make progress
+        rows["span"] = [[(high - low) or 1.0 for low, high in zip(*pair)]
+                        for pair in zip(rows["minimum"], rows["maximum"])]
+        if geometry.numpy is not None:
+            rows = {key: geometry.numpy.array(matrix, dtype=float)
+                    .reshape(shape) for key, matrix in rows.items()}
+            rows["member"] = rows["member"].astype(bool)
+        self.member = rows["member"]  # True where a dial moves an animation
+        self.weight = rows["weight"]  # animation steps per dial step
+        self.minimum = rows["minimum"]
+        self.maximum = rows["maximum"]
+        self.span = rows["span"]  # maximum - minimum, 1 for empty ranges
+        self.value = rows["value"]  # the unrounded state each dial tracks
+        self.portion = rows["portion"]  # dial range share of animations
+
+    def state_vector(self, state):
+        return [float(state[animname]) for animname in self.animnames]
+
+    def values(self, state):
+        '''Returns a dictionary mapping dial names to their values.'''
+        vector = self.state_vector(state)
+        if geometry.numpy is not None:
+            progress = (geometry.numpy.array(vector) - self.minimum) / self.span
+            sums = (self.portion * progress).sum(axis=1).tolist()
+        else:
+            sums = []
+            for row in range(len(self.dialnames)):
+                sums.append(sum(
+                    self.portion[row][col] *
+                    (animstate - self.minimum[row][col]) / self.span[row][col]
+                    for col, animstate in enumerate(vector)))
+        return {name: round(dialsum)
+                for name, dialsum in zip(self.dialnames, sums)}
+
+    def apply(self, mapping, state):
+        '''Moves the dials in mapping to their new values.
+
+        All dials start from the values they have in state. If several moved
+        dials control one animation, the dial sorting last wins. Returns a
+        dictionary mapping the animations whose state changed to their new
+        integer states. Dials that were not moved but control one of these
+        animations follow its change.
+        '''
+        oldvalues = self.values(state)
+        change = [0.0] * len(self.dialnames)
+        for dialname, newval in mapping.items():
+            row = self.dialindex[dialname]
+            newval = min(max(newval, self.dialmin[row]), self.dialmax[row])
+            change[row] = float(newval - oldvalues[dialname])
+        moved = [row for row, delta in enumerate(change) if delta]
+        if not moved:
+            return {}
+        newstates = {}
+        if geometry.numpy is not None:
+            numpy = geometry.numpy
+            rows = numpy.array(moved)
+            delta = numpy.array(change)[rows, None]
+            member = self.member[rows]
+            values = numpy.clip(self.value[rows] + delta * self.weight[rows],
+                                self.minimum[rows], self.maximum[rows])
+            self.value[rows] = numpy.where(member, values, self.value[rows])
+            for row, rowmember, rowvalues in zip(moved, member, values):
+                for col in numpy.flatnonzero(rowmember).tolist():
+                    newstates[self.animnames[col]] = int(round(
+                        float(rowvalues[col])))
+        else:
+            for row in moved:
+                for col, animname in enumerate(self.animnames):
+                    if not self.member[row][col]:
+                        continue
+                    animval = (self.value[row][col] +
+                               change[row] * self.weight[row][col])
+                    animval = max(animval, self.minimum[row][col])
+                    animval = min(animval, self.maximum[row][col])
+                    self.value[row][col] = animval
+                    newstates[animname] = int(round(animval))
+        changed = {animname: animstate
+                   for animname, animstate in newstates.items()
+                   if animstate != state[animname]}
+        # dials that were not moved but share the changed animations follow
+        for animname, animstate in changed.items():
+            self.follow(animname, state[animname], animstate, exclude=moved)
+        return changed
+
+    def follow(self, animname, old, new, exclude=()):
+        '''Moves the values of all dials controlling animname by new - old.
+
+        Called when an animation state is changed without the dial, e.g. by
+        another dial. exclude holds the rows of dials that do not follow.
+        '''
+        col = self.animindex.get(animname, None)
+        if col is None:
+            return
+        for row in range(len(self.dialnames)):
+            if self.member[row][col] and row not in exclude:
+                animval = self.value[row][col] + (new - old)
+                animval = max(animval, self.minimum[row][col])
+                animval = min(animval, self.maximum[row][col])
+                self.value[row][col] = animval
+
+    def reset(self, state):
+        '''Sets the values of all dials to the animation states.'''
+        for row in range(len(self.dialnames)):
+            for col, animname in enumerate(self.animnames):
+                if self.member[row][col]:
+                    self.value[row][col] = float(state[animname])
+
+
+class FrameCache(object):
+    '''A least recently used cache for the frames of one animation.
+
+    The memory budget is the number of points of all cached frames. When it
+    is exceeded the least recently used frames are dropped.
+    '''
+    def __init__(self, maxpoints=100000):
+        self.maxpoints = maxpoints
+        self.points = 0  # the number of points of all cached frames
+        self.hits = 0
+        self.misses = 0
+        self.frames = collections.OrderedDict()  # maps keys to frames
+
+    def __len__(self):
+        return len(self.frames)
+
+    @property
+    def stats(self):
+        '''Returns the cache statistics as a dictionary.'''
+        return {"hits": self.hits, "misses": self.misses,
+                "frames": len(self.frames), "points": self.points}
+
+    def get(self, key):
+        '''Returns the frame stored for key or None.'''
+        entry = self.frames.get(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.frames.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, frame):
+        '''Stores the frame for key and drops frames over the budget.'''
+        points = count_points(frame)
+        if key in self.frames:
+            self.points -= self.frames.pop(key)[1]
+        self.frames[key] = (frame, points)
+        self.points += points
+        while self.points > self.maxpoints and len(self.frames) > 1:
+            oldkey, (oldframe, oldpoints) = self.frames.popitem(last=False)
+            self.points -= oldpoints
+
+    def clear(self):
+        self.frames.clear()
+        self.points = 0
+
+
+class GeometryContext(object):
+    '''Resolves the geometry elements of one draw, each at most once.
+
+    A conforming element depends on the element its delta targets. resolve()
+    resolves the target before the element, so the elements are evaluated in
+    topological order of these dependencies, and remembers every result
+    until the draw ends. Resolved elements are shared and must be copied
+    before they are modified.
+    '''
+    def __init__(self, editor):
+        self.editor = editor
+        self.resolved = {}  # maps element ids to resolved elements
+        self.resolving = []  # the ids whose targets are being resolved
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def stats(self):
+        '''Returns the cache statistics as a dictionary.'''
+        return {"geometry_hits": self.hits,
+                "geometry_misses": self.misses}
+
+    def source(self, geomid):
+        '''Returns the unconformed element geomid of the editor.'''
+        geomelem = self.editor.geometry.get(geomid, None)
+        if geomelem is None:
+            geomelem = self.editor.dollgeometry[geomid]
+        return geomelem
+
+    def resolve(self, geomid, geomelem=None):
+        '''Returns the element geomid conformed to its target.
+
+        geomelem is the unconformed element, e.g. a path in a group; by
+        default it is looked up in the geometry of the editor. Raises a
+        ValueError if the conform targets form a cycle.
+        '''
+        resolved = self.resolved.get(geomid, None)
+        if resolved is not None:
+            self.hits += 1
+            return resolved
+        if geomid in self.resolving:
+            cycle = self.resolving[self.resolving.index(geomid):] + [geomid]
+            raise ValueError("Conforming geometry forms a cycle: %s" %
+                             " -> ".join(cycle))
+        self.misses += 1
+        if geomelem is None:
+            geomelem = self.source(geomid)
+        delta = getattr(geomelem, "delta", None)
+        if delta is not None:
+            self.resolving.append(geomid)
+            try:
+                targetelem = self.resolve(delta.trgtelem.connectivity)
+            finally:
+                self.resolving.pop()
+            geomelem = self.editor.conform(geomid, delta, targetelem)
+        self.resolved[geomid] = geomelem
+        return geomelem
+
+
 class MPaperdollEditor(MBase):
     '''Represents the state of the paperdoll editor application.
+
+    The numeric mode "decimal" keeps the coordinates svglib creates. The
+    opt-in mode "float" converts all numbers of the loaded description
+    files to floats, including deltas and keyframes, and converts frames
+    after interpolating, so conforming and transforms use float math only;
+    coordinates are only converted to rounded decimals at the end of draw().
+
+    If compiled is False, frames are always interpolated by svglib and
+    paths are conformed by their svglib deltas, without frame atlases and
+    conform maps. Such an editor draws the reference output for checking
+    that the compiled paths draw the same doll.
+
+    If cache is True, the description files are loaded from the compiled
+    doll cache when the files did not change since they were last parsed.
+
+    The time each loading phase took is stored in startup_profile. If
+    profile is True, memory allocations are measured too.
     '''
-    def __init__(self):
+    def __init__(self, dolldir="../dollfiles", numeric="decimal",
+                 cache=True, profile=False, compiled=True):
         MBase.__init__(self)
+        self.startup = profiling.PhaseTimer(allocations=profile)
+        if numeric not in {"decimal", "float"}:
+            raise ValueError("Unknown numeric mode '%s'" % numeric)
+        self.numeric = numeric
+        self.compiled = compiled
+        self.cache = cache
         self.state = {}
         self.layers = []
         self.dollgeometry = {}  # the geometry that was drawn last
@@ -164,34 +404,140 @@ class MPaperdollEditor(MBase):
         self.connectivity = {}
         self.geometry = {}
         self.animations = {}
+        self.combinations = {}  # maps combined animations to their parts
         self.dials = {}
+        # incremental drawing
+        self.producers = {}  # maps geometry ids to the animation drawing them
+        self.outlinebases = {}  # maps outline ids to their base geometry
+        self.dependents = {}  # maps animation names to what they change
+        self.outlinedeps = {}  # maps outline ids to animation names
+        self.layerdeps = {}  # maps layer indices to animation names
+        self.posedlayers = set()  # indices of layers posed by the skeleton
+        self.framecache = {}  # maps animation names to frame caches
+        self.outlinecache = {}  # maps outline ids to their last outline
+        self.layercache = {}  # maps layer indices to their last layer
+        self.changed_layers = []  # names of the layers drawn by last draw
+        self.layerelems = []  # the layer groups of the last draw in order
+        self.layerrefs = {}  # maps layer indices to the def ids they use
+        self.defscache = {}  # maps sets of def ids to shared defs elements
+        self.conform_calls = 0  # the number of conform calls in this draw
+        self.conformmaps = {}  # maps element ids to compiled conforming
+        self.descpaths = []  # the paths of the description files
+        self.cache_dirty = False  # True if the doll cache must be written
+        self.drawlock = threading.RLock()  # held while drawing
+        # the state and style overrides being drawn and the GeometryContext
+        # of the draw are local to the drawing thread, so other threads
+        # never see the snapshot of a draw running on a worker
+        self.drawlocal = threading.local()
+        self.layerstyles = {}  # the style overrides of the cached layers
+        self.draw_profile = None  # stage timings of the last draw
         # parse paperdoll ressource files
-        dolldir = Path("../dollfiles").resolve()
-        for descfilepath in dolldir.glob("*.xml"):
-            descfile = svglib.DescriptionFile(descfilepath)
-            # parse paperdoll description file
-            descfile.load_connectivity()
-            descfile.load_geometry()
-            descfile.load_animations()
-            # store paperdoll description file
-            descfilename = descfile.path.name
-            assert descfilename not in self.dollfiles, descfilename
-            self.dollfiles[descfilename] = descfile
+        dolldir = Path(dolldir).resolve()
+        self.dollfiles, conformmaps = self.load_dollfiles(dolldir, cache)
         for content in ("connectivity", "geometry", "animations"):
-            for filename in sorted(self.dollfiles):
-                descfile = self.dollfiles[filename]
-                self.load_content(descfile, content)
+            with self.startup.phase("load_content", content=content) as rec:
+                for filename in sorted(self.dollfiles):
+                    descfile = self.dollfiles[filename]
+                    self.load_content(descfile, content)
+                rec["counts"][content] = len(getattr(self, content))
         for filename in sorted(self.dollfiles):
-            self.load_doll_file(self.dollfiles[filename])
+            with self.startup.phase("load_doll_file", file=filename) as rec:
+                layercount = len(self.layers)
+                self.load_doll_file(self.dollfiles[filename])
+                rec["counts"]["layers"] = len(self.layers) - layercount
+        self.dialengine = DialEngine(self.dials)
+        self.skeleton = skeleton.Skeleton.from_description(
+            self.dollfiles.get("skeleton.xml", None), self.animations)
+        # conforming is compiled before numbers are converted, so the doll
+        # cache is the same in both numeric modes
+        if conformmaps is None and compiled:
+            with self.startup.phase("compile_conform") as rec:
+                conformmaps = self.compile_conform()
+                rec["counts"]["maps"] = len(conformmaps)
+            self.cache_dirty = True
+        if cache and self.cache_dirty:
+            with self.startup.phase("save_cache"):
+                dollcache.save(dolldir, self.descpaths, self.dollfiles,
+                               conformmaps)
+        self.conformmaps = conformmaps if compiled else {}
+        if self.numeric == "float":
+            with self.startup.phase("convert_numbers") as rec:
+                rec["counts"]["numbers"] = sum(
+                    geometry.convert_numbers(descfile, float)
+                    for descfile in self.dollfiles.values())
+                # the templates of the maps are the only other numbers
+                rec["counts"]["numbers"] += sum(
+                    geometry.convert_numbers(conformmap.template, float)
+                    for conformmap in self.conformmaps.values())
+        # memory-map baked frame atlases
+        self.atlases = {}  # maps animation names to frame atlases
+        self.atlasfiles = []  # every opened atlas, closed by close
+        for filename in sorted(self.dollfiles if compiled else ()):
+            descfile = self.dollfiles[filename]
+            with self.startup.phase("load_atlas", file=filename) as rec:
+                frameatlas = atlas.load(descfile)
+                if frameatlas is None:
+                    continue
+                self.atlasfiles.append(frameatlas)
+                rec["counts"]["animations"] = len(frameatlas.entries)
+            for animname, entry in frameatlas.entries.items():
+                # skip animations that were ignored because of their name
+                if self.animations.get(animname) is not (
+                        descfile.animations.get(animname)):
+                    continue
+                # decimal mode only uses frames float64 stores exactly
+                if self.numeric == "decimal" and not entry["exact"]:
+                    continue
+                self.atlases[animname] = frameatlas
+        with self.startup.phase("collect_defs") as rec:
+            self.defs = self.collect_defs()
+            rec["counts"]["defs"] = len(self.defs)
+        self.startup.stop()
+        self.startup_profile = self.startup.report()
         # initialize animation state
-        for animname in self.animations:
-            self.state[animname] = 40
+        for animname, anim in self.animations.items():
+            self.state[animname] = anim.default_state
+        self.reset_dials()
         # connect simple signals
         sisi.connect(self.on__set_state, signal="set state")
         sisi.connect(self.on__draw_doll, signal="draw doll")
         sisi.connect(self.on__export_doll, signal="export doll")
         sisi.connect(self.on__set_style, signal="set style")
 
+    @property
+    def drawstate(self):
+        '''Returns the state drawn on this thread; None outside draws.'''
+        return getattr(self.drawlocal, "state", None)
+
+    @drawstate.setter
+    def drawstate(self, state):
+        self.drawlocal.state = state
+
+    @property
+    def drawstyles(self):
+        '''Returns the style overrides drawn on this thread.'''
+        return getattr(self.drawlocal, "styles", None)
+
+    @drawstyles.setter
+    def drawstyles(self, styles):
+        self.drawlocal.styles = styles
+
+    @property
+    def geomcontext(self):
+        '''Returns the GeometryContext of the draw on this thread.'''
+        return getattr(self.drawlocal, "geomcontext", None)
+
+    @geomcontext.setter
+    def geomcontext(self, context):
+        self.drawlocal.geomcontext = context
+
+    @property
+    def current_state(self):
+        '''Returns the state being drawn or, outside draws, the state.'''
+        if self.drawstate is None:
+            return self.state
+        return self.drawstate
+
     @property
     def frames(self):
         '''Returns the animation frames corresponding to the current state.'''
@@ -208,16 +554,209 @@ class MPaperdollEditor(MBase):
         '''Return the current frame of this animation.
 
         If a state is given the frame corresponding to that state is returned.
+        Frames are cached, so they must be copied before they are modified.
         '''
         anim = self.animations[name]
         if state is None:
-            state = self.state[name]
+            state = self.current_state[name]
+        # combined animations also consult the states of their parts
+        key = (state,)
         if isinstance(anim, svglib.CombinedAnimation):
-            frame = anim.get_frame(state, self.state.copy())
+            partnames = self.animation_dependencies(name) - {name}
+            key += self.state_key(partnames)
+        cache = self.framecache.get(name, None)
+        if cache is None:
+            cache = FrameCache(frame_cache_points)
+            self.framecache[name] = cache
+        frame = cache.get(key)
+        if frame is not None:
+            return frame
+        frameatlas = self.atlases.get(name, None)
+        if frameatlas is not None and frameatlas.has_frame(name, state):
+            frame = frameatlas.frame(name, state, anim)
+        elif isinstance(anim, svglib.CombinedAnimation):
+            frame = anim.get_frame(state, dict(self.current_state))
         else:
             frame = anim.get_frame(state)
+        if self.numeric == "float":
+            geometry.convert_coordinates(frame, float)
+        cache.put(key, frame)
         return frame
 
+    def animation_dependencies(self, name):
+        '''Returns the names of the animations that change this animation.
+
+        Combined animations depend on their own state and the states of the
+        animations they combine.
+        '''
+        names = {name}
+        for partname in self.combinations.get(name, ()):
+            if partname not in names:
+                names |= self.animation_dependencies(partname)
+        return names
+
+    def geometry_dependencies(self, geomid, visited=None):
+        '''Returns the names of the animations that change this geometry.
+
+        Geometry depends on the animation drawing it, the base geometry of
+        outlines and the targets of conforming elements.
+        '''
+        if visited is None:
+            visited = set()
+        if geomid in visited:
+            return set()
+        visited.add(geomid)
+        names = set()
+        animname = self.producers.get(geomid, None)
+        if animname is not None:
+            names |= self.animation_dependencies(animname)
+        baseid = self.outlinebases.get(geomid, None)
+        if baseid is not None:
+            names |= self.geometry_dependencies(baseid, visited)
+        geomelem = self.geometry.get(geomid, None)
+        if geomelem is None:
+            return names
+        elems = [geomelem]
+        if isinstance(geomelem, svglib.SvgGroup):
+            elems.extend(geomelem.iterate())
+        for elem in elems:
+            delta = getattr(elem, "delta", None)
+            if delta is not None:
+                targetid = delta.trgtelem.connectivity
+                names |= self.geometry_dependencies(targetid, visited)
+        return names
+
+    def state_key(self, names):
+        '''Returns the states of the named animations as a hashable key.'''
+        state = self.current_state
+        return tuple(state.get(name, None) for name in sorted(names))
+
+    def build_dependency_graph(self):
+        '''Maps animation names to everything their state changes.
+
+        For each animation dependents stores the layers, outlines and
+        conform targets that depend on it. The graph is built after the
+        first full draw, when it is known which animation draws which
+        geometry. Layers posed by the skeleton are redrawn together, so they
+        share their dependencies.
+        '''
+        def dependent(name):
+            if name not in self.dependents:
+                self.dependents[name] = {"layers": set(), "outlines": set(),
+                                         "targets": set()}
+            return self.dependents[name]
+        self.dependents = {}
+        self.outlinedeps = {}
+        self.layerdeps = {}
+        for idx, layer in enumerate(self.layers):
+            names = set()
+            for content in layer["content"]:
+                contenttag = content.get("tag", None)
+                if contenttag == "animation":
+                    names |= self.animation_dependencies(content["name"])
+                elif contenttag == "trace_outline":
+                    outlinenames = self.geometry_dependencies(content["id"])
+                    self.outlinedeps[content["id"]] = outlinenames
+                    for name in outlinenames:
+                        dependent(name)["outlines"].add(content["id"])
+                    names |= outlinenames
+                else:
+                    names |= self.geometry_dependencies(content["geometry"])
+            self.layerdeps[idx] = names
+        posednames = set(self.skeleton.animations.values())
+        for idx in self.posedlayers:
+            posednames |= self.layerdeps[idx]
+        for idx in self.posedlayers:
+            self.layerdeps[idx] = posednames
+        for idx, names in self.layerdeps.items():
+            for name in names:
+                dependent(name)["layers"].add(self.layers[idx]["name"])
+        for geomelem in self.geometry.values():
+            elems = [geomelem]
+            if isinstance(geomelem, svglib.SvgGroup):
+                elems.extend(geomelem.iterate())
+            for elem in elems:
+                delta = getattr(elem, "delta", None)
+                if delta is not None:
+                    targetid = delta.trgtelem.connectivity
+                    for name in self.geometry_dependencies(targetid):
+                        dependent(name)["targets"].add(targetid)
+
+    def animation_elements(self, name):
+        '''Returns the geometry elements of the current animation frame.
+
+        The elements belong to a cached frame, so they must be copied before
+        they are modified.
+        '''
+        frame = self.animation_frame(name)
+        # add geometry elements that should be drawn to the doll
+        if isinstance(frame, svglib.SvgGroup):
+            return list(frame.iterate())
+        return [frame]
+
+    def frame_cache_stats(self):
+        '''Returns the frame cache statistics of each animation.'''
+        return {name: cache.stats for name, cache in self.framecache.items()}
+
+    def outline_element(self, content):
+        '''Returns the outline described by a trace_outline layer content.
+
+        Like animation_elements() the outline is reused while its base
+        geometry does not change and must be copied before it is modified.
+        '''
+        elemid = content["id"]
+        key = None
+        if elemid in self.outlinedeps:
+            key = self.state_key(self.outlinedeps[elemid])
+            cached = self.outlinecache.get(elemid, None)
+            if cached is not None and cached[0] == key:
+                return cached[1]
+        base_geometry = self.get_geometry(content["base_geometry"])
+        start = int(content["start"])
+        end = int(content["end"])
+        elem = self.trace_outline(base_geometry, elemid, start, end)
+        self.outlinecache[elemid] = (key, elem)
+        return elem
+
+    def load_dollfiles(self, dolldir, cache=True):
+        '''Returns the parsed description files in dolldir by file name.
+
+        Also returns the conform maps compiled for these files, or None if
+        they were not compiled yet. If the files were parsed, cache_dirty
+        is True and the editor saves them once the maps are compiled.
+        '''
+        self.cache_dirty = False
+        with self.startup.phase("glob") as rec:
+            descpaths = sorted(dolldir.glob("*.xml"))
+            rec["counts"]["files"] = len(descpaths)
+        self.descpaths = descpaths
+        if cache:
+            with self.startup.phase("load_cache") as rec:
+                cached = dollcache.load(dolldir, descpaths)
+                rec["counts"]["files"] = len(cached["dollfiles"]
+                                             if cached else ())
+            if cached is not None:
+                return cached["dollfiles"], cached["conformmaps"]
+        dollfiles = {}
+        for descfilepath in descpaths:
+            filename = descfilepath.name
+            with self.startup.phase("DescriptionFile", file=filename) as rec:
+                descfile = svglib.DescriptionFile(descfilepath)
+                rec["counts"]["xml_elements"] = sum(1 for xmlelem
+                                                    in descfile.tree.iter())
+            # parse paperdoll description file
+            for content in ("connectivity", "geometry", "animations"):
+                with self.startup.phase("load_" + content,
+                                        file=filename) as rec:
+                    getattr(descfile, "load_" + content)()
+                    rec["counts"][content] = len(getattr(descfile, content))
+            # store paperdoll description file
+            descfilename = descfile.path.name
+            assert descfilename not in dollfiles, descfilename
+            dollfiles[descfilename] = descfile
+        self.cache_dirty = True
+        return dollfiles, None
+
     def load_content(self, file, attribute):
         source = getattr(file, attribute)
         target = getattr(self, attribute)
@@ -257,8 +796,20 @@ class MPaperdollEditor(MBase):
                         data = layerchild.attrib.copy()
                         data["tag"] = layerchild.tag
                         layercontent.append(data)
+                        if layerchild.tag == "trace_outline":
+                            baseid = data["base_geometry"]
+                            self.outlinebases[data["id"]] = baseid
                 self.layers.append({"name": name,
                                     "content": layercontent})
+        # load the animations mixed by combined animations
+        xmlanims = descfile.tree.find("animations")
+        if xmlanims is not None:
+            for xmlelem in xmlanims:
+                if xmlelem.tag == "combined":
+                    name = xmlelem.get("name", None)
+                    self.combinations[name] = [xmlanim.get("name", None)
+                                               for xmlanim in xmlelem
+                                               if xmlanim.tag == "animation"]
         # load dials
         log.info("Load dials")
         xmllayers = descfile.tree.find("dials")
@@ -273,7 +824,8 @@ class MPaperdollEditor(MBase):
                 else:
                     minimum = int(xmlelem.get("min", None))
                     maximum = int(xmlelem.get("max", None))
-                    dial = MDial(name, minimum=minimum, maximum=maximum)
+                    dial = MDial(name, minimum=minimum, maximum=maximum,
+                                 editor=self)
                     self.dials[name] = dial
                 # add animations to dial
                 for xmlanim in xmlelem:
@@ -285,15 +837,65 @@ class MPaperdollEditor(MBase):
         return descfile
 
     def get_geometry(self, geomid):
-        geomelem = self.geometry.get(geomid, None)
-        if geomelem is None:
-            geomelem = self.dollgeometry[geomid]
-        delta = getattr(geomelem, "delta", None)
-        if delta is not None:
-            targetid = delta.trgtelem.connectivity
-            targetelem = self.get_geometry(targetid)
-            geomelem = delta.conform(geomid, targetelem)
-        return geomelem
+        '''Returns the element geomid conformed to its target.
+
+        During a draw the element is resolved once by the GeometryContext of
+        the draw and shared by all callers.
+        '''
+        if self.geomcontext is not None:
+            return self.geomcontext.resolve(geomid)
+        return GeometryContext(self).resolve(geomid)
+
+    def compile_conform(self):
+        '''Returns a ConformMap for every conforming path of the doll.
+
+        The targets are drawn at the default states of their animations.
+        The maps are linear in the target, so they conform every state.
+        Paths whose target cannot be resolved are compiled when they are
+        first drawn. Without NumPy no maps are compiled.
+        '''
+        self.conformmaps = {}
+        if geometry.numpy is None:
+            return self.conformmaps
+        states = {animname: anim.default_state
+                  for animname, anim in self.animations.items()}
+        self.dollgeometry = {}
+        for animname, anim in self.animations.items():
+            if isinstance(anim, svglib.CombinedAnimation):
+                frame = anim.get_frame(states[animname], states)
+            else:
+                frame = anim.get_frame(states[animname])
+            for elem in geometry.geometry_elements(frame):
+                self.dollgeometry.setdefault(elem.elemid, elem)
+        context = GeometryContext(self)
+        for geomelem in self.geometry.values():
+            for elem in geometry.geometry_elements(geomelem):
+                if getattr(elem, "delta", None) is None:
+                    continue
+                try:
+                    context.resolve(elem.elemid, elem)
+                except (KeyError, ValueError) as err:
+                    log.warning("Conforming %s was not compiled: %s",
+                                elem.elemid, err)
+        self.dollgeometry = {}
+        self.conform_calls = 0
+        return self.conformmaps
+
+    def conform(self, elemid, delta, targetelem):
+        '''Returns a new element conforming elemid to targetelem.
+
+        With NumPy the delta of each path is compiled into a ConformMap at
+        startup, so conforming is a sparse matrix product. Paths that were
+        not compiled then are compiled when they are first conformed.
+        '''
+        self.conform_calls += 1
+        if geometry.numpy is None or not self.compiled:
+            return delta.conform(elemid, targetelem)
+        conformmap = self.conformmaps.get(elemid, None)
+        if conformmap is None or conformmap.delta is not delta:
+            conformmap = geometry.ConformMap(elemid, delta, targetelem)
+            self.conformmaps[elemid] = conformmap
+        return conformmap.conform(targetelem)
 
     def print_geometry(self):
         print()
@@ -316,89 +918,123 @@ class MPaperdollEditor(MBase):
         return svglib.SvgPath.from_path(geomelem, elemid, start, end)
 
     def transform_skeleton(self, svgdoc):
-        '''Apply current scale, translations and rotations to skeleton.
+        '''Poses the bones and body parts in svgdoc by the current state.
 
         This method assumes that all elements in svgdoc have the scale and
-        position they have in the SVG data files.
+        position they have in the SVG data files. Each bone and its body
+        part are transformed once with the world transform of the bone.
+        Returns the number of posed elements.
         '''
-        bonegroupmap = {"upper_arm_bone_l": "g_bone_arm_l",
-                        "lower_arm_bone_l": "g_bone_lower_arm_l"}
-        # replace all H and V commands in bones with L
-        # TODO do this for all elements
-        pelvisbone = svgdoc.idmap["g_bone_pelvis"]
-        boneidmap = pelvisbone.idmap.copy()
-        for subelem in pelvisbone.iterate():
-            if isinstance(subelem, svglib.SvgGeometryElement):
-                for cmd in subelem.commands:
-                    if cmd.commandletter in "HV":
-                        cmd.commandletter = "L"
-                    elif cmd.commandletter in "hv":
-                        cmd.commandletter = "l"
-        # determine "local" bone transformations
-        bonelist = ("upper_arm_bone_l", "lower_arm_bone_l",
-                         "hand_bone_l")
-        skeletondesc = self.dollfiles["skeleton.xml"]
-        for bonename in bonelist:
-            bone = boneidmap[bonename]
-            # find the transformation to create the rotated bone
-            animname = "rotate_" + bone.elemid
-            anim = skeletondesc.animations[animname]
-            animstate = self.state[animname]
-            tfcmd = anim.get_command(animstate)
-            # create the rotated bone
-            rotbone = bone.copy()
-            rotbone.transform(tfcmd)
-            # determine the operations to transform bone into rotbone
-            transforms = bone.transform_operations(rotbone)
-            scale, translation, angle, rotcenter = transforms
-            # apply transformations to bone or bone group
-            bonegroupname = bonegroupmap.get(bonename, None)
-            if bonegroupname is None:
-                tfbone = bone
+        matrices = self.skeleton.pose(self.current_state, self.animations)
+        # the pelvis group holds the bones drawn by the skeleton layer
+        pelvisbone = svgdoc.idmap.get("g_bone_pelvis", None)
+        boneidmap = {} if pelvisbone is None else pelvisbone.idmap
+        posedcount = 0
+        for bonename, matrix in matrices.items():
+            if matrix == skeleton.identity:
+                continue
+            for elem in (boneidmap.get(bonename, None),
+                         svgdoc.idmap.get(self.skeleton.bodypart(bonename),
+                                          None)):
+                if elem is None:
+                    continue
+                skeleton.replace_axis_commands(elem)
+                skeleton.transform_element(elem, matrix)
+                posedcount += 1
+        return posedcount
+
+    def posed_elements(self):
+        '''Returns the ids of the elements modified by transform_skeleton.'''
+        elemids = {"g_bone_pelvis"}
+        elemids.update(self.skeleton.elements())
+        return elemids
+
+    def draw_layer(self, layer, animationelems):
+        '''Returns a new layer group containing the content of layer.'''
+        # create layer element
+        layerelem = svglib.SvgGroup()
+        layerelem.elemid = "layer_" + layer["name"].lower()
+        layerelem.xmlattrib = {"inkscape:label": layer["name"],
+                               "inkscape:groupmode": "layer"}
+        # add geometry elements
+        for content in layer["content"]:
+            contenttag = content.get("tag", None)
+            if contenttag == "animation":
+                # animation frames and outlines are reused between draws,
+                # so the layer gets copies
+                elemlist = animationelems[content["name"]]
+                for unified_elem in elemlist:
+                    layerelem.append(unified_elem.copy())
+            elif contenttag == "trace_outline":
+                unified_elem = self.dollgeometry[content["id"]]
+                layerelem.append(unified_elem.copy())
             else:
-                tfbone = svgdoc.idmap[bonegroupname]
-            tfbone.rotate(angle, rotcenter.x, rotcenter.y)
-            tfbone.translate(translation.x, translation.y)
-            tfbone.scale(scale, scale)
-
-        # determine "global" bone transformations
-        bonetransforms = {}
-        basepelvisbone = skeletondesc.get_geometry("g_bone_pelvis")
-        baseboneidmap = basepelvisbone.idmap.copy()
-        for bonename in bonelist:
-            bone = boneidmap[bonename]
-            basebone = baseboneidmap[bonename]
-            # determine transformations to get from base position directly
-            # to the transformed position of this bone
-            transforms = basebone.transform_operations(bone)
-            scale, translation, angle, rotcenter = transforms
-            # store bone transformations
-            bonetflist = [("rotate", angle, rotcenter.x, rotcenter.y),
-                          ("translate", translation.x, translation.y),
-                          ("scale", scale, scale)]
-            bonetransforms[bonename] = bonetflist
-
-        # transform all geometry elements associated with each bone
-        for bonename in bonetransforms:
-            bodypart = svgdoc.idmap[bonename.replace("_bone", "")]
-            for tf in bonetransforms[bonename]:
-                operation = tf[0]
-                parameters = tf[1:]
-                method = getattr(bodypart, operation)
-                method(*parameters)
-#        upper_arm = svgdoc.idmap["upper_arm_l"]
-#        for tf in bonetransforms["upper_arm_bone_l"]:
-#            operation = tf[0]
-#            parameters = tf[1:]
-#            method = getattr(upper_arm, operation)
-#            method(*parameters)
-        return svgdoc
+                group = self.get_geometry(content["geometry"])
+                # create a copy of the group
+                groupelem = group.copy()
+                layerelem.append(groupelem)
+                # conforming paths are conformed into the copy, so the
+                # source geometry is never modified; copies do not keep the
+                # delta, so it is looked up on the source element
+                sources = geometry.geometry_elements(group)
+                copies = geometry.geometry_elements(groupelem)
+                for elem, elemcopy in zip(sources, copies):
+                    if getattr(elem, "delta", None) is not None:
+                        conformed = self.geomcontext.resolve(elem.elemid,
+                                                             elem)
+                        # the resolved element is shared by the whole draw
+                        # and later stages modify the commands in place
+                        elemcopy.commands = conformed.copy().commands
+        return layerelem
 
     #TODO when modifying the group structure of elements, transforms
     #TODO and styles from removed parent groups should be applied to children
-    def draw(self, width=600, height=800, viewbox="-300 0 600 800"):
-        '''Returns a SVG drawing in a string.'''
+    def draw(self, width=600, height=800, viewbox="-300 0 600 800",
+             incremental=True, state=None, styles=None):
+        '''Returns a SVG drawing of state with the style overrides styles.
+
+        state and styles default to the current state and style overrides.
+        Pass copies to draw on another thread while the current state keeps
+        changing. Only one draw runs at a time.
+        '''
+        if state is None:
+            state = dict(self.state)
+        if styles is None:
+            styles = dict(self.modified_styles)
+        with self.drawlock:
+            self.drawstate = state
+            self.drawstyles = styles
+            try:
+                return self.draw_document(width, height, viewbox,
+                                          incremental)
+            finally:
+                self.drawstate = None
+                self.drawstyles = None
+                self.geomcontext = None
+
+    def draw_document(self, width, height, viewbox, incremental):
+        '''Returns a SVG drawing of drawstate; called by draw().
+
+        If incremental is True, layers that do not depend on any animation
+        whose state changed since the last draw are taken from the last
+        drawing. The returned document then shares these layers with earlier
+        drawings, so it must not be modified.
+
+        The duration and counters of each stage of the draw are stored in
+        draw_profile.
+        '''
+        stages = profiling.PhaseTimer()
+        self.conform_calls = 0
+        # styles are applied while drawing a layer, so cached layers drawn
+        # with other style overrides cannot be reused
+        layerstyles = {elemid: str(style)
+                       for elemid, style in self.drawstyles.items()}
+        if layerstyles != self.layerstyles:
+            self.layercache = {}
+            self.layerstyles = layerstyles
         self.dollgeometry = {}
+        # conformed geometry is resolved once per draw
+        self.geomcontext = GeometryContext(self)
         # calculate the geometry elements that should be drawn from the
         # current animation frames
         animationelems = {}
@@ -407,101 +1043,59 @@ class MPaperdollEditor(MBase):
             for content in layer["content"]:
                 contenttag = content.get("tag", None)
                 if contenttag == "animation":
-                    anim = self.animations[content["name"]]
-                    animstate = self.state[anim.name]
-                    if isinstance(anim, svglib.CombinedAnimation):
-                        frame = anim.get_frame(animstate, self.state.copy())
-                    else:
-                        frame = anim.get_frame(animstate)
-                    # add geometry elements that should be drawn to the doll
-                    subelems = []
-                    if isinstance(frame, svglib.SvgGroup):
-                        for subelem in frame.iterate():
-                            subelems.append(subelem)
-                    else:
-                        subelems.append(frame)
-                    for elem in subelems:
+                    animname = content["name"]
+                    elemlist = self.animation_elements(animname)
+                    for elem in elemlist:
                         elid = elem.elemid
                         assert elid not in self.dollgeometry, elid
                         self.dollgeometry[elid] = elem
-                        try:
-                            animationelems[anim.name].append(elem)
-                        except KeyError:
-                            animationelems[anim.name] = [elem]
+                        self.producers[elid] = animname
+                    animationelems[animname] = elemlist
+        stages.lap("frames", animations=len(animationelems),
+                   elements=len(self.dollgeometry))
         # add outlines
+        outlinecount = 0
         for layer in self.layers:
 #            log.info("Retrace layer %s", layer["name"])
             for content in layer["content"]:
                 contenttag = content.get("tag", None)
                 if contenttag == "trace_outline":
-                    base_geometry_id = content["base_geometry"]
-                    base_geometry = self.get_geometry(base_geometry_id)
                     elemid = content["id"]
-                    start = int(content["start"])
-                    end = int(content["end"])
-#                    print("trace", base_geometry, "for", elemid)
-                    elem = self.trace_outline(base_geometry, elemid,
-                                              start, end)
+                    elem = self.outline_element(content)
                     assert elemid not in self.dollgeometry
                     self.dollgeometry[elemid] = elem
-        # add geometry elements in layers to svg document in draw order
+                    outlinecount += 1
+        # the counters are reported per stage
+        outlinestats = dict(self.geomcontext.stats,
+                            conform_calls=self.conform_calls)
+        stages.lap("outlines", elements=outlinecount, **outlinestats)
+        # add geometry elements in layers to svg document in draw order,
+        # reusing unchanged layers of the last drawing
         svgelem = svglib.SvgDocument()
         svgelem.elemid = "paperdoll1"
         svgelem.width = width
         svgelem.height = height
         svgelem.viewbox = viewbox
-        for layer in self.layers:
-            # create layer element
-            layerelem = svglib.SvgGroup()
-            layerelem.elemid = "layer_" + layer["name"].lower()
-            layerelem.xmlattrib = {"inkscape:label": layer["name"],
-                                   "inkscape:groupmode": "layer"}
+        drawnlayers = {}
+        layerelems = []
+        for idx, layer in enumerate(self.layers):
+            cached = self.layercache.get(idx, None)
+            if (incremental and cached is not None and
+                    cached[0] == self.state_key(self.layerdeps[idx])):
+                layerelem = cached[1]
+            else:
+                layerelem = self.draw_layer(layer, animationelems)
+                drawnlayers[idx] = layerelem
             svgelem.append(layerelem)
-            # add geometry elements
-            for content in layer["content"]:
-                contenttag = content.get("tag", None)
-                if contenttag == "animation":
-                    elemlist = animationelems[content["name"]]
-                    for unified_elem in elemlist:
-                        layerelem.append(unified_elem)
-                elif contenttag == "trace_outline":
-                    unified_elem = self.dollgeometry[content["id"]]
-                    layerelem.append(unified_elem)
-                else:
-                    group = self.get_geometry(content["geometry"])
-                    # create a copy of the group
-                    groupelem = group.copy()
-                    layerelem.append(groupelem)
-                    # add all geometry elements to the new group
-                    # TODO this should probably loop over groupelem, not group
-                    # TODO why do conforming paths break if we loop over groupelem?
-                    for elem in group.iterate():
-#                    for elem in groupelem.iterate():
-                        if isinstance(elem, svglib.SvgGeometryElement):
-                            # adjust conforming paths
-                            delta = getattr(elem, "delta", None)
-                            if delta is not None:
-                                targetid = elem.delta.trgtelem.connectivity
-                                targetelem = self.get_geometry(targetid)
-#                                targetelem = svgelem.idmap[targetid]
-                                elem.conform_to(targetelem)
-        # add defs to svg document
-        xmldefselem = ET.Element("defs", {"id": "defs_paperdoll1"})
-        descfile = self.dollfiles["linedoll.xml"]
-        datafile = descfile.svgfile
-        datasvgelem = datafile.tree.getroot()
-        datadefselem = datasvgelem.find(datafile.svgns("defs"))
-        for filterelem in datadefselem.findall(datafile.svgns("filter")):
-            xmldefselem.append(copy.deepcopy(filterelem))
-        for radialelem in datadefselem.findall(
-                datafile.svgns("radialGradient")):
-            xmldefselem.append(copy.deepcopy(radialelem))
-        for linearelem in datadefselem.findall(
-                datafile.svgns("linearGradient")):
-            xmldefselem.append(copy.deepcopy(linearelem))
-        svgelem.defs = xmldefselem
+            layerelems.append(layerelem)
+        stages.lap("layers", drawn=len(drawnlayers),
+                   reused=len(self.layers) - len(drawnlayers),
+                   **{key: value - outlinestats[key] for key, value
+                      in dict(self.geomcontext.stats,
+                              conform_calls=self.conform_calls).items()})
         # adjust style of elements
-        for layerelem in svgelem:
+        stylecount = 0
+        for layerelem in drawnlayers.values():
             layername = layerelem.xmlattrib["inkscape:label"]
             for elem in layerelem.iterate():
                 if elem.elemid.startswith("line_"):
@@ -524,19 +1118,56 @@ class MPaperdollEditor(MBase):
 #                        elem.style.visible = True
                 # adjust style as specified by the user
                 #TODO replace this hack by implementing style propagation
-                if elem.elemid in self.modified_styles:
-                    elem.style = self.modified_styles[elem.elemid]
-            if layerelem.elemid in self.modified_styles:
-                layerelem.style = self.modified_styles[layerelem.elemid]
-        # transform skeleton
-        svgelem = self.transform_skeleton(svgelem)
-        # round coordinates of all geometry elements
-        for elem in [el for el in svgelem.iterate()
-                     if isinstance(el, svglib.SvgGeometryElement)]:
+                if elem.elemid in self.drawstyles:
+                    elem.style = self.drawstyles[elem.elemid]
+                stylecount += 1
+            if layerelem.elemid in self.drawstyles:
+                layerelem.style = self.drawstyles[layerelem.elemid]
+        stages.lap("styles", elements=stylecount)
+        # add the defs used by the styles to the svg document
+        for idx, layerelem in drawnlayers.items():
+            self.layerrefs[idx] = referenced_ids(layerelem)
+        xmldefselem = self.shared_defs(
+            set().union(*[self.layerrefs[idx]
+                          for idx in range(len(self.layers))]))
+        svgelem.defs = xmldefselem
+        stages.lap("defs", elements=len(xmldefselem))
+        # transform skeleton; posed layers are always redrawn together
+        fulldraw = len(drawnlayers) == len(self.layers)
+        posed = fulldraw or bool(self.posedlayers & set(drawnlayers))
+        posedcount = self.transform_skeleton(svgelem) if posed else 0
+        stages.lap("skeleton", posed=int(posed), elements=posedcount)
+        # round coordinates of all newly drawn geometry elements
+        elems = [el for layerelem in drawnlayers.values()
+                 for el in layerelem.iterate()
+                 if isinstance(el, svglib.SvgGeometryElement)]
+        # float coordinates become rounded decimals here, so the SVG is
+        # written exactly like in decimal mode
+        pointcount = 0
+        for elem in elems:
             for cmd in elem.commands:
                 for point in cmd.parameters:
                     point.x = round_decimal(point.x, 3)
                     point.y = round_decimal(point.y, 3)
+                pointcount += len(cmd.parameters)
+        stages.lap("rounding", elements=len(elems), points=pointcount)
+        # the first full draw tells us which animation draws which geometry
+        if fulldraw and not self.layerdeps:
+            posedids = self.posed_elements()
+            for idx, layerelem in drawnlayers.items():
+                if (layerelem.elemid in posedids or
+                        posedids & set(layerelem.idmap)):
+                    self.posedlayers.add(idx)
+            self.build_dependency_graph()
+        # remember the new layers for the next incremental draw
+        if incremental:
+            for idx, layerelem in drawnlayers.items():
+                key = self.state_key(self.layerdeps[idx])
+                self.layercache[idx] = (key, layerelem)
+        self.changed_layers = [self.layers[idx]["name"]
+                               for idx in sorted(drawnlayers)]
+        self.layerelems = layerelems
+        self.draw_profile = stages.report()
         # add labels to nodes
 #            # determine how many commands need labels
 #            cmdcount = len(elem.commands)
@@ -671,43 +1302,172 @@ class MPaperdollEditor(MBase):
 #            xmlsvgelem.append(xmllayerelem)
         return svgelem
 
-    def save_to_file(self, filepath):
-        '''Write the current state of the paperdoll to a SVG file.'''
+    def save_to_file(self, filepath, state=None, styles=None):
+        '''Write the current state of the paperdoll to a SVG file.
+
+        state and styles are passed to draw().
+        '''
         log.info("Write paperdoll to: %s", filepath)
+        dollpath = Path(filepath)
+        with dollpath.open("wb") as f:
+            self.write_svg(f, state, styles)
+
+    def write_svg(self, f, state=None, styles=None):
+        '''Write the current state of the paperdoll to a binary file object.
+
+        Returns the number of written bytes.
+        '''
+        with self.drawlock:
+            return self.write_drawing(f, state, styles)
+
+    def write_drawing(self, f, state=None, styles=None):
+        '''Draws, renames and writes the doll; called by write_svg().'''
         # draw the paperdoll
-        svgdoc = self.draw(width=200, height=800, viewbox="0 0 200 800")
+        svgdoc = self.draw(width=200, height=800, viewbox="0 0 200 800",
+                           incremental=False, state=state, styles=styles)
         # rename all elements so we can filter them out if the exported
         # file was used as template for new art
         prefix = "pdcexp_"
         svgdoc.elemid = prefix + svgdoc.elemid
         for elem in svgdoc.iterate():
             elem.elemid = prefix + elem.elemid
-        # create an element tree from the svg document
-        xmlsvgelem = svgdoc.to_xml()
-        # create bytes from xml object
-        xml = ET.tostring(xmlsvgelem)
-        # add whitespace and linebreaks to SVG
-#        pretty_xml = vkb.xml(xml.decode("utf-8"), shift=2)
-#        xml = pretty_xml.encode("utf-8")
-        # save pretty xml to file
-        dollpath = Path(filepath)
-        with dollpath.open("w") as f:
-#            f.write(pretty_xml)
-            f.write(xml.decode("utf-8"))
+        # write the svg document layer by layer
+        return svgio.write_document(svgdoc, self.layerelems, f)
 
-    def on__set_state(self, data):
-        animname = data["field"]
-        new = data["value"]
-        old = self.state[animname]
-        #TODO limit change
-        # ignore if operation doesn't change anything
-        if old == new:
-            return
-        # update internal state
-        self.state[animname] = new
+    def collect_defs(self):
+        '''Returns the filters and gradients of all description files.
+
+        The definitions are returned in file and document order by id. If
+        several files define an id, the first definition is used.
+        '''
+        defs = collections.OrderedDict()
+        for filename in sorted(self.dollfiles):
+            datafile = self.dollfiles[filename].svgfile
+            datadefselem = datafile.tree.getroot().find(datafile.svgns("defs"))
+            if datadefselem is None:
+                continue
+            tags = {datafile.svgns(tag) for tag in def_tags}
+            for defelem in datadefselem:
+                defid = defelem.get("id", None)
+                if defelem.tag not in tags or defid is None:
+                    continue
+                if defid in defs:
+                    log.debug("Definition '%s' in %s was ignored", defid,
+                              filename)
+                    continue
+                defs[defid] = defelem
+        return defs
+
+    def shared_defs(self, defids):
+        '''Returns the defs element with the definitions of defids.
+
+        Definitions referenced by other definitions, e.g. gradients that
+        link to another gradient, are included too. The element is shared
+        between draws with the same definitions and must not be modified.
+        '''
+        key = frozenset(defids)
+        xmldefselem = self.defscache.get(key, None)
+        if xmldefselem is not None:
+            return xmldefselem
+        # follow references between definitions
+        needed = set()
+        pending = [defid for defid in key if defid in self.defs]
+        while pending:
+            defid = pending.pop()
+            if defid in needed:
+                continue
+            needed.add(defid)
+            for subelem in self.defs[defid].iter():
+                for value in subelem.attrib.values():
+                    pending.extend(refid for refid in attribute_ids(value)
+                                   if refid in self.defs)
+        xmldefselem = ET.Element("defs", {"id": "defs_paperdoll1"})
+        for defid, defelem in self.defs.items():
+            if defid in needed:
+                xmldefselem.append(defelem)
+        self.defscache[key] = xmldefselem
+        return xmldefselem
+
+    def apply_dials(self, mapping):
+        '''Moves several dials at once, e.g. to apply a preset.
+
+        mapping maps dial names to their new values. Returns a dictionary
+        mapping the animations whose state changed to their new states.
+        '''
+        diff = self.dialengine.apply(mapping, self.state)
+        self.set_states(diff, follow=False)
+        return diff
+
+    def set_states(self, mapping, follow=True):
+        '''Sets the states of several animations in one transaction.
+
+        mapping maps animation names to their new states. Afterwards a single
+        "state changed" signal is sent, whose data maps each changed
+        animation to a dictionary with its "old" and "new" state. Returns
+        that dictionary. If follow is True, the dials controlling the changed
+        animations move along.
+        '''
+        changes = {}
+        for animname, new in mapping.items():
+            if animname not in self.animations:
+                log.warning("Unknown animation '%s' was ignored", animname)
+                continue
+            old = self.state[animname]
+            # ignore if operation doesn't change anything
+            if old == new:
+                continue
+            changes[animname] = {"old": old, "new": new}
+        for animname, change in changes.items():
+            self.state[animname] = change["new"]
+            if follow:
+                self.dialengine.follow(animname, change["old"], change["new"])
         # inform the world about state change
-        data = {"field": animname, "old": old, "new": new}
-        sisi.send(signal="state changed", channel="editor", data=data)
+        if changes:
+            sisi.send(signal="state changed", channel="editor", sender=self,
+                      data=changes)
+        return changes
+
+    def reset_dials(self):
+        '''Sets the dials to the state after it was set without them.'''
+        self.dialengine.reset(self.state)
+
+    def clear_caches(self):
+        '''Forgets the cached frames, outlines and layers of earlier draws.
+
+        The next draw then computes everything like the first draw after
+        startup. Frame atlases and compiled conform maps are kept.
+        '''
+        with self.drawlock:
+            self.framecache = {}
+            self.outlinecache = {}
+            self.layercache = {}
+
+    def disconnect_signals(self):
+        '''Disconnects the editor and its dials from all simple signals.
+
+        Call this before dropping an editor that is not the main editor, so
+        signals are no longer delivered to it.
+        '''
+        for dial in self.dials.values():
+            dial.disconnect_signals()
+        sisi.disconnect(self.on__set_state, signal="set state")
+        sisi.disconnect(self.on__draw_doll, signal="draw doll")
+        sisi.disconnect(self.on__export_doll, signal="export doll")
+        sisi.disconnect(self.on__set_style, signal="set style")
+
+    def close(self):
+        '''Disconnects the editor and unmaps its frame atlases.
+
+        The editor can no longer draw frames from the atlases afterwards.
+        '''
+        self.disconnect_signals()
+        for frameatlas in self.atlasfiles:
+            frameatlas.close()
+        self.atlasfiles = []
+        self.atlases = {}
+
+    def on__set_state(self, data):
+        self.set_states({data["field"]: data["value"]})
 
     def on__draw_doll(self):
         sisi.send(signal="doll drawn", data=self.draw())
@@ -719,6 +1479,42 @@ class MPaperdollEditor(MBase):
         self.modified_styles[data["elemid"]] = data["style"]
 
 
+# --------------------------------------------------------------------------- #
+# Define functions
+# --------------------------------------------------------------------------- #
+def attribute_ids(value):
+    '''Returns the ids referenced by url(#id) or #id in an attribute.'''
+    ids = url_pattern.findall(value)
+    if value.startswith("#"):
+        ids.append(value[1:])
+    return ids
+
+
+def referenced_ids(elem):
+    '''Returns the ids referenced by the styles of an element or group.'''
+    elems = [elem]
+    if isinstance(elem, svglib.SvgGroup):
+        elems.extend(elem.iterate())
+    ids = set()
+    for subelem in elems:
+        style = getattr(subelem, "style", None)
+        if style is not None:
+            ids.update(url_pattern.findall(str(style)))
+        for value in getattr(subelem, "xmlattrib", {}).values():
+            ids.update(url_pattern.findall(str(value)))
+    return ids
+
+
+def count_points(elem):
+    '''Returns the number of points in a geometry element or group.'''
+    if isinstance(elem, svglib.SvgGroup):
+        elems = [el for el in elem.iterate()
+                 if isinstance(el, svglib.SvgGeometryElement)]
+    else:
+        elems = [elem]
+    return sum(len(cmd.parameters) for el in elems for cmd in el.commands)
+
+
 # --------------------------------------------------------------------------- #
 # Declare module globals
 # --------------------------------------------------------------------------- #
@@ -738,4 +1534,7 @@ torsostyle = svglib.Style("display:inline;fill:#eac6b6;fill-opacity:1;" +
               "stroke-miterlimit:4;stroke-dasharray:none;")
 bodystyle = svglib.Style("display:inline;fill:#eac6b6;fill-opacity:1;" +
              "fill-rule:evenodd;stroke:none;")
+def_tags = ("filter", "radialGradient", "linearGradient")  # the copied defs
+url_pattern = re.compile(r"url\(\s*#([^)\s]+)\s*\)")  # matches url(#id)
+frame_cache_points = 100000  # the point budget of each frame cache
 editor = None  # the main model of this application; set in __init__.py
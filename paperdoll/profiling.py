@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+'''Paperdoll editor profiling module.
+
+Records wall time, memory allocations and element counts of named phases,
+e.g. the steps of loading the doll description files or the stages of a
+draw, and writes them as Chrome traces.
+'''
+
+
+# --------------------------------------------------------------------------- #
+# Import libraries
+# --------------------------------------------------------------------------- #
+import contextlib
+import json
+import logging
+import time
+import tracemalloc
+
+
+# --------------------------------------------------------------------------- #
+# Define classes
+# --------------------------------------------------------------------------- #
+class PhaseTimer(object):
+    '''Records the phases of a process in the order they finish.
+
+    Allocations are only measured if allocations is True, because tracing
+    memory allocations slows Python down considerably.
+    '''
+    def __init__(self, allocations=False):
+        self.allocations = allocations
+        self.phases = []
+        self.start = time.perf_counter()
+        self.started_tracing = False
+        if allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+
+    @contextlib.contextmanager
+    def phase(self, name, **info):
+        '''Measures the code in the with block as phase name.
+
+        Keyword arguments, e.g. file="linedoll.xml", are stored with the
+        phase. The yielded dictionary takes element counts in its "counts"
+        item.
+        '''
+        record = {"name": name, "counts": {}}
+        record.update(info)
+        if self.allocations:
+            before, peak = tracemalloc.get_traced_memory()
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["offset"] = start - self.start
+            record["seconds"] = time.perf_counter() - start
+            if self.allocations:
+                after, peak = tracemalloc.get_traced_memory()
+                record["allocated_bytes"] = after - before
+                record["peak_bytes"] = peak - before
+            self.phases.append(record)
+
+    def lap(self, name, **counts):
+        '''Records a phase from the end of the last phase until now.
+
+        Keyword arguments are stored as the element counts of the phase.
+        '''
+        now = time.perf_counter()
+        if self.phases:
+            last = self.phases[-1]
+            start = self.start + last["offset"] + last["seconds"]
+        else:
+            start = self.start
+        self.phases.append({"name": name, "counts": counts,
+                            "offset": start - self.start,
+                            "seconds": now - start})
+
+    def stop(self):
+        '''Stops tracing allocations if this timer started it.'''
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def report(self):
+        '''Returns all phases and the total time as a dictionary.'''
+        return {"start": self.start,
+                "seconds": time.perf_counter() - self.start,
+                "phases": list(self.phases)}
+
+
+# --------------------------------------------------------------------------- #
+# Define functions
+# --------------------------------------------------------------------------- #
+def format_report(report):
+    '''Returns a phase report as a readable table.'''
+    lines = ["%-32s %-16s %10s %12s  %s" % ("phase", "file", "ms",
+                                             "allocated", "counts")]
+    for record in report["phases"]:
+        allocated = record.get("allocated_bytes", None)
+        if allocated is None:
+            allocated = "-"
+        else:
+            allocated = "%.1f KiB" % (allocated / 1024)
+        counts = ", ".join("%s=%s" % item
+                           for item in sorted(record["counts"].items()))
+        lines.append("%-32s %-16s %10.1f %12s  %s" % (
+            record["name"], record.get("file", ""),
+            record["seconds"] * 1000, allocated, counts))
+    lines.append("%-32s %-16s %10.1f" % ("total", "",
+                                         report["seconds"] * 1000))
+    return "\n".join(lines)
+
+
+def write_chrome_trace(reports, path, name="draw"):
+    '''Writes phase reports as a trace for chrome://tracing or Perfetto.
+
+    Each report becomes one span named name with its phases nested below.
+    '''
+    events = []
+    if reports:
+        origin = min(report["start"] for report in reports)
+        for number, report in enumerate(reports):
+            start = (report["start"] - origin) * 1e6
+            events.append({"name": name, "ph": "X", "pid": 1, "tid": 1,
+                           "ts": start, "dur": report["seconds"] * 1e6,
+                           "args": {"number": number}})
+            for record in report["phases"]:
+                events.append({"name": record["name"], "ph": "X",
+                               "pid": 1, "tid": 1,
+                               "ts": start + record["offset"] * 1e6,
+                               "dur": record["seconds"] * 1e6,
+                               "args": record["counts"]})
+    with open(str(path), "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+# --------------------------------------------------------------------------- #
+# Declare module globals
+# --------------------------------------------------------------------------- #
+log = logging.getLogger(__name__)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+'''Paperdoll editor raster export module.
+
+Renders serialized dolls to PNG images with QSvgRenderer. The SVG is parsed
+once and painted into one QImage per requested size, so thumbnails of all
+sizes cost one parse. No window is shown; without a display the offscreen
+Qt platform is used.
+'''
+
+
+# --------------------------------------------------------------------------- #
+# Import libraries
+# --------------------------------------------------------------------------- #
+import logging
+import os
+import sys
+
+# the platform has to be chosen before PyQt5 creates an application
+if not os.environ.get("DISPLAY") and sys.platform.startswith("linux"):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5 import QtCore, QtGui, QtSvg
+from PyQt5.QtCore import Qt
+
+
+# --------------------------------------------------------------------------- #
+# Define functions
+# --------------------------------------------------------------------------- #
+def ensure_application():
+    '''Creates a QGuiApplication unless Qt already has an application.'''
+    global application
+    if QtCore.QCoreApplication.instance() is None:
+        application = QtGui.QGuiApplication([sys.argv[0]])
+    return QtCore.QCoreApplication.instance()
+
+
+def parse_sizes(text):
+    '''Returns the sizes of a comma separated list like "64,256".'''
+    sizes = sorted({int(size) for size in text.split(",") if size.strip()})
+    if not sizes or sizes[0] <= 0:
+        raise ValueError("Image sizes must be positive integers")
+    return sizes
+
+
+def image_size(renderer, size):
+    '''Returns the QSize with size pixels along the longer edge.'''
+    viewbox = renderer.viewBoxF()
+    if viewbox.isEmpty():
+        viewbox = QtCore.QRectF(QtCore.QPointF(0, 0),
+                                QtCore.QSizeF(renderer.defaultSize()))
+    imagesize = viewbox.size()
+    imagesize.scale(size, size, Qt.KeepAspectRatio)
+    return QtCore.QSize(max(1, round(imagesize.width())),
+                        max(1, round(imagesize.height())))
+
+
+def render_images(svgbytes, sizes):
+    '''Returns a dictionary mapping each size to a QImage of the SVG.
+
+    Each image has size pixels along its longer edge and a transparent
+    background.
+    '''
+    ensure_application()
+    renderer = QtSvg.QSvgRenderer(QtCore.QByteArray(svgbytes))
+    if not renderer.isValid():
+        raise ValueError("The SVG data could not be parsed")
+    images = {}
+    for size in sizes:
+        image = QtGui.QImage(image_size(renderer, size),
+                             QtGui.QImage.Format_ARGB32_Premultiplied)
+        image.fill(Qt.transparent)
+        painter = QtGui.QPainter(image)
+        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+        renderer.render(painter)
+        painter.end()
+        images[size] = image
+    return images
+
+
+def save_images(svgbytes, sizes, svgpath):
+    '''Writes one PNG file per size next to svgpath.
+
+    doll_00001.svg becomes doll_00001_64.png, doll_00001_256.png and so on.
+    Returns the paths of the written files.
+    '''
+    paths = []
+    for size, image in sorted(render_images(svgbytes, sizes).items()):
+        path = svgpath.with_name("%s_%s.png" % (svgpath.stem, size))
+        if not image.save(str(path), "PNG"):
+            raise IOError("Could not write %s" % path)
+        paths.append(path)
+    return paths
+
+
+# --------------------------------------------------------------------------- #
+# Declare module globals
+# --------------------------------------------------------------------------- #
+log = logging.getLogger(__name__)
+application = None  # the QGuiApplication created by this module
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+'''Paperdoll editor skeleton module.
+
+The bones of the doll are the linear connectivity elements of skeleton.xml.
+A bone starts at its first node and ends at its last node, and a bone that
+starts at the node another bone ends at is the child of that bone, e.g. the
+lower arm starts at the elbow the upper arm ends at. Mirror elements add
+the mirrored bones, e.g. upper_arm_bone_r for upper_arm_bone_l.
+
+Posing is forward kinematics: each bone rotates around its first node by
+the angle of its rotate_<bone> animation, and its world transform is the
+world transform of its parent followed by that rotation. The transforms are
+3x3 affine matrices in the rest pose coordinates of the doll, so every body
+part is transformed once with the matrix of its bone instead of replaying
+the transforms of all its parents.
+'''
+
+
+# --------------------------------------------------------------------------- #
+# Import libraries
+# --------------------------------------------------------------------------- #
+import logging
+import math
+import re
+
+import geometry
+
+
+# --------------------------------------------------------------------------- #
+# Define classes
+# --------------------------------------------------------------------------- #
+class Skeleton(object):
+    '''The bone hierarchy of the doll.
+
+    bones maps bone names to the node ids of the bone. The bones are stored
+    with parents before their children. Only bones with a rotate animation
+    or an animated ancestor are ever posed.
+    '''
+    def __init__(self, bones, animations):
+        self.parents = {}  # maps bone names to the name of their parent
+        ends = {nodes[-1]: bonename for bonename, nodes in bones.items()}
+        for bonename, nodes in bones.items():
+            self.parents[bonename] = ends.get(nodes[0], None)
+        self.bones = []  # the bone names, parents first
+        for bonename in sorted(bones):
+            self.add_bone(bonename, [])
+        # maps bone names to the names of the animations rotating them
+        self.animations = {bonename: "rotate_" + bonename
+                           for bonename in self.bones
+                           if "rotate_" + bonename in animations}
+        self.animated = set()  # the bones moved by an animation
+        for bonename in self.bones:
+            if (bonename in self.animations or
+                    self.parents[bonename] in self.animated):
+                self.animated.add(bonename)
+
+    @classmethod
+    def from_description(cls, descfile, animations):
+        '''Returns the skeleton of the connectivity of a description file.
+
+        descfile may be None for dolls without a skeleton.
+        '''
+        bones = {}
+        xmlconn = None if descfile is None else descfile.tree.find(
+            "connectivity")
+        if xmlconn is None:
+            return cls(bones, animations)
+        for xmlelem in xmlconn.iter("linear"):
+            bones[xmlelem.get("id")] = [xmlnode.get("id")
+                                        for xmlnode in xmlelem.iter("node")]
+        for xmlmirror in xmlconn.iter("mirror"):
+            template = xmlmirror.get("template_suffix")
+            mirror = xmlmirror.get("mirror_suffix")
+            for bonename, nodes in list(bones.items()):
+                if not bonename.endswith(template):
+                    continue
+                mirrorname = bonename[:-len(template)] + mirror
+                bones.setdefault(mirrorname, [
+                    nodeid[:-len(template)] + mirror
+                    if nodeid.endswith(template) else nodeid
+                    for nodeid in nodes])
+        return cls(bones, animations)
+
+    def add_bone(self, bonename, chain):
+        '''Adds bonename after its parents; chain holds its children.'''
+        if bonename in self.bones:
+            return
+        if bonename in chain:
+            cycle = chain[chain.index(bonename):] + [bonename]
+            raise ValueError("Bones form a cycle: %s" % " -> ".join(cycle))
+        parent = self.parents[bonename]
+        if parent is not None:
+            self.add_bone(parent, chain + [bonename])
+        self.bones.append(bonename)
+
+    def bodypart(self, bonename):
+        '''Returns the id of the element posed with a bone.
+
+        upper_arm_bone_l poses upper_arm_l.
+        '''
+        return bonename.replace("_bone", "")
+
+    def elements(self):
+        '''Returns the ids of the bones and body parts that can be posed.'''
+        elemids = set(self.animated)
+        elemids.update(self.bodypart(bonename) for bonename in self.animated)
+        return elemids
+
+    def pose(self, state, animations):
+        '''Returns a dictionary mapping bone names to world transforms.
+
+        Bones without a rotate animation only follow their parents.
+        '''
+        matrices = {}
+        for bonename in self.bones:
+            parent = self.parents[bonename]
+            matrix = identity if parent is None else matrices[parent]
+            animname = self.animations.get(bonename, None)
+            if animname is not None:
+                anim = animations[animname]
+                angle, cx, cy = rotation_parameters(
+                    anim.get_command(state[animname]))
+                if angle:
+                    matrix = multiply(matrix, rotation(angle, cx, cy))
+            matrices[bonename] = matrix
+        return matrices
+
+
+# --------------------------------------------------------------------------- #
+# Define functions
+# --------------------------------------------------------------------------- #
+def rotation_parameters(command):
+    '''Returns angle and center of a rotate command like "rotate(30 1,2)".
+
+    Other commands are logged and do not rotate.
+    '''
+    match = rotate_pattern.search(str(command))
+    if match is None:
+        log.warning("'%s' is not a rotate command and was ignored", command)
+        return 0.0, 0.0, 0.0
+    values = [float(value) for value
+              in re.split(r"[\s,]+", match.group(1).strip()) if value]
+    values += [0.0] * (3 - len(values))
+    return values[0], values[1], values[2]
+
+
+def rotation(angle, cx=0.0, cy=0.0):
+    '''Returns the matrix rotating by angle degrees around cx, cy.
+
+    Like SVG, positive angles rotate clockwise on screen. The matrix is
+    made of nested tuples, so posing works without NumPy.
+    '''
+    rad = math.radians(angle)
+    cos, sin = math.cos(rad), math.sin(rad)
+    return ((cos, -sin, cx - cos * cx + sin * cy),
+            (sin, cos, cy - sin * cx - cos * cy),
+            (0.0, 0.0, 1.0))
+
+
+def multiply(a, b):
+    '''Returns the product of two 3x3 matrices.'''
+    return tuple(tuple(sum(a[row][k] * b[k][col] for k in range(3))
+                       for col in range(3))
+                 for row in range(3))
+
+
+def transform_element(elem, matrix):
+    '''Applies a rotation matrix to a geometry element or group in place.
+
+    With NumPy the points are transformed as one PathArray. Otherwise the
+    matrix is split into a rotation around the origin and a translation.
+    H and V commands have to be replaced by L before.
+    '''
+    if geometry.numpy is not None:
+        patharray = geometry.PathArray.from_element(elem)
+        patharray.transform(geometry.numpy.array(matrix))
+        patharray.apply()
+        return
+    angle = math.degrees(math.atan2(matrix[1][0], matrix[0][0]))
+    elem.rotate(angle, 0, 0)
+    elem.translate(matrix[0][2], matrix[1][2])
+
+
+def replace_axis_commands(elem):
+    '''Replaces H and V commands by L commands in an element or group.'''
+    for geomelem in geometry.geometry_elements(elem):
+        for cmd in geomelem.commands:
+            if cmd.commandletter in "HV":
+                cmd.commandletter = "L"
+            elif cmd.commandletter in "hv":
+                cmd.commandletter = "l"
+
+
+# --------------------------------------------------------------------------- #
+# Declare module globals
+# --------------------------------------------------------------------------- #
+log = logging.getLogger(__name__)
+identity = ((1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0))
+rotate_pattern = re.compile(r"rotate\(([^)]*)\)")
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+'''Paperdoll editor streaming SVG serialization module.
+
+Instead of converting a whole drawing to one element tree and one bytes
+object, the document is written as a sequence of chunks: the opening svg
+tag with the defs, one chunk per layer and the closing tag. Only one layer
+is converted to an element tree at a time, and the chunks of layers reused
+by an incremental draw are taken from a ChunkCache.
+
+ElementTree declares the namespaces of a serialized element on that
+element, so a layer serialized on its own would declare them again. Layers
+are therefore serialized inside a wrapper element that takes the
+declarations, and the declarations of all layers are added to the opening
+svg tag. Every namespace gets one fixed prefix, so all chunks agree.
+'''
+
+
+# --------------------------------------------------------------------------- #
+# Import libraries
+# --------------------------------------------------------------------------- #
+import logging
+import re
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import quoteattr
+
+import svglib
+
+
+# --------------------------------------------------------------------------- #
+# Define classes
+# --------------------------------------------------------------------------- #
+class ChunkCache(object):
+    '''Remembers the serialized bytes of unchanged elements.
+
+    Elements are identified by object identity, so an element must not be
+    modified after it was serialized with a cache. The layers reused by
+    incremental draws are never modified.
+    '''
+    def __init__(self):
+        self.chunks = {}  # maps element ids to (element, chunk) tuples
+        self.shell = None  # the last (key, defs, head, tail) shell
+
+    def get(self, elem):
+        '''Returns the (bytes, namespaces) chunk of elem or None.'''
+        entry = self.chunks.get(id(elem), None)
+        if entry is None or entry[0] is not elem:
+            return None
+        return entry[1]
+
+    def put(self, elem, chunk):
+        self.chunks[id(elem)] = (elem, chunk)
+
+    def retain(self, elems):
+        '''Forgets the bytes of all elements not in elems.'''
+        keep = {id(elem) for elem in elems}
+        for key in [key for key in self.chunks if key not in keep]:
+            del self.chunks[key]
+
+    def clear(self):
+        self.chunks = {}
+        self.shell = None
+
+
+# --------------------------------------------------------------------------- #
+# Define functions
+# --------------------------------------------------------------------------- #
+def namespace_prefix(uri):
+    '''Returns the prefix ElementTree uses for the namespace uri.
+
+    Namespaces without a registered prefix would get a numbered prefix that
+    depends on the serialized element, so they are registered with a fixed
+    one the first time they are seen.
+    '''
+    prefix = prefixes.get(uri, None)
+    if prefix is None:
+        data = ET.tostring(ET.Element("{%s}x" % uri)).decode("utf-8")
+        prefix = data[1:data.index(":")]
+        if re.fullmatch(r"ns\d+", prefix):
+            prefix = known_prefixes.get(uri, "pdc%s" % len(prefixes))
+            ET.register_namespace(prefix, uri)
+        prefixes[uri] = prefix
+    return prefix
+
+
+def namespaces(xmlelem):
+    '''Returns the (prefix, uri) pairs of the namespaces in an element.'''
+    uris = set()
+    for subelem in xmlelem.iter():
+        if not isinstance(subelem.tag, str):
+            continue  # comments and processing instructions
+        for name in [subelem.tag] + list(subelem.attrib):
+            if name.startswith("{"):
+                uris.add(name[1:name.index("}")])
+    uris.discard(xml_namespace)  # the xml prefix is never declared
+    return frozenset((namespace_prefix(uri), uri) for uri in uris)
+
+
+def declare_namespaces(head, pairs):
+    '''Adds namespace declarations to the opening tag of a document head.
+
+    Prefixes the opening tag declares already are left alone.
+    '''
+    end = head.index(b">")
+    declared = set(re.findall(rb'xmlns:([^=\s]+)=', head[:end]))
+    extra = b"".join(
+        (" xmlns:%s=%s" % (prefix, quoteattr(uri))).encode("utf-8")
+        for prefix, uri in sorted(pairs)
+        if prefix.encode("utf-8") not in declared)
+    return head[:end] + extra + head[end:]
+
+
+def layer_chunk(layerelem, cache=None):
+    '''Returns the bytes of a layer and the namespaces they use.
+
+    The bytes contain no namespace declarations; they belong on the opening
+    svg tag of the document.
+    '''
+    chunk = None if cache is None else cache.get(layerelem)
+    if chunk is None:
+        xmlelem = layerelem.to_xml()
+        pairs = namespaces(xmlelem)
+        wrapper = ET.Element(wrap_tag)
+        wrapper.append(xmlelem)
+        data = ET.tostring(wrapper)
+        chunk = (data[data.index(b">") + 1:-len(wrap_end)], pairs)
+        if cache is not None:
+            cache.put(layerelem, chunk)
+    return chunk
+
+
+def document_shell(svgdoc, cache=None, pairs=()):
+    '''Returns the bytes before and after the layers of a document.
+
+    The head contains the opening svg tag and the defs, the tail the closing
+    svg tag. pairs are the (prefix, uri) namespaces used by the layers; they
+    are declared on the opening svg tag.
+    '''
+    key = (svgdoc.elemid, svgdoc.width, svgdoc.height, svgdoc.viewbox)
+    if (cache is not None and cache.shell is not None and
+            cache.shell[0] == key and cache.shell[1] is svgdoc.defs):
+        head, tail = cache.shell[2], cache.shell[3]
+    else:
+        emptydoc = svglib.SvgDocument()
+        emptydoc.elemid = svgdoc.elemid
+        emptydoc.width = svgdoc.width
+        emptydoc.height = svgdoc.height
+        emptydoc.viewbox = svgdoc.viewbox
+        emptydoc.defs = svgdoc.defs
+        xmlsvgelem = emptydoc.to_xml()
+        # a marker element shows where the layers go
+        ET.SubElement(xmlsvgelem, split_tag)
+        namespaces(xmlsvgelem)  # registers fixed prefixes first
+        xml = ET.tostring(xmlsvgelem)
+        head, tail = xml.split(split_marker, 1)
+        if cache is not None:
+            cache.shell = (key, svgdoc.defs, head, tail)
+    if pairs:
+        head = declare_namespaces(head, pairs)
+    return head, tail
+
+
+def iter_document(svgdoc, layers, cache=None):
+    '''Yields the serialized document in chunks of bytes.
+
+    layers are the top level elements of svgdoc in document order. With a
+    cache the bytes of layers serialized before are reused.
+    '''
+    chunks = [layer_chunk(layerelem, cache) for layerelem in layers]
+    pairs = frozenset().union(*[chunk[1] for chunk in chunks])
+    head, tail = document_shell(svgdoc, cache, pairs)
+    yield head
+    for data, _ in chunks:
+        yield data
+    if cache is not None:
+        cache.retain(layers)
+    yield tail
+
+
+def layer_document(svgdoc, layerelem, cache=None):
+    '''Returns a standalone document containing only one layer of svgdoc.
+
+    The document has the size, view box and defs of svgdoc, so the layer
+    documents of all layers can be displayed on top of each other.
+    '''
+    data, pairs = layer_chunk(layerelem, cache)
+    head, tail = document_shell(svgdoc, cache, pairs)
+    return b"".join((head, data, tail))
+
+
+def write_document(svgdoc, layers, f, cache=None):
+    '''Writes the document to the binary file object f.
+
+    Returns the number of written bytes.
+    '''
+    size = 0
+    for chunk in iter_document(svgdoc, layers, cache):
+        f.write(chunk)
+        size += len(chunk)
+    return size
+
+
+def document_bytes(svgdoc, layers, cache=None):
+    '''Returns the serialized document as one bytes object.'''
+    return b"".join(iter_document(svgdoc, layers, cache))
+
+
+# --------------------------------------------------------------------------- #
+# Declare module globals
+# --------------------------------------------------------------------------- #
+log = logging.getLogger(__name__)
+split_tag = "pdcsplit"  # the tag of the marker element in document shells
+split_marker = b"<pdcsplit />"
+wrap_tag = "pdcwrap"  # the tag of the element layers are serialized in
+wrap_end = b"</pdcwrap>"
+xml_namespace = "http://www.w3.org/XML/1998/namespace"
+prefixes = {}  # maps namespace uris to their fixed prefixes
+known_prefixes = {
+    "http://www.inkscape.org/namespaces/inkscape": "inkscape",
+    "http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd": "sodipodi",
+    "http://www.w3.org/1999/xlink": "xlink"}
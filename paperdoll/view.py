@@ -7,52 +7,206 @@
 # Import libraries
 # --------------------------------------------------------------------------- #
 import logging
+import time
 
-import xml.etree.ElementTree as ET
-from PyQt5 import QtWidgets, QtGui, QtCore, QtSvg, QtWebEngineWidgets
+from PyQt5 import QtWidgets, QtGui, QtCore, QtSvg
 from PyQt5.QtCore import Qt
 
 import svglib
 import simplesignals as sisi
 
+import svgio
+
 
 # --------------------------------------------------------------------------- #
 # Define classes
 # --------------------------------------------------------------------------- #
 class DrawSchedule(QtCore.QObject):
-    '''Initiates a redraw when no state change has happened for some time.
+    '''Coalesces state changes into redraws at an adaptive frame rate.
+
+    The first state change starts a single reusable timer. When it fires
+    the doll is drawn once in its latest state; the states in between are
+    dropped. While the user keeps dragging a dial a new frame is drawn
+    every interval, which adapts to the measured draw time, so slow dolls
+    are drawn less often instead of falling behind. No new draw starts
+    before the last one was delivered, skipped or failed.
     '''
     def __init__(self, delay=10, parent=None):
         QtCore.QObject.__init__(self, parent=parent)
-        # the time in milliseconds we wait for state changes
-        # before we start a redraw
+        # the minimum time in milliseconds between a state change
+        # and the redraw
         self.delay = delay
-        # the number of changes that occurred
-        self.changecount = 0
+        # the exponential moving average of the draw time in milliseconds
+        self.drawtime = 0.0
+        self.smoothing = 0.3  # the weight of the last draw in drawtime
+        self.pending = False  # True if the state changed since the last draw
+        self.drawing = False  # True until the requested draw was delivered
+        self.drawstart = 0.0
+        self.frames = 0  # the number of drawn frames
+        self.dropped = 0  # the number of state changes never drawn
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.attempt_redraw)
         # connect simple signals
         sisi.connect(self.on__state_changed, signal="state changed",
                      channel="editor")
+        sisi.connect(self.on__doll_drawn, signal="doll drawn")
+
+    @property
+    def interval(self):
+        '''Returns the time in milliseconds until the next frame.'''
+        return max(self.delay, int(self.drawtime))
+
+    def schedule(self):
+        '''Starts the timer unless a frame is already scheduled.'''
+        if not self.timer.isActive() and not self.drawing:
+            self.timer.start(self.interval)
 
     @QtCore.pyqtSlot()
     def attempt_redraw(self):
-        '''Start a redraw if changeid is the id of the last state change.'''
-        # the delay for the first change is up, so we update the changecount
-        self.changecount -= 1
-        # has the time delay for all changes passed?
-        if self.changecount is 0:
-            sisi.send(signal="draw doll")
+        '''Draws the latest state if it was not drawn yet.'''
+        if not self.pending or self.drawing:
+            return
+        self.pending = False
+        self.drawing = True
+        self.drawstart = time.perf_counter()
+        sisi.send(signal="draw doll")
 
     def on__state_changed(self):
-        # remember that a change occurred
-        self.changecount += 1
-        # each time the state is changed we start waiting again
-        QtCore.QTimer.singleShot(self.delay, self.attempt_redraw)
-#        timer = QtCore.QTimer(self)
-#        timer.timeout.connect(self.attempt_redraw)
-#        timer.setSingleShot(True)
-#        timer.start(self.delay)
-#        t = threading.Timer(self.delay, self.attempt_redraw, [self.changeid])
-#        t.start()
+        if self.pending:
+            self.dropped += 1  # the previous change is never drawn
+        self.pending = True
+        self.schedule()
+
+    def on__doll_drawn(self, data):
+        if not self.drawing:
+            return  # the draw was not requested by this schedule
+        self.drawing = False
+        if data is not None:  # None if the draw was skipped or failed
+            self.frames += 1
+            drawtime = (time.perf_counter() - self.drawstart) * 1000
+            self.drawtime += self.smoothing * (drawtime - self.drawtime)
+        if self.pending:
+            self.schedule()
+
+
+class BackgroundDrawer(QtCore.QObject):
+    '''Draws and exports the doll on a worker thread instead of the GUI
+    thread.
+
+    Each "draw doll" signal queues a draw of a copy of the current state and
+    style overrides. Queued draws that were superseded by a newer request
+    before they started are skipped. The worker also serializes the layers
+    that changed, and the result is delivered on the GUI thread, where
+    "doll drawn" is sent. Skipped and failed draws send "doll drawn" without
+    a drawing, so a DrawSchedule waiting for the draw can go on.
+
+    "export doll" signals queue an export of a copy of the current state
+    behind the draws, so the GUI thread never waits for the draw lock.
+    '''
+    drawn = QtCore.pyqtSignal(object)
+
+    def __init__(self, model, parent=None):
+        QtCore.QObject.__init__(self, parent=parent)
+        self.model = model
+        self.generation = 0  # the number of the newest draw request
+        self.result = None  # the last delivered drawing
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(1)  # draws must finish in order
+        # only used on the worker thread
+        self.chunkcache = svgio.ChunkCache()  # serialized unchanged layers
+        self.lastshell = None  # the document shell of the last drawing
+        # results are emitted on the worker thread, so they are queued
+        self.drawn.connect(self.on_drawn, Qt.QueuedConnection)
+        # the model no longer draws or exports on the GUI thread
+        sisi.disconnect(self.model.on__draw_doll, signal="draw doll")
+        sisi.connect(self.on__draw_doll, signal="draw doll")
+        sisi.disconnect(self.model.on__export_doll, signal="export doll")
+        sisi.connect(self.on__export_doll, signal="export doll")
+
+    def draw(self, generation, state, styles):
+        '''Draws and serializes the doll; runs on the worker thread.
+
+        Returns the result to deliver on the GUI thread.
+        '''
+        if generation != self.generation:
+            # a newer draw was requested before this one started
+            return {"generation": generation, "svgdoc": None,
+                    "superseded": True}
+        with self.model.drawlock:
+            svgdoc = self.model.draw(state=state, styles=styles)
+            layerelems = list(self.model.layerelems)
+            changed = set(self.model.changed_layers)
+            # only the layers that changed need to be rendered again,
+            # unless the size or the defs of the document changed
+            shell = svgio.document_shell(svgdoc, self.chunkcache)
+            renderall = shell != self.lastshell
+            layerdocs = {}
+            for idx, layerelem in enumerate(layerelems):
+                if renderall or self.model.layers[idx]["name"] in changed:
+                    layerdocs[idx] = svgio.layer_document(
+                        svgdoc, layerelem, self.chunkcache)
+            self.chunkcache.retain(layerelems)
+            self.lastshell = shell
+        return {"generation": generation, "svgdoc": svgdoc,
+                "layercount": len(layerelems), "layerdocs": layerdocs}
+
+    @QtCore.pyqtSlot(object)
+    def on_drawn(self, result):
+        if result["svgdoc"] is not None:
+            self.result = result
+        # always answer the request, the schedule waits for it
+        sisi.send(signal="doll drawn", data=result["svgdoc"])
+
+    def copy_state(self):
+        '''Returns copies of the current state and style overrides.'''
+        state = dict(self.model.state)
+        styles = {elemid: style.copy() for elemid, style
+                  in self.model.modified_styles.items()}
+        return state, styles
+
+    def on__draw_doll(self):
+        self.generation += 1
+        state, styles = self.copy_state()
+        self.pool.start(DrawJob(self, self.generation, state, styles))
+
+    def on__export_doll(self, data):
+        state, styles = self.copy_state()
+        self.pool.start(ExportJob(self.model, data["path"], state, styles))
+
+
+class DrawJob(QtCore.QRunnable):
+    '''Runs one draw of a BackgroundDrawer on a worker thread.
+
+    The result is always emitted, for failed draws with the exception.
+    '''
+    def __init__(self, drawer, generation, state, styles):
+        QtCore.QRunnable.__init__(self)
+        self.drawer = drawer
+        self.args = (generation, state, styles)
+
+    def run(self):
+        try:
+            result = self.drawer.draw(*self.args)
+        except Exception as exc:
+            log.exception("Drawing the doll failed")
+            result = {"generation": self.args[0], "svgdoc": None,
+                      "error": exc}
+        self.drawer.drawn.emit(result)
+
+
+class ExportJob(QtCore.QRunnable):
+    '''Writes the doll to a SVG file on a worker thread.'''
+    def __init__(self, model, path, state, styles):
+        QtCore.QRunnable.__init__(self)
+        self.model = model
+        self.args = (path, state, styles)
+
+    def run(self):
+        try:
+            self.model.save_to_file(*self.args)
+        except Exception:
+            log.exception("Exporting the doll to %s failed", self.args[0])
 
 
 class VBase(object):
@@ -75,13 +229,13 @@ class VPaperDoll(VWidget):
     '''
     def __init__(self):
         VWidget.__init__(self)
-        self.webview = QScrollingWebView()
+        self.canvas = QSvgCanvas()
 #        self.lastpos = None
         # create layout
         self.setMinimumWidth(50)
         self.setMinimumHeight(50)
         vbox = QtWidgets.QVBoxLayout()
-        vbox.addWidget(self.webview)
+        vbox.addWidget(self.canvas)
         self.setLayout(vbox)
 
 
@@ -123,6 +277,8 @@ class VDial(VWidget):
         # connect simple signals
         sisi.connect(self.on__update_dial_state, signal="update dial state",
                      sender=self.model)
+        # show the initial value
+        self.on__update_dial_state(self, self.model.value)
 #
 #    @property
 #    def minimum(self):
@@ -160,7 +316,8 @@ class VSliders(VWidget):
         layout = QtWidgets.QFormLayout()
         self.setLayout(layout)
         # connect simple signals
-        sisi.connect(self.on__set_state, signal="set state", channel="editor")
+        sisi.connect(self.on__state_changed, signal="state changed",
+                     channel="editor")
 
     def add_slider(self, aniname, value=50):
         slider = QtWidgets.QSlider(Qt.Horizontal)
@@ -185,14 +342,14 @@ class VSliders(VWidget):
         slider = self.sliders[slidername]
         slider.setValue(self.lastval[slidername])
 
-    def on__set_state(self, sender, data):
-        if sender is not self:
-            aniname = data["field"]
-            value = data["value"]
+    def on__state_changed(self, data):
+        for aniname, change in data.items():
             slidername = aniname + "_slider"
-            slider = self.sliders[slidername]
-            self.lastval[slidername] = value
-            slider.setValue(value)
+            slider = self.sliders.get(slidername, None)
+            if slider is None:
+                continue
+            self.lastval[slidername] = change["new"]
+            slider.setValue(change["new"])
 
 
 # define window classes
@@ -252,6 +409,7 @@ class VEditorWindow(VBaseWindow):
         VBaseWindow.__init__(self)
         self.model = model
         self.svgdoc = None  # the SVG document of the currently displayed doll
+        self.drawer = BackgroundDrawer(model, parent=self)
         self.dials = []
         # create widgets
         self.central = QtWidgets.QWidget()
@@ -290,12 +448,14 @@ class VEditorWindow(VBaseWindow):
         sisi.connect(self.on__doll_drawn, signal="doll drawn")
 
     def render_doll(self):
-        # create an element tree from the svg document
-        xmlsvgelem = self.svgdoc.to_xml()
-        # create bytes from xml object
-        xml = ET.tostring(xmlsvgelem)
-        # update paperdoll webview
-        self.doll.webview.setContent(xml, "image/svg+xml")
+        # the drawer serialized the layers that changed in the last draw
+        result = self.drawer.result
+        if result is None or result["svgdoc"] is not self.svgdoc:
+            return
+        canvas = self.doll.canvas
+        for idx, layerdoc in sorted(result["layerdocs"].items()):
+            canvas.set_layer(idx, layerdoc)
+        canvas.truncate(result["layercount"])
 
     @QtCore.pyqtSlot()
     def on_exportsvg_triggered(self):
@@ -314,27 +474,32 @@ class VEditorWindow(VBaseWindow):
 #        elemid = model.elemidmap[item.index()]
         elemid = item.text()
         elem = self.svgdoc.idmap[elemid]
-        if elem.style is None:
-            elem.style = svglib.Style("display:inline")
-        # toggle visibility
-        if elem.style.visible is True:
-            elem.style.visible = False
+        # the drawn elements are shared with the layer caches and may be
+        # serialized by the drawer, so the changed styles are copies
+        style = self.model.modified_styles.get(elem.elemid, elem.style)
+        if style is None:
+            style = svglib.Style("display:inline")
         else:
-            elem.style.visible = True
-        data = {"elemid": elem.elemid, "style": elem.style}
+            style = style.copy()
+        # toggle visibility
+        style.visible = style.visible is not True
+        data = {"elemid": elem.elemid, "style": style}
         sisi.send(signal="set style", data=data)
         # set visibility of subelements
         #TODO replace this hack by implementing style propagation
         if isinstance(elem, svglib.SvgGroup):
             for subelem in elem.iterate():
                 if subelem.style is not None:
-                    subelem.style.visible = elem.style.visible
-                    data = {"elemid": subelem.elemid, "style": subelem.style}
+                    substyle = subelem.style.copy()
+                    substyle.visible = style.visible
+                    data = {"elemid": subelem.elemid, "style": substyle}
                     sisi.send(signal="set style", data=data)
         sisi.send(signal="draw doll")
         #TODO fix making lines invisible (their style does not have "display")
 
     def on__doll_drawn(self, data):
+        if data is None:
+            return  # the draw was skipped or failed
         # update current model
         self.svgdoc = data
         # update object list
@@ -442,32 +607,66 @@ class QSvgDocumentModel(QtGui.QStandardItemModel):
 #        #TODO modify the model via signals, do not store state here
 
 
-class QScrollingWebView(QtWebEngineWidgets.QWebEngineView):
+class QSvgCanvas(QtWidgets.QGraphicsView):
+    '''Displays layered SVG data natively with wheel zoom and drag panning.
+
+    Each layer is a standalone SVG document shown by its own graphics item,
+    so changing one layer only renders that layer again. Hold Ctrl and turn
+    the mouse wheel to zoom at the mouse position, drag with the left mouse
+    button to pan.
+    '''
     def __init__(self, *args, **kwargs):
-        QtWebEngineWidgets.QWebEngineView.__init__(self, *args, **kwargs)
+        QtWidgets.QGraphicsView.__init__(self, *args, **kwargs)
+        self.zoom = 1.0
+        self.layers = []  # (renderer, item) tuples in drawing order
+        self.setScene(QtWidgets.QGraphicsScene(self))
+        # configure view
+        self.setRenderHints(QtGui.QPainter.Antialiasing |
+                            QtGui.QPainter.SmoothPixmapTransform)
+        self.setDragMode(QtWidgets.QGraphicsView.ScrollHandDrag)
+        self.setTransformationAnchor(QtWidgets.QGraphicsView.AnchorUnderMouse)
+        self.setViewportUpdateMode(
+            QtWidgets.QGraphicsView.BoundingRectViewportUpdate)
+
+    def set_layer(self, idx, svgbytes):
+        '''Displays the SVG document in svgbytes as layer number idx.'''
+        while len(self.layers) <= idx:
+            renderer = QtSvg.QSvgRenderer(self)
+            item = QtSvg.QGraphicsSvgItem()
+            item.setZValue(len(self.layers))
+            # cache the rendered layer until its content changes
+            item.setCacheMode(QtWidgets.QGraphicsItem.DeviceCoordinateCache)
+            self.scene().addItem(item)
+            self.layers.append((renderer, item))
+        renderer, item = self.layers[idx]
+        if not renderer.load(QtCore.QByteArray(svgbytes)):
+            log.warning("Layer %s of the drawn doll could not be displayed",
+                        idx)
+            return
+        # the item caches its size, so it has to look at the renderer again
+        item.setSharedRenderer(renderer)
+        item.update()
+        self.scene().setSceneRect(item.boundingRect())
+
+    def truncate(self, count):
+        '''Removes all layers after the first count layers.'''
+        while len(self.layers) > count:
+            renderer, item = self.layers.pop()
+            self.scene().removeItem(item)
+            renderer.deleteLater()
 
     def wheelEvent(self, event):
-        angledelta = event.angleDelta().y()
-        pos = event.pos()
-        evx, evy = pos.x(), pos.y()
-#        if angledelta > 0:
-#            scrollstep = 10
-#        else:
-#            scrollstep = -10
-        page = self.page()
         if event.modifiers() == Qt.ControlModifier:
-            zoom = self.zoomFactor()
+            angledelta = event.angleDelta().y()
             if angledelta > 0:
-                zoom = min(zoom + 0.125, 5.0)
+                zoom = min(self.zoom + 0.125, 5.0)
             else:
-                zoom = max(zoom - 0.125, 0.25)
-            self.setZoomFactor(zoom)
-            page.runJavaScript("window.scrollTo(%s, %s);" % (evx, evy))
-#        elif event.modifiers() == Qt.ShiftModifier:
-#            page.runJavaScript("window.scrollBy(%s, 0);" % scrollstep)
-#        else:
-#            page.runJavaScript("window.scrollBy(0, %s);" % scrollstep)
-        event.accept()
+                zoom = max(self.zoom - 0.125, 0.25)
+            self.scale(zoom / self.zoom, zoom / self.zoom)
+            self.zoom = zoom
+            event.accept()
+        else:
+            QtWidgets.QGraphicsView.wheelEvent(self, event)
 
 
 # --------------------------------------------------------------------------- #
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+'''Test configuration of the paperdoll editor.
+
+The modules of the paperdoll package import each other by their plain
+names, so the package directory is put on the python path like the
+launcher does. Tests that need svglib, simplesignals or NumPy are skipped
+where these libraries are not installed.
+'''
+
+
+# --------------------------------------------------------------------------- #
+# Import libraries
+# --------------------------------------------------------------------------- #
+import sys
+from pathlib import Path
+
+import pytest
+
+
+# --------------------------------------------------------------------------- #
+# Declare module globals
+# --------------------------------------------------------------------------- #
+rootdir = Path(__file__).resolve().parent.parent
+dolldir = rootdir / "dollfiles"
+for path in (rootdir, rootdir / "paperdoll"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
+
+
+# --------------------------------------------------------------------------- #
+# Define fixtures
+# --------------------------------------------------------------------------- #
+@pytest.fixture(scope="session")
+def signals():
+    '''Registers the simple signals used by the editor models.'''
+    pytest.importorskip("svglib")
+    pytest.importorskip("simplesignals")
+    import paperdoll
+    paperdoll.init_signals()
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+'''Checks the frame atlas format and that baked frames match the animations.
+
+The doll files are copied to a temporary directory, because atlases are
+written next to their description files.
+'''
+
+
+# --------------------------------------------------------------------------- #
+# Import libraries
+# --------------------------------------------------------------------------- #
+import json
+import shutil
+import struct
+
+import pytest
+
+from conftest import dolldir
+
+
+# --------------------------------------------------------------------------- #
+# Define functions
+# --------------------------------------------------------------------------- #
+def coordinates(frame):
+    '''Returns the stored coordinates of a frame with their types.'''
+    import geometry
+    return [(type(point.x), point.x, type(point.y), point.y)
+            for geomelem in geometry.geometry_elements(frame)
+            for cmd in geomelem.commands for point in cmd.parameters]
+
+
+# --------------------------------------------------------------------------- #
+# Define tests
+# --------------------------------------------------------------------------- #
+@pytest.fixture
+def baked(signals, tmp_path):
+    '''Returns an editor for a copy of the doll files and its atlases.'''
+    import atlas
+    import model
+    tmpdolldir = tmp_path / "dollfiles"
+    shutil.copytree(str(dolldir), str(tmpdolldir))
+    editor = model.MPaperdollEditor(tmpdolldir, cache=False)
+    model.editor = editor
+    paths = [atlas.bake(descfile) for descfile in editor.dollfiles.values()]
+    paths = [path for path in paths if path is not None]
+    assert paths
+    yield editor, paths
+    editor.disconnect_signals()
+
+
+def test_header_and_alignment(baked):
+    import atlas
+    editor, paths = baked
+    for path in paths:
+        data = path.read_bytes()
+        assert data[:len(atlas.magic)] == atlas.magic
+        headersize, = struct.unpack_from("<I", data, len(atlas.magic))
+        start = len(atlas.magic) + 4
+        header = json.loads(data[start:start + headersize].decode("utf-8"))
+        assert header["sources"]["version"] == atlas.format_version
+        datastart = atlas.data_offset(headersize)
+        assert datastart % 8 == 0
+        values = (len(data) - datastart) // 8
+        for entry in header["animations"].values():
+            assert set(entry) == {"first", "last", "count", "offset",
+                                  "exact"}
+            frames = entry["last"] - entry["first"] + 1
+            assert entry["offset"] + frames * entry["count"] <= values
+
+
+def test_frames_match_the_animations(baked):
+    import atlas
+    import geometry
+    editor, paths = baked
+    for descfile in editor.dollfiles.values():
+        frameatlas = atlas.load(descfile)
+        if frameatlas is None:
+            continue
+        assert frameatlas.is_current(descfile)
+        for name, entry in frameatlas.entries.items():
+            anim = descfile.animations[name]
+            for state in range(entry["first"], entry["last"] + 1):
+                expected = anim.get_frame(state)
+                frame = frameatlas.frame(name, state, anim)
+                assert geometry.flat_points(frame) == \
+                    geometry.flat_points(expected)
+                if entry["exact"]:
+                    # the coordinates keep their numeric type and value
+                    assert coordinates(frame) == coordinates(expected)
+        frameatlas.close()
+
+
+def test_changed_files_outdate_the_atlas(baked):
+    import atlas
+    editor, paths = baked
+    descfile = next(descfile for descfile in editor.dollfiles.values()
+                    if atlas.atlas_path(descfile) in paths)
+    svgpaths = sorted(descfile.path.parent.glob("*.svg"))
+    with svgpaths[0].open("a") as f:
+        f.write("\n")
+    assert atlas.load(descfile) is None
+
+
+def atlas_bytes(entries, values):
+    '''Returns the bytes of an atlas with a header and float64 values.'''
+    import sys
+    import atlas
+    header = json.dumps({"byteorder": sys.byteorder, "sources": {},
+                         "animations": entries}).encode("utf-8")
+    data = atlas.magic + struct.pack("<I", len(header)) + header
+    data += bytes(atlas.data_offset(len(header)) - len(data))
+    return data + struct.pack("=%sd" % values, *range(values))
+
+
+@pytest.mark.parametrize("corrupt", [
+    lambda data: b"",
+    lambda data: data[:10],
+    lambda data: data[:-3],
+    lambda data: data[:-8],
+    lambda data: data.replace(b"animations", b"animatiXns")])
+def test_corrupt_atlases_are_ignored(tmp_path, corrupt):
+    import types
+    pytest.importorskip("svglib")
+    import atlas
+    entries = {"anim": {"first": 0, "last": 1, "count": 4, "offset": 0,
+                        "exact": True}}
+    descfile = types.SimpleNamespace(path=tmp_path / "doll.xml")
+    path = atlas.atlas_path(descfile)
+    path.write_bytes(corrupt(atlas_bytes(entries, 8)))
+    assert atlas.load(descfile) is None
+
+
+def test_intact_test_atlas_opens(tmp_path):
+    pytest.importorskip("svglib")
+    import atlas
+    entries = {"anim": {"first": 0, "last": 1, "count": 4, "offset": 0,
+                        "exact": True}}
+    path = tmp_path / "doll.atlas"
+    path.write_bytes(atlas_bytes(entries, 8))
+    frameatlas = atlas.FrameAtlas(path)
+    assert list(frameatlas.points("anim", 1)) == [4.0, 5.0, 6.0, 7.0]
+    frameatlas.close()
+
+
+def test_closing_the_editor_unmaps_its_atlases(baked):
+    import model
+    editor, paths = baked
+    reopened = model.MPaperdollEditor(paths[0].parent, cache=False)
+    frameatlases = list(reopened.atlasfiles)
+    assert frameatlases
+    reopened.close()
+    assert reopened.atlases == {}
+    for frameatlas in frameatlases:
+        assert frameatlas.mmap.closed
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+'''Checks the headless batch rendering.'''
+
+
+# --------------------------------------------------------------------------- #
+# Import libraries
+# --------------------------------------------------------------------------- #
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from conftest import dolldir
+
+
+# --------------------------------------------------------------------------- #
+# Define tests
+# --------------------------------------------------------------------------- #
+def test_spawned_workers_use_the_editor_options(signals, monkeypatch):
+    import batch
+    import model
+    monkeypatch.setattr(batch, "worker_editor", None)
+    monkeypatch.setattr(model, "editor", None)
+    batch.init_worker(str(dolldir), {"numeric": "float", "cache": False,
+                                     "compiled": False})
+    try:
+        assert batch.worker_editor.numeric == "float"
+        assert not batch.worker_editor.cache
+        assert not batch.worker_editor.compiled
+    finally:
+        batch.worker_editor.disconnect_signals()
+
+
+@pytest.fixture(scope="module")
+def rendered(signals, tmp_path_factory):
+    '''Returns an editor, its states and the files render_states wrote.'''
+    import batch
+    import benchmark
+    import model
+    editor = model.MPaperdollEditor(dolldir, cache=False)
+    states = [{}] + benchmark.random_states(editor, 4, seed=2)
+    outdir = tmp_path_factory.mktemp("rendered")
+    paths = batch.render_states(editor, states, outdir)
+    yield editor, states, paths
+    editor.close()
+
+
+def test_render_states_writes_one_file_per_state_in_order(rendered,
+                                                          tmp_path):
+    import batch
+    editor, states, paths = rendered
+    assert [path.name for path in paths] == ["doll_%05d.svg" % number
+                                             for number in range(len(states))]
+    assert sorted(paths[0].parent.iterdir()) == paths
+    for number, path in enumerate(paths):
+        ET.parse(str(path))
+        # each file is the drawing of the state with the same number
+        single = batch.render_states(editor, [states[number]], tmp_path,
+                                     pattern="single.svg")
+        assert single[0].read_bytes() == path.read_bytes()
+    assert len({path.read_bytes() for path in paths}) > 1
+
+
+def test_render_pool_keeps_the_order_of_states(rendered, tmp_path):
+    import batch
+    editor, states, paths = rendered
+    poolpaths, report = batch.render_pool(editor, states, tmp_path,
+                                          processes=2, dolldir=dolldir,
+                                          chunksize=1)
+    assert poolpaths == [tmp_path / path.name for path in paths]
+    assert report["count"] == len(states)
+    for poolpath, path in zip(poolpaths, paths):
+        assert poolpath.read_bytes() == path.read_bytes()
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+'''Checks that compiled conform maps conform like the svglib deltas.'''
+
+
+# --------------------------------------------------------------------------- #
+# Import libraries
+# --------------------------------------------------------------------------- #
+import pytest
+
+numpy = pytest.importorskip("numpy")
+pytest.importorskip("svglib")
+
+import geometry
+
+from conftest import dolldir
+
+
+# --------------------------------------------------------------------------- #
+# Define classes
+# --------------------------------------------------------------------------- #
+class FunctionDelta(object):
+    '''A delta that maps every target coordinate with a function.'''
+    def __init__(self, function):
+        self.function = function
+
+    def conform(self, elemid, targetelem):
+        elem = targetelem.copy()
+        geometry.set_flat_points(elem, [
+            self.function(value)
+            for value in geometry.flat_points(targetelem)])
+        return elem
+
+
+class ResizingDelta(object):
+    '''A delta whose probes conform to another number of points.'''
+    def __init__(self, other):
+        self.other = other
+        self.calls = 0
+
+    def conform(self, elemid, targetelem):
+        self.calls += 1
+        if self.calls == 1:
+            return targetelem.copy()
+        return self.other.copy()
+
+
+# --------------------------------------------------------------------------- #
+# Define tests
+# --------------------------------------------------------------------------- #
+@pytest.fixture(scope="module")
+def editor(signals):
+    import model
+    editor = model.MPaperdollEditor(dolldir, cache=False)
+    model.editor = editor
+    editor.draw(incremental=False)  # loads the frames conforming targets
+    return editor
+
+
+@pytest.fixture(scope="module")
+def conforming(editor):
+    '''Returns (elemid, delta, target) of all conforming doll paths.'''
+    found = []
+    for geomelem in editor.geometry.values():
+        for elem in geometry.geometry_elements(geomelem):
+            delta = getattr(elem, "delta", None)
+            if delta is not None:
+                target = editor.get_geometry(delta.trgtelem.connectivity)
+                found.append((elem.elemid, delta, target))
+    assert found
+    return found
+
+
+def displaced(elem, seed):
+    '''Returns a copy of elem with all points moved at random.'''
+    values = numpy.array(geometry.flat_points(elem))
+    rng = numpy.random.RandomState(seed)
+    elem = elem.copy()
+    geometry.set_flat_points(elem, (values + rng.uniform(-5, 5, len(values)))
+                             .tolist())
+    return elem
+
+
+def test_maps_match_the_deltas(conforming):
+    linear = 0
+    for elemid, delta, target in conforming:
+        conformmap = geometry.ConformMap(elemid, delta, target)
+        for probe in (target, displaced(target, 1)):
+            expected = geometry.flat_points(delta.conform(elemid, probe))
+            actual = geometry.flat_points(conformmap.conform(probe))
+            assert numpy.allclose(actual, expected, rtol=0.0, atol=1e-6)
+        linear += conformmap.linear
+    assert linear  # the doll deltas are compiled, not only delegated
+
+
+def test_linear_delta_is_compiled(conforming):
+    elemid, delta, target = conforming[0]
+    conformmap = geometry.ConformMap(elemid, FunctionDelta(
+        lambda value: 2 * value + 1), target)
+    assert conformmap.linear
+    # one weight per coordinate
+    assert len(conformmap) == len(geometry.flat_points(target))
+
+
+def test_nonlinear_delta_falls_back(conforming):
+    elemid, delta, target = conforming[0]
+    square = FunctionDelta(lambda value: value * value)
+    conformmap = geometry.ConformMap(elemid, square, target)
+    assert not conformmap.linear
+    probe = displaced(target, 2)
+    assert geometry.flat_points(conformmap.conform(probe)) == \
+        geometry.flat_points(square.conform(elemid, probe))
+
+
+def test_other_point_counts_fall_back(conforming):
+    sizes = {len(geometry.flat_points(target)): target
+             for elemid, delta, target in conforming}
+    if len(sizes) < 2:
+        pytest.skip("all conform targets have the same number of points")
+    (size, target), (othersize, other) = list(sizes.items())[:2]
+    shift = FunctionDelta(lambda value: value + 3)
+    conformmap = geometry.ConformMap("shifted", shift, target)
+    assert conformmap.linear
+    assert geometry.flat_points(conformmap.conform(other)) == \
+        geometry.flat_points(shift.conform("shifted", other))
+
+
+def test_resizing_delta_falls_back(conforming):
+    sizes = {len(geometry.flat_points(target)): target
+             for elemid, delta, target in conforming}
+    if len(sizes) < 2:
+        pytest.skip("all conform targets have the same number of points")
+    (size, target), (othersize, other) = list(sizes.items())[:2]
+    resizing = ResizingDelta(other)
+    conformmap = geometry.ConformMap("resized", resizing, target)
+    assert not conformmap.linear and len(conformmap) == 0
+    assert geometry.flat_points(conformmap.conform(target)) == \
+        geometry.flat_points(other)
+
+
+def test_maps_are_compiled_at_startup(signals, tmp_path):
+    import shutil
+    import model
+    tmpdolldir = tmp_path / "dollfiles"
+    shutil.copytree(str(dolldir), str(tmpdolldir))
+    for attempt in ("parsed", "cached"):
+        editor = model.MPaperdollEditor(tmpdolldir, cache=True)
+        model.editor = editor
+        try:
+            compiled = dict(editor.conformmaps)
+            assert compiled
+            # the maps keep referring to the deltas of the loaded paths
+            for geomelem in editor.geometry.values():
+                for elem in geometry.geometry_elements(geomelem):
+                    delta = getattr(elem, "delta", None)
+                    if delta is not None and elem.elemid in compiled:
+                        assert compiled[elem.elemid].delta is delta
+            editor.draw(incremental=False)
+            assert editor.conformmaps == compiled  # nothing compiled late
+        finally:
+            editor.disconnect_signals()
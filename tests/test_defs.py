@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+'''Checks that drawings only get the definitions their styles reference.'''
+
+
+# --------------------------------------------------------------------------- #
+# Import libraries
+# --------------------------------------------------------------------------- #
+import collections
+import types
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from conftest import dolldir
+
+
+# --------------------------------------------------------------------------- #
+# Define functions
+# --------------------------------------------------------------------------- #
+def defs_editor():
+    '''Returns a stand-in editor with linked and unused definitions.'''
+    defs = collections.OrderedDict()
+    for defid, attrib in [
+            ("base", {}),
+            ("shade", {"href": "#base"}),
+            ("glow", {"fill": "url(#shade)"}),
+            ("blur", {}),
+            ("unused", {"href": "#blur"})]:
+        defs[defid] = ET.Element("linearGradient", dict(attrib, id=defid))
+    return types.SimpleNamespace(defs=defs, defscache={})
+
+
+def def_ids(xmldefselem):
+    return [defelem.get("id") for defelem in xmldefselem]
+
+
+# --------------------------------------------------------------------------- #
+# Define tests
+# --------------------------------------------------------------------------- #
+def test_attribute_ids(signals):
+    import model
+    assert model.attribute_ids("url(#shade)") == ["shade"]
+    assert model.attribute_ids("url( #shade )") == ["shade"]
+    assert model.attribute_ids("#base") == ["base"]
+    assert model.attribute_ids("red") == []
+
+
+def test_only_url_references_are_collected(signals):
+    import model
+    elem = types.SimpleNamespace(
+        style="fill:url(#glow);stroke:#blur",
+        xmlattrib={"filter": "url(#blur)", "href": "#unused"})
+    assert model.referenced_ids(elem) == {"glow", "blur"}
+
+
+def test_shared_defs_follow_links_between_definitions(signals):
+    import model
+    editor = defs_editor()
+    xmldefselem = model.MPaperdollEditor.shared_defs(editor, {"glow"})
+    # in the order of the definitions, without unreferenced ones
+    assert def_ids(xmldefselem) == ["base", "shade", "glow"]
+    xmldefselem = model.MPaperdollEditor.shared_defs(editor,
+                                                     {"blur", "missing"})
+    assert def_ids(xmldefselem) == ["blur"]
+    assert def_ids(model.MPaperdollEditor.shared_defs(editor, set())) == []
+
+
+def test_shared_defs_change_with_the_referenced_ids(signals):
+    import model
+    editor = defs_editor()
+    first = model.MPaperdollEditor.shared_defs(editor, {"shade"})
+    assert model.MPaperdollEditor.shared_defs(editor, {"shade"}) is first
+    second = model.MPaperdollEditor.shared_defs(editor, {"shade", "blur"})
+    assert second is not first
+    assert def_ids(second) == ["base", "shade", "blur"]
+    # the cached element of the first set is unchanged
+    assert def_ids(first) == ["base", "shade"]
+    assert model.MPaperdollEditor.shared_defs(editor, {"shade"}) is first
+
+
+def test_drawings_contain_the_referenced_defs(signals):
+    import model
+    import svglib
+    editor = model.MPaperdollEditor(dolldir, cache=False)
+    try:
+        svgdoc = editor.draw(incremental=False)
+        emitted = set(def_ids(svgdoc.defs))
+        referenced = set().union(*[editor.layerrefs[idx] for idx in
+                                   range(len(editor.layers))])
+        referenced &= set(editor.defs)
+        assert referenced <= emitted <= set(editor.defs)
+        assert emitted == set(def_ids(editor.shared_defs(referenced)))
+        unused = [defid for defid in editor.defs if defid not in emitted]
+        if not unused:
+            pytest.skip("the doll files use all of their definitions")
+        # a style referencing another definition adds it to the drawing
+        layerelem = editor.layerelems[0]
+        style = svglib.Style("filter:url(#%s)" % unused[0])
+        svgdoc = editor.draw(incremental=False,
+                             styles={layerelem.elemid: style})
+        assert unused[0] in def_ids(svgdoc.defs)
+        svgdoc = editor.draw(incremental=False, styles={})
+        assert set(def_ids(svgdoc.defs)) == emitted
+    finally:
+        editor.close()
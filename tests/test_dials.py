@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+'''Checks that the dial engine maps dial values to animation states.'''
+
+
+# --------------------------------------------------------------------------- #
+# Import libraries
+# --------------------------------------------------------------------------- #
+import types
+
+import pytest
+
+pytest.importorskip("svglib")
+pytest.importorskip("simplesignals")
+
+import geometry
+import model
+
+
+# --------------------------------------------------------------------------- #
+# Define functions
+# --------------------------------------------------------------------------- #
+def dial(minimum=1, maximum=100, **animations):
+    '''Returns a dial controlling animations given as (min, init, max).'''
+    dialmodel = types.SimpleNamespace(minimum=minimum, maximum=maximum,
+                                      animations={})
+    for name, (animmin, initial, animmax) in animations.items():
+        model.MDial.add_animation(dialmodel, name, animmin, initial, animmax)
+    return dialmodel
+
+
+# --------------------------------------------------------------------------- #
+# Define tests
+# --------------------------------------------------------------------------- #
+@pytest.fixture(params=["numpy", "lists"])
+def engine_type(request, monkeypatch):
+    '''Runs a test with the NumPy matrices and with nested lists.'''
+    if request.param == "numpy":
+        monkeypatch.setattr(geometry, "numpy", pytest.importorskip("numpy"))
+    else:
+        monkeypatch.setattr(geometry, "numpy", None)
+    return model.DialEngine
+
+
+def test_values_follow_the_states(engine_type):
+    engine = engine_type({"d": dial(a=(0, 0, 99))})
+    assert engine.values({"a": 0}) == {"d": 0}
+    assert engine.values({"a": 50}) == {"d": 50}
+    assert engine.values({"a": 99}) == {"d": 99}
+
+
+def test_apply_moves_and_clamps(engine_type):
+    engine = engine_type({"d": dial(a=(0, 0, 99), b=(10, 10, 20))})
+    state = {"a": 0, "b": 10}
+    changed = engine.apply({"d": 51}, state)
+    assert changed["a"] > 0 and changed["b"] > 10
+    state.update(changed)
+    state.update(engine.apply({"d": 1000}, state))
+    assert state == {"a": 99, "b": 20}
+    # an unchanged value changes nothing
+    assert engine.apply({"d": engine.values(state)["d"]}, state) == {}
+
+
+def test_unmoved_dials_follow_shared_animations(engine_type):
+    engine = engine_type({"d1": dial(a=(0, 0, 99)),
+                          "d2": dial(a=(0, 0, 99))})
+    state = {"a": 0}
+    state.update(engine.apply({"d1": 50}, state))
+    assert state == {"a": 50}
+    # d2 continues from the state d1 left, not from its initial value
+    state.update(engine.apply({"d2": 60}, state))
+    assert state == {"a": 60}
+
+
+def test_follow_and_reset(engine_type):
+    engine = engine_type({"d": dial(a=(0, 0, 99))})
+    state = {"a": 30}
+    engine.follow("a", 0, 30)
+    assert engine.apply({"d": 40}, state) == {"a": 40}
+    engine.reset({"a": 0})
+    assert engine.apply({"d": 10}, {"a": 0}) == {"a": 10}
+
+
+def test_dials_belong_to_their_editor(signals):
+    from conftest import dolldir
+    first = model.MPaperdollEditor(dolldir, cache=False)
+    second = model.MPaperdollEditor(dolldir, cache=False)
+    try:
+        dialname = sorted(first.dials)[0]
+        dial = first.dials[dialname]
+        start = dial.value
+        before = second.dials[dialname].value
+        dial.change_value(dial.maximum if start != dial.maximum
+                          else dial.minimum)
+        assert dial.value != start
+        # the other editor and its dials did not move
+        assert second.dials[dialname].value == before
+        assert second.state == {animname: anim.default_state for animname,
+                                anim in second.animations.items()}
+    finally:
+        first.disconnect_signals()
+        second.disconnect_signals()
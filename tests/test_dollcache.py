@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+'''Checks that the compiled doll cache is only used while it is current.
+
+The cached content here are plain dictionaries in a temporary doll
+directory, so the tests do not depend on the doll files.
+'''
+
+
+# --------------------------------------------------------------------------- #
+# Import libraries
+# --------------------------------------------------------------------------- #
+import logging
+
+import pytest
+
+
+# --------------------------------------------------------------------------- #
+# Define tests
+# --------------------------------------------------------------------------- #
+@pytest.fixture
+def cached(tmp_path):
+    '''Returns the dollcache module and the paths of a cached doll.'''
+    pytest.importorskip("svglib")
+    import dollcache
+    descpaths = []
+    for name in ("body", "head"):
+        descpath = tmp_path / (name + ".xml")
+        descpath.write_text("<description name='%s'/>" % name)
+        descpath.with_suffix(".svg").write_text("<svg id='%s'/>" % name)
+        descpaths.append(descpath)
+    dollfiles = {"body.xml": {"elements": ["torso"]},
+                 "head.xml": {"elements": ["face"]}}
+    assert dollcache.save(tmp_path, descpaths, dollfiles, {"torso": 1})
+    return dollcache, tmp_path, descpaths
+
+
+def test_current_cache_is_loaded(cached):
+    dollcache, dolldir, descpaths = cached
+    content = dollcache.load(dolldir, descpaths)
+    assert content == {"dollfiles": {"body.xml": {"elements": ["torso"]},
+                                     "head.xml": {"elements": ["face"]}},
+                       "conformmaps": {"torso": 1}}
+
+
+@pytest.mark.parametrize("suffix", [".xml", ".svg"])
+def test_changed_source_files_outdate_the_cache(cached, suffix):
+    dollcache, dolldir, descpaths = cached
+    path = descpaths[1].with_suffix(suffix)
+    path.write_text(path.read_text() + "\n<!-- changed -->")
+    assert dollcache.load(dolldir, descpaths) is None
+
+
+def test_other_description_files_outdate_the_cache(cached):
+    dollcache, dolldir, descpaths = cached
+    assert dollcache.load(dolldir, descpaths[:1]) is None
+
+
+def test_changed_svglib_outdates_the_cache(cached, monkeypatch):
+    dollcache, dolldir, descpaths = cached
+    library = dict(dollcache.library_signature())
+    library["svglib_sha1"] = "0" * 40
+    monkeypatch.setattr(dollcache, "library", library)
+    assert dollcache.load(dolldir, descpaths) is None
+
+
+def test_other_cache_version_outdates_the_cache(cached, monkeypatch):
+    dollcache, dolldir, descpaths = cached
+    monkeypatch.setattr(dollcache, "cache_version",
+                        dollcache.cache_version + 1)
+    assert dollcache.load(dolldir, descpaths) is None
+
+
+def test_corrupt_cache_is_ignored(cached, caplog):
+    dollcache, dolldir, descpaths = cached
+    path = dollcache.cache_path(dolldir)
+    path.write_bytes(path.read_bytes()[:-5])
+    with caplog.at_level(logging.WARNING, logger="dollcache"):
+        assert dollcache.load(dolldir, descpaths) is None
+    assert "was ignored" in caplog.text
+
+
+def test_unpicklable_files_are_not_cached(cached, caplog):
+    dollcache, dolldir, descpaths = cached
+    path = dollcache.cache_path(dolldir)
+    path.unlink()
+    dollfiles = {"body.xml": {"convert": lambda value: value}}
+    with caplog.at_level(logging.WARNING, logger="dollcache"):
+        assert dollcache.save(dolldir, descpaths, dollfiles) is None
+    assert "cannot be cached" in caplog.text
+    assert not path.exists()
+    assert dollcache.load(dolldir, descpaths) is None
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+'''Checks that doll state records survive writing and reading.'''
+
+
+# --------------------------------------------------------------------------- #
+# Import libraries
+# --------------------------------------------------------------------------- #
+import io
+
+import pytest
+
+pytest.importorskip("svglib")
+
+import dollstate
+
+
+# --------------------------------------------------------------------------- #
+# Define tests
+# --------------------------------------------------------------------------- #
+records = [
+    {"state": [1, 50, -3], "styles": {}},
+    {"state": [0, 2**31 - 1, -2**31],
+     "styles": {"torso": "fill:#ff0000;stroke:none", "äpfel": ""}}]
+
+
+@pytest.mark.parametrize("record", records)
+def test_codec_round_trip(record):
+    codec = dollstate.RecordCodec(["a", "b", "c"])
+    assert codec.decode(codec.encode(record)) == record
+
+
+def test_codec_rejects_trailing_bytes():
+    codec = dollstate.RecordCodec(["a", "b", "c"])
+    with pytest.raises(ValueError):
+        codec.decode(codec.encode(records[0]) + b"\0")
+
+
+def test_file_round_trip():
+    f = io.BytesIO()
+    writer = dollstate.RecordWriter(f, ["a", "b", "c"])
+    for record in records:
+        writer.write(record)
+    f.seek(0)
+    reader = dollstate.RecordReader(f)
+    assert reader.animations == ["a", "b", "c"]
+    assert list(reader) == records
+
+
+def test_truncated_file():
+    f = io.BytesIO()
+    dollstate.RecordWriter(f, ["a"]).write({"state": [1], "styles": {}})
+    f = io.BytesIO(f.getvalue()[:-1])
+    with pytest.raises(ValueError):
+        list(dollstate.RecordReader(f))
+
+
+def test_shard_path():
+    assert dollstate.shard_path("dolls.tar.gz", "tar.gz", 3) == \
+        "dolls_0003.tar.gz"
+    assert dollstate.shard_path("dolls", "zip", 0) == "dolls_0000"
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+'''Checks the least recently used cache of animation frames.'''
+
+
+# --------------------------------------------------------------------------- #
+# Import libraries
+# --------------------------------------------------------------------------- #
+import types
+
+import pytest
+
+pytest.importorskip("svglib")
+pytest.importorskip("simplesignals")
+
+import model
+
+from conftest import dolldir
+
+
+# --------------------------------------------------------------------------- #
+# Define functions
+# --------------------------------------------------------------------------- #
+def frame(points):
+    '''Returns a path-like frame with the given number of points.'''
+    command = types.SimpleNamespace(parameters=[None] * points)
+    return types.SimpleNamespace(commands=[command])
+
+
+# --------------------------------------------------------------------------- #
+# Define tests
+# --------------------------------------------------------------------------- #
+def test_hits_and_misses():
+    cache = model.FrameCache()
+    assert cache.get((1,)) is None
+    first = frame(3)
+    cache.put((1,), first)
+    assert cache.get((1,)) is first
+    assert cache.stats == {"hits": 1, "misses": 1, "frames": 1, "points": 3}
+
+
+def test_least_recently_used_frames_are_dropped():
+    cache = model.FrameCache(maxpoints=10)
+    for state in range(3):
+        cache.put((state,), frame(4))
+    # the budget holds two frames; the oldest one was dropped
+    assert len(cache) == 2 and cache.points == 8
+    assert cache.get((0,)) is None
+    cache.get((1,))  # state 2 is now the least recently used frame
+    cache.put((3,), frame(4))
+    assert cache.get((2,)) is None
+    assert cache.get((1,)) is not None
+
+
+def test_oversized_frames_are_kept_alone():
+    cache = model.FrameCache(maxpoints=5)
+    cache.put((0,), frame(2))
+    cache.put((1,), frame(50))
+    assert len(cache) == 1 and cache.get((1,)) is not None
+
+
+def test_replacing_a_frame_updates_the_budget():
+    cache = model.FrameCache()
+    cache.put((0,), frame(2))
+    cache.put((0,), frame(5))
+    assert len(cache) == 1 and cache.points == 5
+    cache.clear()
+    assert len(cache) == 0 and cache.points == 0
+
+
+def test_editor_reuses_frames(signals):
+    editor = model.MPaperdollEditor(dolldir, cache=False)
+    model.editor = editor
+    try:
+        name = sorted(editor.animations)[0]
+        first = editor.animation_frame(name)
+        hits = editor.frame_cache_stats()[name]["hits"]
+        assert editor.animation_frame(name) is first
+        assert editor.frame_cache_stats()[name]["hits"] == hits + 1
+    finally:
+        editor.disconnect_signals()
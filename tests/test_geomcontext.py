@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+'''Checks that each draw resolves conformed geometry once and in order.'''
+
+
+# --------------------------------------------------------------------------- #
+# Import libraries
+# --------------------------------------------------------------------------- #
+import types
+
+import pytest
+
+pytest.importorskip("svglib")
+pytest.importorskip("simplesignals")
+
+import model
+
+from conftest import dolldir
+
+
+# --------------------------------------------------------------------------- #
+# Define functions
+# --------------------------------------------------------------------------- #
+def conforming(target):
+    '''Returns an element whose delta targets the element target.'''
+    trgtelem = types.SimpleNamespace(connectivity=target)
+    return types.SimpleNamespace(delta=types.SimpleNamespace(
+        trgtelem=trgtelem))
+
+
+def context(geometry):
+    '''Returns a context for a stand-in editor that records conforming.'''
+    calls = []
+
+    def conform(elemid, delta, targetelem):
+        calls.append((elemid, targetelem))
+        return ("conformed", elemid)
+    editor = types.SimpleNamespace(geometry=geometry, dollgeometry={},
+                                   conform=conform)
+    return model.GeometryContext(editor), calls
+
+
+def coordinates(elem):
+    '''Returns the coordinates of the geometry elements in elem.'''
+    import geometry
+    return [(type(point.x), point.x, type(point.y), point.y)
+            for geomelem in geometry.geometry_elements(elem)
+            for cmd in geomelem.commands for point in cmd.parameters]
+
+
+# --------------------------------------------------------------------------- #
+# Define tests
+# --------------------------------------------------------------------------- #
+def test_targets_are_resolved_first_and_once():
+    body = types.SimpleNamespace()
+    geomcontext, calls = context({"body": body, "shirt": conforming("body"),
+                                  "coat": conforming("shirt")})
+    assert geomcontext.resolve("coat") == ("conformed", "coat")
+    assert calls == [("shirt", body), ("coat", ("conformed", "shirt"))]
+    assert geomcontext.resolve("shirt") == ("conformed", "shirt")
+    assert len(calls) == 2
+    assert geomcontext.stats == {"geometry_hits": 1, "geometry_misses": 3}
+
+
+def test_cycles_raise_value_error():
+    geomcontext, calls = context({"a": conforming("b"),
+                                  "b": conforming("c"),
+                                  "c": conforming("a")})
+    with pytest.raises(ValueError, match="a -> b -> c -> a"):
+        geomcontext.resolve("a")
+    assert calls == []
+    assert geomcontext.resolving == []
+    # a failed resolution is not remembered
+    with pytest.raises(ValueError, match="b -> c -> a -> b"):
+        geomcontext.resolve("b")
+
+
+@pytest.fixture
+def editor(signals):
+    editor = model.MPaperdollEditor(dolldir, cache=False)
+    yield editor
+    editor.close()
+
+
+def stage_counts(editor):
+    return {record["name"]: record["counts"]
+            for record in editor.draw_profile["phases"]}
+
+
+def test_stages_report_their_own_counters(editor):
+    keys = ("geometry_hits", "geometry_misses", "conform_calls")
+    editor.draw(incremental=False)
+    phases = stage_counts(editor)
+    assert phases["layers"]["reused"] == 0
+    assert sum(phases[stage][key] for stage in ("outlines", "layers")
+               for key in keys[1:]) > 0
+    # without changes no layer is drawn, so the layers stage neither
+    # resolves nor conforms anything, whatever the outlines stage did
+    editor.draw()
+    phases = stage_counts(editor)
+    assert phases["layers"]["drawn"] == 0
+    for key in keys:
+        assert phases["layers"][key] == 0
+        assert phases["outlines"][key] >= 0
+
+
+def test_drawing_does_not_modify_resolved_elements(editor, monkeypatch):
+    resolved = {}
+    resolve = model.GeometryContext.resolve
+
+    def recording_resolve(geomcontext, geomid, geomelem=None):
+        elem = resolve(geomcontext, geomid, geomelem)
+        if geomid not in resolved:
+            resolved[geomid] = (elem, coordinates(elem))
+        return elem
+    monkeypatch.setattr(model.GeometryContext, "resolve", recording_resolve)
+    editor.draw(incremental=False)
+    assert resolved
+    for geomid, (elem, before) in resolved.items():
+        # skeleton posing and rounding only change the layer copies
+        assert coordinates(elem) == before, geomid
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+'''Checks that incremental draws write the same SVG as full draws.
+
+Incremental draws reuse cached layers, so a wrong dependency between an
+animation and a layer, a posed layer or a conform target shows up as a
+difference to a full draw of the same state.
+'''
+
+
+# --------------------------------------------------------------------------- #
+# Import libraries
+# --------------------------------------------------------------------------- #
+import random
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from conftest import dolldir
+
+
+# --------------------------------------------------------------------------- #
+# Define functions
+# --------------------------------------------------------------------------- #
+def animation_ranges(editor):
+    '''Returns the keyframe range of every animation with keyframes.'''
+    import atlas
+    ranges = {}
+    for descfile in editor.dollfiles.values():
+        for name in descfile.animations:
+            staterange = atlas.keyframe_range(descfile, name)
+            if staterange is not None and name in editor.animations:
+                ranges[name] = staterange
+    return ranges
+
+
+def sweep(ranges, count, seed=0):
+    '''Returns state changes moving one, then several animations at once.'''
+    rng = random.Random(seed)
+    names = sorted(ranges)
+    changes = [{name: ranges[name][1]} for name in names]
+    changes += [{name: rng.randint(*ranges[name])
+                 for name in rng.sample(names, min(3, len(names)))}
+                for _ in range(count)]
+    return changes
+
+
+# --------------------------------------------------------------------------- #
+# Define tests
+# --------------------------------------------------------------------------- #
+def test_incremental_draws_match_full_draws(signals):
+    import model
+    incremental = model.MPaperdollEditor(dolldir, cache=False)
+    full = model.MPaperdollEditor(dolldir, cache=False)
+    try:
+        ranges = animation_ranges(incremental)
+        # the sweep covers skeleton rotations and conform targets
+        assert any(name.startswith("rotate_") for name in ranges)
+        incremental.draw()
+        assert any(deps["targets"]
+                   for deps in incremental.dependents.values())
+        for number, change in enumerate(sweep(ranges, 20)):
+            for editor in (incremental, full):
+                editor.set_states(change)
+            expected = ET.tostring(
+                full.draw(incremental=False).to_xml())
+            actual = ET.tostring(incremental.draw().to_xml())
+            assert actual == expected, "change %s: %s" % (number, change)
+    finally:
+        incremental.disconnect_signals()
+        full.disconnect_signals()
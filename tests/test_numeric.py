@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+'''Checks that the numeric modes draw the reference SVG.
+
+The reference editor draws with svglib alone, i.e. with Decimal coordinates
+and without frame atlases and conform maps.
+'''
+
+
+# --------------------------------------------------------------------------- #
+# Import libraries
+# --------------------------------------------------------------------------- #
+import pytest
+
+from conftest import dolldir
+
+
+# --------------------------------------------------------------------------- #
+# Define tests
+# --------------------------------------------------------------------------- #
+@pytest.fixture(scope="module")
+def states(signals):
+    import benchmark
+    import model
+    editor = model.MPaperdollEditor(dolldir, cache=False)
+    model.editor = editor
+    return [{}] + benchmark.random_states(editor, 5, seed=1)
+
+
+def test_both_modes_draw_the_reference(states):
+    import batch
+    assert batch.compare_numeric(dolldir, states, cache=False) == []
+
+
+def test_float_mode_converts_deltas_and_keyframes(signals):
+    from decimal import Decimal
+    import geometry
+    import model
+    editor = model.MPaperdollEditor(dolldir, numeric="float", cache=False)
+    model.editor = editor
+    # a second pass finds no Decimal left anywhere in the loaded files
+    assert all(geometry.convert_numbers(descfile, float) == 0
+               for descfile in editor.dollfiles.values())
+    frame = editor.animation_frame(sorted(editor.animations)[0])
+    for elem in geometry.geometry_elements(frame):
+        for cmd in elem.commands:
+            for point in cmd.parameters:
+                assert not isinstance(point.x, Decimal)
+                assert not isinstance(point.y, Decimal)
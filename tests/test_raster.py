@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+'''Checks the PNG thumbnails written next to rendered SVG files.'''
+
+
+# --------------------------------------------------------------------------- #
+# Import libraries
+# --------------------------------------------------------------------------- #
+import pytest
+
+pytest.importorskip("PyQt5.QtSvg")
+
+import raster
+from PyQt5 import QtGui
+
+from conftest import dolldir
+
+
+# --------------------------------------------------------------------------- #
+# Define functions
+# --------------------------------------------------------------------------- #
+def image_size(path):
+    '''Returns the width and height of an image file.'''
+    image = QtGui.QImage(str(path))
+    assert not image.isNull(), path
+    return image.width(), image.height()
+
+
+# --------------------------------------------------------------------------- #
+# Define tests
+# --------------------------------------------------------------------------- #
+def test_parse_sizes():
+    assert raster.parse_sizes("256, 64,64") == [64, 256]
+    with pytest.raises(ValueError):
+        raster.parse_sizes("0,64")
+    with pytest.raises(ValueError):
+        raster.parse_sizes(" , ")
+
+
+def test_thumbnails_fit_the_longer_edge(tmp_path):
+    svgbytes = (b'<svg xmlns="http://www.w3.org/2000/svg" width="300" '
+                b'height="600" viewBox="0 0 300 600">'
+                b'<rect width="300" height="600" fill="red"/></svg>')
+    svgpath = tmp_path / "doll_00001.svg"
+    paths = raster.save_images(svgbytes, [64, 256], svgpath)
+    assert [path.name for path in paths] == ["doll_00001_64.png",
+                                             "doll_00001_256.png"]
+    assert image_size(paths[0]) == (32, 64)
+    assert image_size(paths[1]) == (128, 256)
+
+
+def test_invalid_svg_raises_value_error(tmp_path):
+    with pytest.raises(ValueError):
+        raster.save_images(b"<svg", [64], tmp_path / "doll.svg")
+
+
+def test_render_states_writes_thumbnails(signals, tmp_path):
+    import batch
+    import model
+    editor = model.MPaperdollEditor(dolldir, cache=False)
+    try:
+        paths = batch.render_states(editor, [{}, {}], tmp_path,
+                                    pngsizes=[48, 96])
+    finally:
+        editor.close()
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "doll_00000.svg", "doll_00000_48.png", "doll_00000_96.png",
+        "doll_00001.svg", "doll_00001_48.png", "doll_00001_96.png"]
+    for path in paths:
+        # the drawings are 600 by 800 units
+        assert image_size(path.with_name(path.stem + "_48.png")) == (36, 48)
+        assert image_size(path.with_name(path.stem + "_96.png")) == (72, 96)
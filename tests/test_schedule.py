@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+'''Checks that the draw schedule coalesces state changes into redraws.'''
+
+
+# --------------------------------------------------------------------------- #
+# Import libraries
+# --------------------------------------------------------------------------- #
+import pytest
+
+QtCore = pytest.importorskip("PyQt5.QtCore")
+
+
+# --------------------------------------------------------------------------- #
+# Define tests
+# --------------------------------------------------------------------------- #
+@pytest.fixture
+def schedule(signals):
+    '''Returns a DrawSchedule and the list of draws it requested.'''
+    import simplesignals as sisi
+    app = QtCore.QCoreApplication.instance()
+    if app is None:
+        app = QtCore.QCoreApplication([])
+    import view
+    requests = []
+
+    def on__draw_doll():
+        requests.append(True)
+
+    schedule = view.DrawSchedule(delay=10)
+    sisi.connect(on__draw_doll, signal="draw doll")
+    yield schedule, requests
+    sisi.disconnect(on__draw_doll, signal="draw doll")
+    sisi.disconnect(schedule.on__state_changed, signal="state changed",
+                    channel="editor")
+    sisi.disconnect(schedule.on__doll_drawn, signal="doll drawn")
+    schedule.timer.stop()
+
+
+def change_state(value):
+    import simplesignals as sisi
+    sisi.send(signal="state changed", channel="editor",
+              data={"anim": {"old": value - 1, "new": value}})
+
+
+def fire(schedule):
+    '''Runs the timeout of the schedule without an event loop.'''
+    assert schedule.timer.isActive()
+    schedule.timer.stop()
+    schedule.attempt_redraw()
+
+
+def test_changes_are_coalesced(schedule):
+    import simplesignals as sisi
+    schedule, requests = schedule
+    for value in range(1, 4):
+        change_state(value)
+    assert schedule.dropped == 2
+    fire(schedule)
+    assert len(requests) == 1 and schedule.drawing
+    # no new draw starts while the last one is not delivered
+    change_state(4)
+    change_state(5)
+    assert not schedule.timer.isActive()
+    schedule.attempt_redraw()
+    assert len(requests) == 1
+    sisi.send(signal="doll drawn", data=object())
+    assert schedule.frames == 1 and not schedule.drawing
+    fire(schedule)
+    assert len(requests) == 2
+
+
+def test_failed_draws_release_the_schedule(schedule):
+    import simplesignals as sisi
+    schedule, requests = schedule
+    change_state(1)
+    fire(schedule)
+    sisi.send(signal="doll drawn", data=None)
+    assert not schedule.drawing and schedule.frames == 0
+    change_state(2)
+    fire(schedule)
+    assert len(requests) == 2
+
+
+def test_interval_follows_the_draw_time(schedule):
+    schedule, requests = schedule
+    assert schedule.interval == 10
+    schedule.drawtime = 250.0
+    assert schedule.interval == 250
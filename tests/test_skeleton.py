@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+'''Checks the bone hierarchy and the forward kinematics of the skeleton.'''
+
+
+# --------------------------------------------------------------------------- #
+# Import libraries
+# --------------------------------------------------------------------------- #
+import logging
+import math
+
+import pytest
+
+pytest.importorskip("svglib")
+
+import skeleton
+
+
+# --------------------------------------------------------------------------- #
+# Define classes
+# --------------------------------------------------------------------------- #
+class Animation(object):
+    '''An animation whose frames are rotate commands.'''
+    def __init__(self, commands):
+        self.commands = commands
+
+    def get_command(self, state):
+        return self.commands[state]
+
+
+# --------------------------------------------------------------------------- #
+# Define tests
+# --------------------------------------------------------------------------- #
+bones = {"upper_arm_bone_l": ["shoulder_l", "elbow_l"],
+         "lower_arm_bone_l": ["elbow_l", "wrist_l"],
+         "hand_bone_l": ["wrist_l", "fingers_l"],
+         "upper_arm_bone_r": ["shoulder_r", "elbow_r"],
+         "lower_arm_bone_r": ["elbow_r", "wrist_r"]}
+
+
+def test_parents_come_before_children():
+    bonetree = skeleton.Skeleton(bones, {})
+    assert bonetree.parents["hand_bone_l"] == "lower_arm_bone_l"
+    assert bonetree.parents["upper_arm_bone_l"] is None
+    order = bonetree.bones
+    assert sorted(order) == sorted(bones)
+    for bonename, parent in bonetree.parents.items():
+        if parent is not None:
+            assert order.index(parent) < order.index(bonename)
+
+
+def test_cycles_are_rejected():
+    with pytest.raises(ValueError, match="cycle"):
+        skeleton.Skeleton({"a": ["x", "y"], "b": ["y", "x"]}, {})
+
+
+def test_only_animated_bones_are_posed():
+    bonetree = skeleton.Skeleton(bones, {"rotate_lower_arm_bone_l"})
+    assert bonetree.animated == {"lower_arm_bone_l", "hand_bone_l"}
+    assert bonetree.elements() == {"lower_arm_bone_l", "lower_arm_l",
+                                   "hand_bone_l", "hand_l"}
+
+
+def test_children_follow_their_parents():
+    animations = {"rotate_upper_arm_bone_l": Animation(["rotate(90 0,0)"]),
+                  "rotate_lower_arm_bone_l": Animation(["rotate(90 1,0)"])}
+    bonetree = skeleton.Skeleton(bones, animations)
+    state = {animname: 0 for animname in animations}
+    matrices = bonetree.pose(state, animations)
+    expected = skeleton.multiply(skeleton.rotation(90),
+                                 skeleton.rotation(90, 1, 0))
+    assert matrices["hand_bone_l"] == expected
+    assert matrices["upper_arm_bone_r"] == skeleton.identity
+    # the point (2, 0) turns by 90 degrees twice
+    x, y = (sum(row[k] * value for k, value in enumerate((2.0, 0.0, 1.0)))
+            for row in expected[:2])
+    assert math.isclose(x, -1.0, abs_tol=1e-9)
+    assert math.isclose(y, 1.0, abs_tol=1e-9)
+
+
+def test_rotation_parameters(caplog):
+    assert skeleton.rotation_parameters("rotate(30 1,2)") == (30.0, 1.0, 2.0)
+    assert skeleton.rotation_parameters("rotate(-5)") == (-5.0, 0.0, 0.0)
+    with caplog.at_level(logging.WARNING):
+        assert skeleton.rotation_parameters("translate(3,4)") == \
+            (0.0, 0.0, 0.0)
+    assert "not a rotate command" in caplog.text
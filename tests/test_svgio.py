@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+'''Checks that streamed documents parse like whole serialized documents.'''
+
+
+# --------------------------------------------------------------------------- #
+# Import libraries
+# --------------------------------------------------------------------------- #
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from conftest import dolldir
+
+
+# --------------------------------------------------------------------------- #
+# Define tests
+# --------------------------------------------------------------------------- #
+@pytest.fixture(scope="module")
+def editor(signals):
+    import model
+    editor = model.MPaperdollEditor(dolldir, cache=False)
+    model.editor = editor
+    return editor
+
+
+def test_streamed_document_parses_like_whole_document(editor):
+    import svgio
+    svgdoc = editor.draw(incremental=False)
+    whole = ET.tostring(svgdoc.to_xml())
+    cache = svgio.ChunkCache()
+    streamed = svgio.document_bytes(svgdoc, editor.layerelems, cache)
+    assert ET.canonicalize(streamed) == ET.canonicalize(whole)
+    # cached chunks give the same bytes
+    assert svgio.document_bytes(svgdoc, editor.layerelems, cache) == streamed
+
+
+def test_layers_do_not_declare_namespaces(editor):
+    import svgio
+    svgdoc = editor.draw(incremental=False)
+    for layerelem in editor.layerelems:
+        data, pairs = svgio.layer_chunk(layerelem)
+        assert b"xmlns" not in data
+        document = svgio.layer_document(svgdoc, layerelem)
+        ET.fromstring(document)  # every used prefix is declared